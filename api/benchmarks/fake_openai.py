@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for benchmarking without spending tokens.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with a
+configurable time to first token, token rate and answer length, and can reject
+a share of calls with 429s to exercise the scheduler's retries. Point the app
+at it with OPENAI_BASE_URL=http://127.0.0.1:8101/v1.
+
+    python benchmarks/fake_openai.py --port 8101 --ttft 0.4 --tokens-per-second 60
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Answer template; the citation and Devanagari exercise the citation extractor
+ANSWER_HEAD = [
+    "##",
+    "The",
+    "question",
+    "in",
+    "context\n\n",
+    "As",
+    "the",
+    "Bhagavad",
+    "Gita",
+    "(Chapter",
+    "2,",
+    "Verse",
+    "47)",
+    "teaches:\n",
+    "कर्मण्येवाधिकारस्ते",
+    "मा",
+    "फलेषु",
+    "कदाचन\n\n",
+]
+FILLER = (
+    "dharma karma yoga atman brahman the and of to a in is that practice wisdom "
+    "path devotion knowledge action duty self truth"
+).split()
+
+
+def create_app(
+    ttft: float,
+    tokens_per_second: float,
+    answer_tokens: int,
+    error_rate: float,
+    cached_share: float,
+) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(7)
+
+    def answer_words(n: int):
+        words = list(ANSWER_HEAD)
+        while len(words) < n:
+            words.append(rng.choice(FILLER))
+        return words[: max(n, len(ANSWER_HEAD))]
+
+    def usage(messages, completion_tokens: int):
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        cached = int(prompt_tokens * cached_share) // 128 * 128
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def rate_limited():
+        return JSONResponse(
+            {
+                "error": {
+                    "message": "Rate limit reached",
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }
+            },
+            status_code=429,
+            headers={"retry-after-ms": "500"},
+        )
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if error_rate and rng.random() < error_rate:
+            return rate_limited()
+
+        model = body.get("model", "gpt-4o")
+        n = min(answer_tokens, body.get("max_tokens") or answer_tokens)
+        words = answer_words(n)
+        completion_id = f"chatcmpl-{rng.getrandbits(64):x}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + len(words) / tokens_per_second)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage(body["messages"], len(words)),
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def events():
+            def chunk(delta, finish_reason=None, **extra):
+                return (
+                    "data: "
+                    + json.dumps(
+                        {
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": created,
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": delta,
+                                    "finish_reason": finish_reason,
+                                }
+                            ]
+                            if delta is not None
+                            else [],
+                            **extra,
+                        }
+                    )
+                    + "\n\n"
+                )
+
+            await asyncio.sleep(ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(words):
+                yield chunk({"content": word if i == 0 else " " + word})
+                await asyncio.sleep(1 / tokens_per_second)
+            yield chunk({}, "stop")
+            if include_usage:
+                yield chunk(None, usage=usage(body["messages"], len(words)))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions") or 1536
+        data = []
+        for i, text in enumerate(inputs):
+            # Same text, same vector, so semantic cache hits are reproducible
+            seed = int.from_bytes(
+                hashlib.sha256(str(text).encode()).digest()[:4], "little"
+            )
+            vector = np.random.default_rng(seed).standard_normal(dimensions)
+            data.append(
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": (vector / np.linalg.norm(vector)).tolist(),
+                }
+            )
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument(
+        "--ttft", type=float, default=0.4, help="seconds before the first token"
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of calls answered with 429"
+    )
+    parser.add_argument(
+        "--cached-share",
+        type=float,
+        default=0.5,
+        help="share of prompt tokens reported as served from the prompt cache",
+    )
+    args = parser.parse_args()
+
+    app = create_app(
+        args.ttft,
+        args.tokens_per_second,
+        args.answer_tokens,
+        args.error_rate,
+        args.cached_share,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
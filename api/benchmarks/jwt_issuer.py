@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Issue Supabase-style access tokens for benchmark users.
+
+The app verifies HS256 tokens locally against SUPABASE_JWT_SECRET, so tokens
+signed here with the same secret authenticate without Supabase.
+
+    python benchmarks/jwt_issuer.py --secret bench-secret --users 3
+"""
+
+import argparse
+import time
+import uuid
+from typing import List
+
+import jwt
+
+AUDIENCE = "authenticated"
+
+
+def issue_token(user_id: str, email: str, secret: str, ttl: float = 3600) -> str:
+    """A signed access token with the claims the app reads (sub, email, aud, exp)."""
+    now = int(time.time())
+    claims = {
+        "sub": user_id,
+        "email": email,
+        "aud": AUDIENCE,
+        "role": "authenticated",
+        "iat": now,
+        "exp": now + int(ttl),
+    }
+    return jwt.encode(claims, secret, algorithm="HS256")
+
+
+def issue_tokens(count: int, secret: str, ttl: float = 3600) -> List[str]:
+    """Tokens for ``count`` distinct users."""
+    tokens = []
+    for i in range(count):
+        user_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"bench-user-{i}"))
+        tokens.append(issue_token(user_id, f"bench{i}@example.com", secret, ttl))
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--ttl", type=float, default=3600)
+    args = parser.parse_args()
+
+    for token in issue_tokens(args.users, args.secret, args.ttl):
+        print(token)
+
+
+if __name__ == "__main__":
+    main()
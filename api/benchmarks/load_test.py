@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Load-test the API offline against a fake OpenAI and locally issued JWTs.
+
+Starts benchmarks/fake_openai.py and the app under uvicorn (SQLite by default,
+or any DATABASE_URL such as a local Postgres), seeds a conversation per user,
+then sends an open-loop Poisson mix of ask / stream / list / fetch requests at
+the target rate. Reports p50/p95/p99 latency, throughput, errors and SQL
+statements per request (from /api/metrics), and can save the results as a
+baseline and compare later runs against it. SQLite runs need aiosqlite, from
+the dev dependency group (uv sync --group dev); tiktoken's encoding must
+already be cached for a fully offline run. Runs with several workers disable
+the message write queue, which only supports a single worker.
+
+    python benchmarks/load_test.py --rps 20 --duration 60 --users 50
+    python benchmarks/load_test.py --workers 4 \
+        --database-url postgresql://localhost/nara_bench
+    python benchmarks/load_test.py --output baseline.json
+    python benchmarks/load_test.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+from jwt_issuer import issue_tokens  # benchmarks/ is on sys.path when run as a script
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# For create_schema, which imports the app's models
+sys.path.insert(0, API_DIR)
+
+JWT_SECRET = "nara-benchmark-secret-not-for-production"
+# create_client only checks that the service key looks like a JWT
+SUPABASE_SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+# Operation -> endpoint function, as labelled in /api/metrics
+ENDPOINTS = {
+    "ask": "ask_question",
+    "ask_stream": "ask_question_stream",
+    "list": "get_all_conversations",
+    "messages": "get_all_messages",
+    "new": "create_new_conversation",
+}
+DEFAULT_MIX = "ask=0.15,ask_stream=0.15,list=0.35,messages=0.3,new=0.05"
+
+QUESTIONS = [
+    "What is dharma?",
+    "What does the Bhagavad Gita say about karma yoga?",
+    "How should I meditate every morning?",
+    "What is the meaning of om?",
+    "Tell me the story of Prahlada",
+    "What is the difference between atman and brahman?",
+    "How do I perform a simple puja at home?",
+    "What is my duty when my family disagrees with me?",
+    "Translate the first verse of the Isha Upanishad",
+    "What does Advaita Vedanta teach about the self?",
+    "Why is Ganesha worshipped first?",
+    "How can I let go of attachment to results?",
+]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        op, weight = item.split("=")
+        if op not in ENDPOINTS:
+            raise ValueError(f"Unknown operation in mix: {op}")
+        mix[op] = float(weight)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def create_schema(database_url: str) -> None:
+    # Tables only; a Postgres database migrated with alembic is left as it is
+    os.environ["DATABASE_URL"] = database_url
+    from database import models  # noqa: F401  (registers the tables)
+    from utils.database import Base
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=API_DIR, env=env)
+
+
+async def wait_until_ready(
+    client: httpx.AsyncClient,
+    url: str,
+    processes: List[subprocess.Popen],
+    timeout: float = 60,
+) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if any(process.poll() is not None for process in processes):
+            raise RuntimeError(f"A benchmark process exited before {url} came up")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+        await asyncio.sleep(0.25)
+
+
+async def scrape(
+    client: httpx.AsyncClient, app_url: str
+) -> Dict[str, Dict[str, float]]:
+    """Statements and request counts per endpoint from /api/metrics."""
+    counts = {"statements": defaultdict(float), "requests": defaultdict(float)}
+    text = (await client.get(f"{app_url}/api/metrics")).text
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == "nara_db_statements_total":
+                counts["statements"][sample.labels["endpoint"]] += sample.value
+            elif sample.name == "nara_http_request_seconds_count":
+                counts["requests"][sample.labels["endpoint"]] += sample.value
+    return counts
+
+
+class LoadTest:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        app_url: str,
+        tokens: List[str],
+        mix: Dict[str, float],
+        seed: int,
+    ):
+        self.client = client
+        self.app_url = app_url
+        self.users = [
+            {"headers": {"Authorization": f"Bearer {token}"}, "conversations": []}
+            for token in tokens
+        ]
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.rng = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def seed(self) -> None:
+        """Give every user a conversation with one answered question."""
+
+        async def seed_user(user):
+            await self.new_conversation(user)
+            await self.ask(user)
+
+        await asyncio.gather(*(seed_user(user) for user in self.users))
+
+    async def new_conversation(self, user) -> None:
+        response = await self.client.post(
+            f"{self.app_url}/api/createnewconversation",
+            json={"question": self.rng.choice(QUESTIONS)},
+            headers=user["headers"],
+        )
+        response.raise_for_status()
+        user["conversations"].append(response.json()["id"])
+
+    async def ask(self, user) -> None:
+        response = await self.client.post(
+            f"{self.app_url}/api/ask",
+            json={
+                "question": self.rng.choice(QUESTIONS),
+                "conversation_id": user["conversations"][-1],
+            },
+            headers=user["headers"],
+        )
+        response.raise_for_status()
+
+    async def ask_stream(self, user) -> float:
+        """Returns the time to the first streamed delta."""
+        started = time.perf_counter()
+        first_delta = None
+        async with self.client.stream(
+            "POST",
+            f"{self.app_url}/api/ask/stream",
+            json={
+                "question": self.rng.choice(QUESTIONS),
+                "conversation_id": user["conversations"][-1],
+            },
+            headers=user["headers"],
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line == "event: delta" and first_delta is None:
+                    first_delta = time.perf_counter() - started
+                elif line == "event: error":
+                    raise RuntimeError("stream ended with an error event")
+        return first_delta if first_delta is not None else time.perf_counter() - started
+
+    async def list_conversations(self, user) -> None:
+        response = await self.client.get(
+            f"{self.app_url}/api/conversations", headers=user["headers"]
+        )
+        response.raise_for_status()
+
+    async def fetch_messages(self, user) -> None:
+        conversation_id = self.rng.choice(user["conversations"])
+        response = await self.client.get(
+            f"{self.app_url}/api/conversations/{conversation_id}/messages",
+            headers=user["headers"],
+        )
+        response.raise_for_status()
+
+    async def run_one(self, op: str) -> None:
+        user = self.rng.choice(self.users)
+        started = time.perf_counter()
+        try:
+            if op == "ask":
+                await self.ask(user)
+            elif op == "ask_stream":
+                self.latencies["ask_stream_ttfb"].append(await self.ask_stream(user))
+            elif op == "list":
+                await self.list_conversations(user)
+            elif op == "messages":
+                await self.fetch_messages(user)
+            elif op == "new":
+                await self.new_conversation(user)
+        except (httpx.HTTPError, RuntimeError) as e:
+            self.errors[op] += 1
+            if self.errors[op] <= 3:
+                print(f"{op} failed: {str(e)}")
+            return
+        self.latencies[op].append(time.perf_counter() - started)
+
+    async def run(self, rps: float, duration: float) -> float:
+        """Open-loop arrivals for ``duration`` seconds.
+
+        Returns the wall time until all requests finished.
+        """
+        tasks = []
+        started = time.perf_counter()
+        next_arrival = started
+        while next_arrival - started < duration:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            op = self.rng.choices(self.ops, self.weights)[0]
+            tasks.append(asyncio.create_task(self.run_one(op)))
+            next_arrival += self.rng.expovariate(rps)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+def summarize(test: LoadTest, elapsed: float, before: Dict, after: Dict) -> Dict:
+    results = {"elapsed_seconds": elapsed, "operations": {}}
+    completed = 0
+    for op in list(ENDPOINTS) + ["ask_stream_ttfb"]:
+        values = sorted(test.latencies.get(op, []))
+        if not values and not test.errors.get(op):
+            continue
+        entry = {
+            "count": len(values),
+            "errors": test.errors.get(op, 0),
+            "p50_ms": None if not values else percentile(values, 50) * 1000,
+            "p95_ms": None if not values else percentile(values, 95) * 1000,
+            "p99_ms": None if not values else percentile(values, 99) * 1000,
+        }
+        endpoint = ENDPOINTS.get(op)
+        if endpoint is not None:
+            completed += len(values)
+            requests = after["requests"][endpoint] - before["requests"][endpoint]
+            statements = after["statements"][endpoint] - before["statements"][endpoint]
+            entry["statements_per_request"] = (
+                statements / requests if requests else None
+            )
+        results["operations"][op] = entry
+
+    results["throughput_rps"] = completed / elapsed
+    results["background_statements"] = (
+        after["statements"]["background"] - before["statements"]["background"]
+    )
+    return results
+
+
+def report(results: Dict, baseline: Optional[Dict], tolerance: float) -> bool:
+    """Print the results table.
+
+    Returns False if any p95 regressed beyond ``tolerance``.
+    """
+
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    print(
+        f"\n{'operation':<16}{'count':>7}{'errors':>7}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'stmts/req':>11}"
+    )
+    ok = True
+    for op, entry in results["operations"].items():
+        statements = entry.get("statements_per_request")
+        per_request = "-" if statements is None else f"{statements:.2f}"
+        line = (
+            f"{op:<16}{entry['count']:>7}{entry['errors']:>7}"
+            f"{ms(entry['p50_ms']):>10}{ms(entry['p95_ms']):>10}"
+            f"{ms(entry['p99_ms']):>10}{per_request:>11}"
+        )
+        previous = (baseline or {}).get("operations", {}).get(op)
+        if previous and previous.get("p95_ms") and entry["p95_ms"]:
+            change = entry["p95_ms"] / previous["p95_ms"] - 1
+            line += f"   p95 {change:+.0%} vs baseline"
+            if change > tolerance:
+                line += "  REGRESSION"
+                ok = False
+        print(line)
+    print(
+        f"\nthroughput {results['throughput_rps']:.1f} req/s "
+        f"over {results['elapsed_seconds']:.1f}s, "
+        f"{results['background_statements']:.0f} background statements "
+        "(queued message writes)"
+    )
+    return ok
+
+
+async def main_async(args) -> bool:
+    workdir = tempfile.mkdtemp(prefix="nara-bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    app_url = args.app_url or f"http://127.0.0.1:{args.port}"
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+
+    processes = []
+    try:
+        if not args.app_url:
+            create_schema(database_url)
+            env = dict(os.environ)
+            env.update(
+                OPENAI_API_KEY="benchmark",
+                OPENAI_BASE_URL=f"{fake_url}/v1",
+                SUPABASE_URL="http://127.0.0.1:9",
+                SUPABASE_SERVICE_KEY=SUPABASE_SERVICE_KEY,
+                SUPABASE_JWT_SECRET=JWT_SECRET,
+                DATABASE_URL=database_url,
+                DB_PROFILE="production",
+                MESSAGE_SPOOL_PATH=os.path.join(workdir, "message_spool.jsonl"),
+                RESPONSE_CACHE_PATH=os.path.join(workdir, "response_cache.db"),
+            )
+            if args.workers > 1:
+                os.makedirs(os.path.join(workdir, "metrics"))
+                env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(workdir, "metrics")
+                # The write-behind queue needs a single worker for read-your-writes
+                env["MESSAGE_QUEUE_ENABLED"] = "false"
+            for item in args.env:
+                key, value = item.split("=", 1)
+                env[key] = value
+
+            processes.append(
+                start_process(
+                    [
+                        sys.executable,
+                        os.path.join("benchmarks", "fake_openai.py"),
+                        "--port",
+                        str(args.fake_port),
+                        "--ttft",
+                        str(args.ttft),
+                        "--tokens-per-second",
+                        str(args.tokens_per_second),
+                        "--answer-tokens",
+                        str(args.answer_tokens),
+                        "--error-rate",
+                        str(args.error_rate),
+                    ],
+                    env,
+                )
+            )
+            processes.append(
+                start_process(
+                    [
+                        sys.executable,
+                        "-m",
+                        "uvicorn",
+                        "main:app",
+                        "--port",
+                        str(args.port),
+                        "--workers",
+                        str(args.workers),
+                        "--log-level",
+                        "warning",
+                        "--no-access-log",
+                    ],
+                    env,
+                )
+            )
+
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+            if not args.app_url:
+                await wait_until_ready(client, f"{fake_url}/openapi.json", processes)
+            await wait_until_ready(client, f"{app_url}/api/health", processes)
+
+            test = LoadTest(
+                client,
+                app_url,
+                issue_tokens(args.users, args.jwt_secret or JWT_SECRET),
+                parse_mix(args.mix),
+                args.seed,
+            )
+            print(f"Seeding {args.users} users...")
+            await test.seed()
+
+            before = await scrape(client, app_url)
+            print(f"Running {args.rps} req/s for {args.duration}s against {app_url}...")
+            elapsed = await test.run(args.rps, args.duration)
+            # Let queued message writes land before counting background statements
+            await asyncio.sleep(1)
+            after = await scrape(client, app_url)
+
+        results = summarize(test, elapsed, before, after)
+        results["config"] = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("baseline", "output")
+        }
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        ok = report(results, baseline, args.tolerance)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Saved results to {args.output}")
+        return ok
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--app-url", help="benchmark an already running app instead of starting one"
+    )
+    parser.add_argument(
+        "--jwt-secret", help="SUPABASE_JWT_SECRET of the app given by --app-url"
+    )
+    parser.add_argument(
+        "--env", action="append", default=[], help="extra KEY=VALUE for the app"
+    )
+    parser.add_argument("--fake-port", type=int, default=8101)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="compare p95 latencies with a saved run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed p95 increase over the baseline",
+    )
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
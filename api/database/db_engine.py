@@ -1,5 +1,15 @@
-from typing import List, Dict
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from database import models
+from database.user_cache import user_id_cache
 
 
 def get_conversation_context(
@@ -22,52 +32,246 @@ def get_conversation_context(
     return context
 
 
-def get_or_create_user(db, user_id: str, email: str) -> models.User:
-    """Get existing user or create new one."""
-    user = db.query(models.User).filter(models.User.supabase_id == user_id).first()
-    if not user:
-        user = models.User(supabase_id=user_id, email=email)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
-
-
-def get_or_create_conversation(
-    db, user_question: str, user_id: str, user_email: str, conversation_id: int = None
-) -> models.Conversation:
-    """Get active conversation or create new one."""
-    user = get_or_create_user(db, user_id, user_email)
-    conversation = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.user_id == user.id)
-        .filter(models.Conversation.id == conversation_id)
-        .first()
+def _insert(db: AsyncSession, model):
+    """INSERT construct for the session's dialect, with ON CONFLICT support."""
+    if db.bind.dialect.name == "sqlite":
+        return sqlite_insert(model)
+    return postgresql_insert(model)
+
+
+async def upsert_user(db: AsyncSession, user_id: str, email: str) -> int:
+    """Insert the user if needed and return users.id, in a single statement.
+
+    Known users are answered from the user id cache without touching the
+    database. Does not commit; the caller owns the transaction and caches the
+    id once it has committed.
+    """
+    db_user_id = await user_id_cache.get(user_id)
+    if db_user_id is not None:
+        return db_user_id
+
+    stmt = _insert(db, models.User).values(supabase_id=user_id, email=email)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.User.supabase_id],
+        set_={"email": stmt.excluded.email},
+    ).returning(models.User.id)
+    result = await db.execute(stmt)
+    return result.scalar_one()
+
+
+async def resolve_user_id(db: AsyncSession, user_id: str) -> Optional[int]:
+    """Map a Supabase user id to users.id, or None if the user doesn't exist yet."""
+    db_user_id = await user_id_cache.get(user_id)
+    if db_user_id is not None:
+        return db_user_id
+
+    result = await db.execute(
+        select(models.User.id).filter(models.User.supabase_id == user_id)
+    )
+    db_user_id = result.scalar_one_or_none()
+    if db_user_id is not None:
+        await user_id_cache.set(user_id, db_user_id)
+    return db_user_id
+
+
+async def create_conversation(
+    db: AsyncSession, user_id: str, user_email: str, title: Optional[str] = None
+) -> Tuple[int, str]:
+    """Create a conversation for the user in one transaction.
+
+    Returns (conversation_id, title); the title falls back to the column default.
+    """
+    db_user_id = await upsert_user(db, user_id, user_email)
+    values = {"user_id": db_user_id}
+    if title is not None:
+        values["title"] = title
+    result = await db.execute(
+        insert(models.Conversation)
+        .values(**values)
+        .returning(models.Conversation.id, models.Conversation.title)
     )
+    row = result.one()
+    await db.commit()
+    await user_id_cache.set(user_id, db_user_id)
+    return row.id, row.title
 
-    if not conversation:
-        conversation = models.Conversation(user_id=user.id, title=f"{user_question}")
 
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
+async def get_conversation(
+    db: AsyncSession, user_id: str, conversation_id: Optional[int]
+) -> Optional[models.Conversation]:
+    """Return the conversation if it exists and belongs to the user."""
+    if conversation_id is None:
+        return None
 
-    return conversation
+    db_user_id = await resolve_user_id(db, user_id)
+    if db_user_id is None:
+        return None
 
+    result = await db.execute(
+        select(models.Conversation)
+        .filter(models.Conversation.user_id == db_user_id)
+        .filter(models.Conversation.id == conversation_id)
+    )
+    return result.scalars().first()
 
-def store_message(
-    db,
-    conversation_id: int,
+
+async def store_message(
+    db: AsyncSession,
+    conversation_id: Optional[int],
     user_message: str,
     assistant_message: str,
-):
-    """Store a message in the database."""
-    message = models.Message(
-        conversation_id=conversation_id,
-        user_message=user_message,
-        assistant_message=assistant_message,
+    user_id: str = None,
+    user_email: str = None,
+    route: Optional[str] = None,
+) -> Tuple[int, int]:
+    """Store a message in the database in a single transaction.
+
+    When ``conversation_id`` is None the user is upserted and a new conversation
+    titled with the question is created first. ``route`` names the model route
+    that produced the answer. Returns (conversation_id, message_id).
+    """
+    db_user_id = None
+    if conversation_id is None:
+        db_user_id = await upsert_user(db, user_id, user_email)
+        result = await db.execute(
+            insert(models.Conversation)
+            .values(user_id=db_user_id, title=f"{user_message}")
+            .returning(models.Conversation.id)
+        )
+        conversation_id = result.scalar_one()
+
+    result = await db.execute(
+        insert(models.Message)
+        .values(
+            conversation_id=conversation_id,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            route=route,
+        )
+        .returning(models.Message.id)
+    )
+    message_id = result.scalar_one()
+    await db.commit()
+    if db_user_id is not None:
+        await user_id_cache.set(user_id, db_user_id)
+    return conversation_id, message_id
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    """Encode a keyset position as an opaque URL-safe cursor."""
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor from encode_cursor, raising ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _keyset(db: AsyncSession, timestamp_column, id_column, cursor: Optional[str]):
+    """The (timestamp, id) keyset to order by, and its position at ``cursor``.
+
+    SQLite keeps timestamps as text in two formats: "YYYY-MM-DD HH:MM:SS" from
+    CURRENT_TIMESTAMP defaults, and with microseconds when SQLAlchemy writes or
+    binds a datetime. Compared as text the two misorder within a second, so on
+    SQLite the column and the cursor both go through strftime, which reads either
+    format into the same one. Ordering and comparing by the same expression keeps
+    the pages consistent.
+    """
+
+    def normalized(timestamp):
+        if db.get_bind().dialect.name == "sqlite":
+            return func.strftime("%Y-%m-%d %H:%M:%f", timestamp)
+        return timestamp
+
+    position = None
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        position = tuple_(normalized(literal(timestamp, timestamp_column.type)), row_id)
+    return (normalized(timestamp_column), id_column), position
+
+
+async def list_conversations(
+    db: AsyncSession,
+    supabase_id: str,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Page through a user's conversations, most recently updated first.
+
+    Returns the page and the cursor for the next page (None on the last page).
+    A limit of None returns every remaining conversation.
+    """
+    db_user_id = await resolve_user_id(db, supabase_id)
+    if db_user_id is None:
+        return [], None
+
+    query = select(
+        models.Conversation.id,
+        models.Conversation.title,
+        models.Conversation.updated_at,
+    ).filter(models.Conversation.user_id == db_user_id)
+    keyset, position = _keyset(
+        db, models.Conversation.updated_at, models.Conversation.id, cursor
     )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-    return message
+    if position is not None:
+        query = query.filter(tuple_(*keyset) < position)
+
+    query = query.order_by(*(column.desc() for column in keyset))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+
+    return [{"id": row.id, "title": row.title} for row in rows], next_cursor
+
+
+async def list_messages(
+    db: AsyncSession,
+    conversation_id: int,
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str]]:
+    """Page backwards through a conversation's messages, newest page first.
+
+    Each page is in chronological order. The returned cursor fetches the page of
+    older messages before it (None once the start of the conversation is reached).
+    A limit of None returns every remaining message.
+    """
+    query = select(
+        models.Message.id,
+        models.Message.user_message,
+        models.Message.assistant_message,
+        models.Message.created_at,
+    ).filter(models.Message.conversation_id == conversation_id)
+    keyset, position = _keyset(db, models.Message.created_at, models.Message.id, cursor)
+    if position is not None:
+        query = query.filter(tuple_(*keyset) < position)
+
+    query = query.order_by(*(column.desc() for column in keyset))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = (await db.execute(query)).all()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return [
+        {
+            "id": row.id,
+            "user": row.user_message,
+            "assistant": row.assistant_message,
+        }
+        for row in reversed(rows)
+    ], next_cursor
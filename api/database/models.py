@@ -1,10 +1,24 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
-from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime, timezone
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+)
 from sqlalchemy.orm import relationship
-from datetime import datetime
-from utils.database import Base
 from sqlalchemy.sql import func
 
+from utils.database import Base
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -20,20 +34,38 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Sidebar listing: a user's conversations, most recently updated first
+        Index("ix_conversations_user_id_updated_at", "user_id", "updated_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     title = Column(String(255), default="New Conversation")
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user = relationship("User", back_populates="conversations")
     messages = relationship(
-        "Message", back_populates="conversation", cascade="all, delete-orphan"
+        "Message",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        passive_deletes=True,  # Let the ON DELETE CASCADE remove messages
     )
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # History loads: a conversation's messages in creation order
+        Index(
+            "ix_messages_conversation_id_created_at",
+            "conversation_id",
+            "created_at",
+            "id",
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(
@@ -42,6 +74,12 @@ class Message(Base):
     user_message = Column(Text)
     assistant_message = Column(Text)
     response_liked = Column(Boolean, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Name of the services.routing route that produced the answer
+    route = Column(String(50), nullable=True)
+    # Stamped by the app on every write path (store_message and the write
+    # queue), so the history order never mixes app and database clocks
+    created_at = Column(
+        DateTime(timezone=True), default=utcnow, server_default=func.now()
+    )
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     conversation = relationship("Conversation", back_populates="messages")
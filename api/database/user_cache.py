@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Set
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from database import models
+
+load_dotenv()
+
+# Entries in the per-process supabase_id -> users.id cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+# Optional Redis URL so every worker shares the mapping (requires the redis package)
+USER_CACHE_REDIS_URL = os.getenv("USER_CACHE_REDIS_URL")
+USER_CACHE_REDIS_PREFIX = os.getenv("USER_CACHE_REDIS_PREFIX", "nara:user-id:")
+
+# Keep references to in-flight invalidation tasks so they are not garbage collected
+_invalidation_tasks: Set[asyncio.Task] = set()
+
+
+class RedisUserIdBackend:
+    """Shared mapping stored in Redis, consulted after a local cache miss."""
+
+    def __init__(self, url: str, prefix: str = USER_CACHE_REDIS_PREFIX):
+        import redis.asyncio as redis
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, supabase_id: str) -> Optional[int]:
+        value = await self._redis.get(self.prefix + supabase_id)
+        return int(value) if value is not None else None
+
+    async def set(self, supabase_id: str, user_id: int) -> None:
+        await self._redis.set(self.prefix + supabase_id, user_id)
+
+    async def delete(self, supabase_id: str) -> None:
+        await self._redis.delete(self.prefix + supabase_id)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class UserIdCache:
+    """Bounded LRU cache mapping Supabase user ids to users.id.
+
+    The mapping never changes once a user row exists, so entries only leave the
+    cache through LRU eviction or an explicit invalidation when the user is
+    deleted.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, backend=None):
+        self.maxsize = maxsize
+        self.backend = backend
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_local(self, supabase_id: str) -> Optional[int]:
+        with self._lock:
+            user_id = self._entries.get(supabase_id)
+            if user_id is not None:
+                self._entries.move_to_end(supabase_id)
+            return user_id
+
+    def _set_local(self, supabase_id: str, user_id: int) -> None:
+        with self._lock:
+            self._entries[supabase_id] = user_id
+            self._entries.move_to_end(supabase_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def get(self, supabase_id: str) -> Optional[int]:
+        user_id = self._get_local(supabase_id)
+        if user_id is None and self.backend is not None:
+            try:
+                user_id = await self.backend.get(supabase_id)
+            except Exception as e:
+                print(f"Error reading shared user id cache: {str(e)}")
+                return None
+            if user_id is not None:
+                self._set_local(supabase_id, user_id)
+        return user_id
+
+    async def set(self, supabase_id: str, user_id: int) -> None:
+        self._set_local(supabase_id, user_id)
+        if self.backend is not None:
+            try:
+                await self.backend.set(supabase_id, user_id)
+            except Exception as e:
+                print(f"Error writing shared user id cache: {str(e)}")
+
+    def invalidate(self, supabase_id: str) -> None:
+        """Forget a user locally, and in the shared backend if there is one."""
+        with self._lock:
+            self._entries.pop(supabase_id, None)
+
+        if self.backend is not None:
+            try:
+                task = asyncio.get_running_loop().create_task(
+                    self.backend.delete(supabase_id)
+                )
+            except RuntimeError:
+                print(
+                    "No event loop to invalidate shared user id cache "
+                    f"for {supabase_id}"
+                )
+                return
+            _invalidation_tasks.add(task)
+            task.add_done_callback(_invalidation_tasks.discard)
+
+    async def close(self) -> None:
+        if self.backend is not None:
+            await self.backend.close()
+
+
+def create_user_id_cache() -> UserIdCache:
+    backend = RedisUserIdBackend(USER_CACHE_REDIS_URL) if USER_CACHE_REDIS_URL else None
+    return UserIdCache(backend=backend)
+
+
+user_id_cache = create_user_id_cache()
+
+
+@event.listens_for(models.User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    if target.supabase_id:
+        user_id_cache.invalidate(target.supabase_id)
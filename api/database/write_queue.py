@@ -0,0 +1,375 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from database import models
+from utils.database import AsyncSessionLocal
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process spool locking (Windows); run a single worker there
+    fcntl = None
+
+load_dotenv()
+
+# Persist messages for existing conversations in the background instead of
+# before the answer is returned
+MESSAGE_QUEUE_ENABLED = os.getenv("MESSAGE_QUEUE_ENABLED", "true").lower() == "true"
+# Messages buffered in memory before enqueue applies backpressure
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "10000"))
+# Most messages written in a single multi-row INSERT
+MESSAGE_QUEUE_BATCH_SIZE = int(os.getenv("MESSAGE_QUEUE_BATCH_SIZE", "200"))
+# Seconds shutdown waits for queued messages before spooling the rest
+MESSAGE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("MESSAGE_QUEUE_DRAIN_TIMEOUT", "10"))
+# Seconds a read waits for its conversation's queued messages to land
+MESSAGE_QUEUE_READ_TIMEOUT = float(os.getenv("MESSAGE_QUEUE_READ_TIMEOUT", "2"))
+# Messages that couldn't be written (e.g. during a database outage) are appended
+# here and replayed once the database is reachable again. Spool access is
+# serialized with a lock file next to it, and lines that can't be parsed are
+# moved to a .bad file beside it. Only one process may run the queue per spool
+# (see MessageWriteQueue); run several workers with the queue disabled
+MESSAGE_SPOOL_PATH = os.getenv("MESSAGE_SPOOL_PATH", "data/message_spool.jsonl")
+MESSAGE_SPOOL_RETRY_INTERVAL = float(os.getenv("MESSAGE_SPOOL_RETRY_INTERVAL", "30"))
+
+
+class MessageWriteQueue:
+    """Write-behind queue for chat messages.
+
+    Messages are buffered in a bounded asyncio queue and written by a single
+    background task, which batches whatever has accumulated into one multi-row
+    INSERT. Messages that fail to write are appended to a local JSONL spool and
+    replayed later, so an outage delays messages rather than losing them.
+
+    Reads that need a conversation's latest messages (history, the message list)
+    call ``wait_for`` first, which returns as soon as that conversation has
+    nothing left in the queue. Queued messages only exist in this process, so
+    read-your-writes needs a single worker: ``start`` takes an exclusive lock
+    next to the spool and fails if another process already runs the queue (with
+    ``uvicorn --workers N``, set MESSAGE_QUEUE_ENABLED=false). Deployments
+    across several hosts need sticky sessions or the queue disabled.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = MESSAGE_QUEUE_SIZE,
+        batch_size: int = MESSAGE_QUEUE_BATCH_SIZE,
+        spool_path: str = MESSAGE_SPOOL_PATH,
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.spool_path = spool_path
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, int] = {}
+        self._flushed: Optional[asyncio.Condition] = None
+        self._spool_lock: Optional[asyncio.Lock] = None
+        # Held while this process runs the queue; see _claim
+        self._owner_file = None
+
+    async def start(self) -> None:
+        """Start the writer task and replay anything spooled by a previous run.
+
+        Raises RuntimeError if another process is already running the queue.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        if self._owner_file is None:
+            self._owner_file = await asyncio.to_thread(self._claim)
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.maxsize)
+            self._flushed = asyncio.Condition()
+            self._spool_lock = asyncio.Lock()
+        try:
+            await self.replay_spool()
+        except Exception as e:
+            # The writer still starts; the idle loop retries the spool later
+            print(f"Error replaying the message spool: {str(e)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def enqueue(
+        self,
+        conversation_id: int,
+        user_message: str,
+        assistant_message: str,
+        route: Optional[str] = None,
+    ) -> None:
+        """Queue a message for an existing conversation.
+
+        Waits only if the buffer is full.
+        """
+        await self.start()
+        row = {
+            "conversation_id": conversation_id,
+            "user_message": user_message,
+            "assistant_message": assistant_message,
+            "route": route,
+            # Stamp the time now, with the same clock as store_message, so
+            # batching and replays keep the true order
+            "created_at": models.utcnow().isoformat(),
+        }
+        self._pending[conversation_id] = self._pending.get(conversation_id, 0) + 1
+        await self._queue.put(row)
+
+    async def wait_for(
+        self, conversation_id: int, timeout: float = MESSAGE_QUEUE_READ_TIMEOUT
+    ) -> None:
+        """Wait until the conversation's queued messages are written or spooled."""
+        if not self._pending.get(conversation_id):
+            return
+        async with self._flushed:
+            try:
+                await asyncio.wait_for(
+                    self._flushed.wait_for(
+                        lambda: not self._pending.get(conversation_id)
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                print(
+                    "Timed out waiting for queued messages of conversation "
+                    f"{conversation_id}"
+                )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                row = await asyncio.wait_for(
+                    self._queue.get(), MESSAGE_SPOOL_RETRY_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                # Idle: a good moment to retry anything spooled during an outage
+                try:
+                    await self.replay_spool()
+                except Exception as e:
+                    print(f"Error replaying the message spool: {str(e)}")
+                continue
+
+            batch = [row]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # _write removes rows as they are committed, so only these get spooled
+            unwritten = list(batch)
+            try:
+                await self._write(unwritten)
+            except asyncio.CancelledError:
+                # Shutdown gave up waiting on the database
+                await self._spool(unwritten)
+                raise
+            except Exception as e:
+                print(
+                    f"Error writing {len(unwritten)} queued messages, "
+                    f"spooling them: {str(e)}"
+                )
+                await self._spool(unwritten)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                await self._release(batch)
+
+    async def _release(self, batch: List[Dict]) -> None:
+        for row in batch:
+            conversation_id = row["conversation_id"]
+            self._pending[conversation_id] -= 1
+            if not self._pending[conversation_id]:
+                del self._pending[conversation_id]
+        async with self._flushed:
+            self._flushed.notify_all()
+
+    @staticmethod
+    def _values(rows: List[Dict]) -> List[Dict]:
+        return [
+            {**row, "created_at": datetime.fromisoformat(row["created_at"])}
+            for row in rows
+        ]
+
+    async def _write(self, rows: List[Dict]) -> None:
+        """Insert the rows in one statement, or one by one if some violate constraints.
+
+        Rows are removed from ``rows`` once committed (or dropped), so if this
+        raises, the list holds exactly the rows that still need writing.
+        """
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(models.Message).values(self._values(rows)))
+                await db.commit()
+                rows.clear()
+                return
+            except IntegrityError:
+                await db.rollback()
+
+            # Typically a conversation deleted while its messages were queued
+            while rows:
+                row = rows[0]
+                try:
+                    await db.execute(insert(models.Message).values(self._values([row])))
+                    await db.commit()
+                except IntegrityError as e:
+                    await db.rollback()
+                    print(
+                        "Dropping queued message for conversation "
+                        f"{row['conversation_id']}: {str(e)}"
+                    )
+                del rows[0]
+
+    def _claim(self):
+        """Take the lock that lets one process run the queue for this spool."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+        owner_file = open(self.spool_path + ".owner", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(owner_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner_file.close()
+                raise RuntimeError(
+                    f"Another process is running the message queue for "
+                    f"{self.spool_path}; its queued messages would be invisible "
+                    "to reads here. Run a single worker, or set "
+                    "MESSAGE_QUEUE_ENABLED=false."
+                ) from None
+        return owner_file
+
+    def _lock_spool_file(self, blocking: bool = True):
+        """Take the cross-process spool lock.
+
+        Returns the open lock file, to be closed to release the lock, or None
+        if ``blocking`` is false and another worker holds it.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.spool_path)), exist_ok=True)
+        lock_file = open(self.spool_path + ".lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(
+                    lock_file,
+                    fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+                )
+            except BlockingIOError:
+                lock_file.close()
+                return None
+        return lock_file
+
+    def _append_spool(self, rows: List[Dict]) -> None:
+        # Locked so another worker can't move the spool aside mid-append
+        with self._lock_spool_file():
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    async def _spool(self, rows: List[Dict]) -> None:
+        async with self._spool_lock:
+            await asyncio.to_thread(self._append_spool, rows)
+
+    @staticmethod
+    def _rewrite(path: str, rows: List[Dict]) -> None:
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+
+    def _take_spool(self) -> List[Dict]:
+        """Move the spool aside and read it; a leftover from a failed replay goes first.
+
+        Lines that aren't a complete message (say, one cut short by a crash) are
+        moved to the .bad file instead of failing the replay.
+        """
+        replay_path = self.spool_path + ".replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.spool_path):
+                return []
+            os.replace(self.spool_path, replay_path)
+
+        rows, bad_lines = [], []
+        with open(replay_path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    if not isinstance(row, dict) or "conversation_id" not in row:
+                        raise ValueError("not a spooled message")
+                    rows.append(row)
+                except ValueError:
+                    bad_lines.append(line if line.endswith("\n") else line + "\n")
+
+        if bad_lines:
+            with open(self.spool_path + ".bad", "a", encoding="utf-8") as f:
+                f.writelines(bad_lines)
+            self._rewrite(replay_path, rows)
+            print(
+                f"Moved {len(bad_lines)} unreadable spool lines "
+                f"to {self.spool_path}.bad"
+            )
+        return rows
+
+    async def replay_spool(self) -> None:
+        """Write spooled messages to the database, keeping the spool if that fails."""
+        async with self._spool_lock:
+            lock_file = await asyncio.to_thread(self._lock_spool_file, False)
+            if lock_file is None:
+                # Another worker is replaying the shared spool
+                return
+            try:
+                rows = await asyncio.to_thread(self._take_spool)
+                if not rows:
+                    return
+                replay_path = self.spool_path + ".replay"
+                total = len(rows)
+                while rows:
+                    batch = rows[: self.batch_size]
+                    try:
+                        await self._write(batch)
+                    except Exception as e:
+                        # Keep only what hasn't been written, so the next
+                        # replay can't duplicate
+                        remaining = batch + rows[self.batch_size :]
+                        print(
+                            f"Error replaying {len(remaining)} spooled "
+                            f"messages: {str(e)}"
+                        )
+                        await asyncio.to_thread(self._rewrite, replay_path, remaining)
+                        return
+                    del rows[: self.batch_size]
+                os.remove(replay_path)
+                print(f"Replayed {total} spooled messages")
+            finally:
+                lock_file.close()
+
+    async def close(self) -> None:
+        """Drain the queue on shutdown, spooling whatever can't be written in time."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), MESSAGE_QUEUE_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Timed out draining the message queue")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        rows = []
+        while not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if rows:
+            await self._spool(rows)
+            print(f"Spooled {len(rows)} unwritten messages to {self.spool_path}")
+        self._owner_file.close()
+        self._owner_file = None
+
+
+message_queue = MessageWriteQueue() if MESSAGE_QUEUE_ENABLED else None
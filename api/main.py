@@ -1,19 +1,73 @@
-import sys
+import json
+import math
 import os
-from fastapi import FastAPI, HTTPException, Depends, Header
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Union
-from services.chat import *
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import jwt
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from supabase import Client, create_client
+
 from database import models
-from utils.database import engine, get_db
-from sqlalchemy.orm import Session
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from database.db_engine import create_conversation, list_conversations, list_messages
+from database.user_cache import user_id_cache
+from database.write_queue import message_queue
+from services.auth import authenticate
+from services.cache import response_cache
+from services.chat import ask_llm, ask_llm_stream
+from services.history import get_encoding
+from services.llm import close_llm_client, get_llm_client
+from services.retrieval import get_retriever
+from services.scheduler import llm_scheduler, request_deadline
+from services.verses import get_verse_store
+from utils.database import async_engine, get_async_db, pool_status
+from utils.metrics import (
+    METRICS_TOKEN,
+    MetricsMiddleware,
+    mark_process_dead,
+    refresh_gauges,
+    render,
+    timed,
+)
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared OpenAI connection pool on startup and close it on shutdown
+    get_llm_client()
+    # Load the history tokenizer, verse index and retriever now rather than on
+    # the first question
+    get_encoding("gpt-4o")
+    get_retriever()
+    if message_queue is not None:
+        await message_queue.start()
+    yield
+    # Flush queued messages while the database engine is still usable
+    if message_queue is not None:
+        await message_queue.close()
+    await close_llm_client()
+    if response_cache:
+        response_cache.close()
+    await user_id_cache.close()
+    mark_process_dead()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+# Page sizes for the keyset-paginated list endpoints. A request without a
+# limit or cursor gets the whole list, for clients that don't follow
+# X-Next-Cursor; a cursor without a limit gets the default page size
+CONVERSATIONS_PAGE_SIZE = int(os.getenv("CONVERSATIONS_PAGE_SIZE", "100"))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = 500
 
 # Configure CORS - more permissive for development
 app.add_middleware(
@@ -22,44 +76,55 @@ app.add_middleware(
     allow_credentials=False,  # Set to False when using allow_origins=["*"]
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
-    expose_headers=["*"]  # Expose all headers
+    expose_headers=["*"],  # Expose all headers
 )
 
 # Initialize Supabase client
 supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
+    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY")
 )
 
+
 async def get_current_user(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="No authorization header")
-    
+
     try:
         # Remove 'Bearer ' from the token
-        token = authorization.replace('Bearer ', '')
-        
+        token = authorization.replace("Bearer ", "")
+
         # Check if token is empty after removing Bearer
         if not token:
             raise HTTPException(status_code=401, detail="Empty token")
-        
-        # Verify the JWT token with Supabase
-        user = supabase.auth.get_user(token)
-        
+
+        # Verify the JWT locally, falling back to Supabase when no key is available
+        with timed("auth"):
+            user = await authenticate(token, supabase)
+
         # Check if user data exists
         if not user or not user.user:
             raise HTTPException(status_code=401, detail="Invalid user data")
-            
+
         return user
+    except HTTPException:
+        raise
+    except jwt.InvalidTokenError as e:
+        print(f"Authentication error: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid or expired token") from e
     except Exception as e:
         print(f"Authentication error: {str(e)}")
         # More specific error handling
         if "JWT" in str(e) or "token" in str(e).lower():
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
+            raise HTTPException(
+                status_code=401, detail="Invalid or expired token"
+            ) from e
         elif "user" in str(e).lower():
-            raise HTTPException(status_code=401, detail="User not found")
+            raise HTTPException(status_code=401, detail="User not found") from e
         else:
-            raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+            raise HTTPException(
+                status_code=401, detail=f"Authentication failed: {str(e)}"
+            ) from e
+
 
 class QuestionRequest(BaseModel):
     question: str
@@ -71,125 +136,170 @@ class QuestionResponse(BaseModel):
     response: str
     exa_response: str = ""
     analysis_response: str = ""
+    citations: List[Dict] = []
+    # Prompt/completion token counts, including prompt tokens served from cache
+    usage: Optional[Dict] = None
     history: List[Dict]
 
 
 @app.post("/api/ask", response_model=QuestionResponse)
-async def ask_question(request: QuestionRequest, user = Depends(get_current_user)):
+async def ask_question(
+    request: QuestionRequest,
+    user=Depends(get_current_user),
+    x_request_timeout: Optional[float] = Header(None),
+):
+    # The deadline starts now, so time spent queueing counts against it
+    deadline = request_deadline(x_request_timeout)
     try:
-        result = ask_llm(
+        result = await ask_llm(
             request.question,
             user.user.id,
             user.user.email,
             request.conversation_id,
+            deadline,
         )
 
         if result.get("error"):
-            raise HTTPException(status_code=500, detail=result["error"])
+            headers = None
+            if result.get("retry_after") is not None:
+                headers = {"Retry-After": str(math.ceil(result["retry_after"]))}
+            raise HTTPException(
+                status_code=result.get("status_code", 500),
+                detail=result["error"],
+                headers=headers,
+            )
 
         return QuestionResponse(
             response=result["response"] or "",
             exa_response=result.get("exa_response", ""),
             analysis_response=result.get("analysis_response", ""),
+            citations=result.get("citations", []),
+            usage=result.get("usage"),
             history=result["history"],
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print("Exception in ask_question: ", e)
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+def format_sse(event: Dict) -> str:
+    """Format a chat event as a Server-Sent Events frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+@app.post("/api/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    user=Depends(get_current_user),
+    x_request_timeout: Optional[float] = Header(None),
+):
+    events = ask_llm_stream(
+        request.question,
+        user.user.id,
+        user.user.email,
+        request.conversation_id,
+        request_deadline(x_request_timeout),
+    )
+
+    return StreamingResponse(
+        (format_sse(event) async for event in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/api/createnewconversation")
-async def create_new_conversation(request: dict, user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_new_conversation(
+    request: dict,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
     try:
         if not user:
             raise HTTPException(status_code=400, detail="User not found")
 
-        user_db = db.query(models.User).filter(models.User.supabase_id == user.user.id).first()
-        if not user_db:
-            user_db = models.User(supabase_id=user.user.id, email=user.user.email)
-            db.add(user_db)
-            db.commit()
-            db.refresh(user_db)
-
-        conversation = models.Conversation(
-            user_id=user_db.id, title=request.get("question")
+        conversation_id, title = await create_conversation(
+            db, user.user.id, user.user.email, request.get("question")
         )
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
 
-        return {"id": conversation.id, "title": conversation.title}
+        return {"id": conversation_id, "title": title}
     except Exception as e:
         print(f"Error creating new conversation: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
 
 
 @app.get("/api/conversations")
-async def get_all_conversations(user = Depends(get_current_user), db: Session = Depends(get_db)):
-    user_db = db.query(models.User).filter(models.User.supabase_id == user.user.id).first()
-    if not user_db:
-        return []
-
-    conversations = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.user_id == user_db.id)
-        .order_by(models.Conversation.updated_at.desc())
-        .all()
-    )
+async def get_all_conversations(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if cursor and limit is None:
+        limit = CONVERSATIONS_PAGE_SIZE
+    try:
+        conversations, next_cursor = await list_conversations(
+            db, user.user.id, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
-    return [{"id": c.id, "title": c.title} for c in conversations]
+    # The body stays a plain list; the cursor for the next page goes in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return conversations
 
 
 @app.get("/api/conversations/{conversation_id}/messages")
-async def get_all_messages(conversation_id: int, db: Session = Depends(get_db)):
-    messages = (
-        db.query(models.Message)
-        .filter(models.Message.conversation_id == conversation_id)
-        .order_by(models.Message.created_at)
-        .all()
-    )
+async def get_all_messages(
+    conversation_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    if message_queue is not None:
+        await message_queue.wait_for(conversation_id)
+    if cursor and limit is None:
+        limit = MESSAGES_PAGE_SIZE
+    try:
+        messages, next_cursor = await list_messages(db, conversation_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
 
-    return [
-        {
-            "id": msg.id,
-            "user": msg.user_message,
-            "assistant": msg.assistant_message,
-        }
-        for msg in messages
-    ]
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages
 
 
 @app.delete("/api/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int, db: Session = Depends(get_db)):
-    conversation = (
-        db.query(models.Conversation)
-        .filter(models.Conversation.id == conversation_id)
-        .first()
-    )
+async def delete_conversation(
+    conversation_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    conversation = await db.get(models.Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    db.delete(conversation)
-    db.commit()
+    await db.delete(conversation)
+    await db.commit()
     return {"status": "success"}
 
 
 @app.put("/api/conversations/{conversation_id}/title")
 async def update_conversation_title(
-    conversation_id: int, title_update: dict, db: Session = Depends(get_db)
+    conversation_id: int, title_update: dict, db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        conversation = (
-            db.query(models.Conversation)
-            .filter(models.Conversation.id == conversation_id)
-            .first()
-        )
+        conversation = await db.get(models.Conversation, conversation_id)
 
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
 
         conversation.title = title_update["title"]
-        db.commit()
+        await db.commit()
 
         return {
             "status": "success",
@@ -198,37 +308,65 @@ async def update_conversation_title(
         }
     except Exception as e:
         print(f"Error updating conversation title: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
 
 
 @app.post("/api/messages/{message_id}/feedback")
 async def update_message_feedback(
-    message_id: int, feedback: dict, db: Session = Depends(get_db)
+    message_id: int, feedback: dict, db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        message = (
-            db.query(models.Message).filter(models.Message.id == message_id).first()
-        )
+        message = await db.get(models.Message, message_id)
         if not message:
             raise HTTPException(status_code=404, detail="Message not found")
 
         message.response_liked = feedback["response_liked"]
-        db.commit()
+        await db.commit()
 
         return {"status": "success", "message": "Feedback updated successfully"}
     except Exception as e:
         print(f"Error updating message feedback: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+
+@app.get("/api/verses/search")
+async def search_verses(q: str, limit: int = Query(10, ge=1, le=50)):
+    return [verse.to_dict() for verse in get_verse_store().search(q, limit)]
+
+
+@app.get("/api/verses/{text}/{chapter}/{verse}")
+async def get_verse(text: str, chapter: int, verse: int):
+    found = get_verse_store().get(text, chapter, verse)
+    if not found:
+        raise HTTPException(status_code=404, detail="Verse not found")
+    return found.to_dict()
 
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "message": "API is running"}
+    return {
+        "status": "healthy",
+        "message": "API is running",
+        "database_pool": pool_status(async_engine),
+    }
+
+
+@app.get("/api/metrics")
+async def metrics(authorization: str = Header(None)):
+    """Prometheus metrics, aggregated over all workers in multiprocess mode."""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    refresh_gauges(
+        pool_status(async_engine), llm_scheduler.limiters if llm_scheduler else None
+    )
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
 
 @app.get("/api/auth-test")
-async def auth_test(user = Depends(get_current_user)):
+async def auth_test(user=Depends(get_current_user)):
     return {
-        "status": "authenticated", 
+        "status": "authenticated",
         "user_id": user.user.id,
-        "email": user.user.email
+        "email": user.user.email,
     }
@@ -1,11 +1,10 @@
 from logging.config import fileConfig
 
-from sqlalchemy import engine_from_config
-from sqlalchemy import pool
-
 from alembic import context
-import os
 from dotenv import load_dotenv
+from sqlalchemy import engine_from_config, pool
+
+from utils.database import db_settings
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -32,7 +31,7 @@ target_metadata = Base.metadata
 
 
 def get_url():
-    return f"postgresql://{os.getenv('PG_USER')}:{os.getenv('PG_PASSWORD')}@{os.getenv('PG_HOST')}:{os.getenv('PG_PORT')}/{os.getenv('PG_DATABASE')}"
+    return db_settings.sync_url
 
 
 def run_migrations_offline() -> None:
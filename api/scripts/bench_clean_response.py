@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Time clean_response and ResponseCleaner against the original multi-pass cleaner
+on answer-sized inputs.
+
+Their equivalence is checked by tests/test_clean_response.py, which also holds
+the original implementation.
+
+    python scripts/bench_clean_response.py --size 20000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chat import ResponseCleaner, clean_response
+from tests.test_clean_response import legacy_clean_response
+
+SAMPLE_PARAGRAPH = (
+    "## Karma Yoga\n\n\n"
+    "The Bhagavad Gita (Chapter 2, Verse 47) states:   \n"
+    "   'कर्मण्येवाधिकारस्ते मा फलेषु कदाचन।'\n"
+    "This translates directly as: ***You have the right to action alone.***\n\n\n\n"
+)
+
+
+def benchmark(size: int, number: int) -> None:
+    text = (SAMPLE_PARAGRAPH * (size // len(SAMPLE_PARAGRAPH) + 1))[:size]
+    # Completion deltas are a few characters each
+    chunks = [text[i : i + 4] for i in range(0, len(text), 4)]
+
+    def streamed():
+        cleaner = ResponseCleaner()
+        for chunk in chunks:
+            cleaner.feed(chunk)
+        cleaner.finish()
+
+    for name, fn in (
+        ("legacy clean_response", lambda: legacy_clean_response(text)),
+        ("clean_response", lambda: clean_response(text)),
+        ("ResponseCleaner (4-char chunks)", streamed),
+    ):
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:34s} {seconds * 1e6:9.1f} us per {len(text)} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=20000, help="Benchmark text length")
+    parser.add_argument("--number", type=int, default=200, help="Timed runs per repeat")
+    args = parser.parse_args()
+
+    benchmark(args.size, args.number)
+
+
+if __name__ == "__main__":
+    main()
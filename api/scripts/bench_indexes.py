@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Benchmark the history and sidebar queries with and without the composite indexes.
+
+Seeds users, conversations and messages into a scratch database, then times the
+two hottest queries in the API before and after creating
+ix_messages_conversation_id_created_at and ix_conversations_user_id_updated_at.
+
+    python scripts/bench_indexes.py --url sqlite:///bench.db --messages 1000000
+    python scripts/bench_indexes.py --url postgresql://localhost/nara_bench
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select
+
+from database import models
+from utils.database import Base
+
+COMPOSITE_INDEXES = [
+    index
+    for table in (models.Message.__table__, models.Conversation.__table__)
+    for index in table.indexes
+    if index.name
+    in (
+        "ix_messages_conversation_id_created_at",
+        "ix_conversations_user_id_updated_at",
+    )
+]
+
+BATCH_SIZE = 10_000
+
+
+def seed(engine, users: int, conversations: int, messages: int):
+    """Fill the scratch database with synthetic users, conversations and messages."""
+    print(
+        f"Seeding {users} users, {conversations} conversations, {messages} messages..."
+    )
+    start = datetime(2025, 1, 1)
+    rng = random.Random(42)
+
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.User),
+            [
+                {
+                    "id": i,
+                    "supabase_id": f"user-{i}",
+                    "email": f"user{i}@example.com",
+                    "created_at": start,
+                }
+                for i in range(1, users + 1)
+            ],
+        )
+
+        for offset in range(0, conversations, BATCH_SIZE):
+            conn.execute(
+                insert(models.Conversation),
+                [
+                    {
+                        "id": i,
+                        "user_id": rng.randint(1, users),
+                        "title": f"Conversation {i}",
+                        "created_at": start,
+                        "updated_at": start
+                        + timedelta(seconds=rng.randint(0, 10_000_000)),
+                    }
+                    for i in range(
+                        offset + 1, min(offset + BATCH_SIZE, conversations) + 1
+                    )
+                ],
+            )
+
+        body = "Lorem ipsum " * 20
+        for offset in range(0, messages, BATCH_SIZE):
+            conn.execute(
+                insert(models.Message),
+                [
+                    {
+                        "conversation_id": rng.randint(1, conversations),
+                        "user_message": body,
+                        "assistant_message": body,
+                        "created_at": start + timedelta(seconds=offset + i),
+                    }
+                    for i in range(min(BATCH_SIZE, messages - offset))
+                ],
+            )
+
+
+def time_queries(engine, users: int, conversations: int, iterations: int) -> dict:
+    """Time the history load and sidebar listing for random conversations/users."""
+    rng = random.Random(7)
+    timings = {"history": [], "sidebar": []}
+    with engine.connect() as conn:
+        for _ in range(iterations):
+            conversation_id = rng.randint(1, conversations)
+            t0 = time.perf_counter()
+            conn.execute(
+                select(
+                    models.Message.id,
+                    models.Message.user_message,
+                    models.Message.assistant_message,
+                )
+                .where(models.Message.conversation_id == conversation_id)
+                .order_by(models.Message.created_at)
+            ).all()
+            timings["history"].append(time.perf_counter() - t0)
+
+            user_id = rng.randint(1, users)
+            t0 = time.perf_counter()
+            conn.execute(
+                select(models.Conversation.id, models.Conversation.title)
+                .where(models.Conversation.user_id == user_id)
+                .order_by(models.Conversation.updated_at.desc())
+            ).all()
+            timings["sidebar"].append(time.perf_counter() - t0)
+
+    return timings
+
+
+def report(label: str, timings: dict):
+    print(f"\n=== {label} ===")
+    for name, samples in timings.items():
+        samples = sorted(samples)
+        p50 = statistics.median(samples) * 1000
+        p95 = samples[int(len(samples) * 0.95) - 1] * 1000
+        print(
+            f"{name:>8}: p50 {p50:8.3f} ms   p95 {p95:8.3f} ms   "
+            f"({len(samples)} queries)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--url", default="sqlite:///bench_indexes.db", help="Scratch database URL"
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--conversations", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    for index in COMPOSITE_INDEXES:
+        index.drop(engine)
+
+    seed(engine, args.users, args.conversations, args.messages)
+    report(
+        "Without composite indexes",
+        time_queries(engine, args.users, args.conversations, args.iterations),
+    )
+
+    print("\nCreating composite indexes...")
+    for index in COMPOSITE_INDEXES:
+        index.create(engine)
+    report(
+        "With composite indexes",
+        time_queries(engine, args.users, args.conversations, args.iterations),
+    )
+
+
+if __name__ == "__main__":
+    main()
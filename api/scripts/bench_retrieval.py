@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark BM25 verse retrieval latency on a synthetic corpus.
+
+Builds a corpus of random verses from a fixed vocabulary, then times
+VerseRetriever.bm25 for random multi-word questions and reports p50/p99.
+
+    python scripts/bench_retrieval.py --verses 100000 --queries 2000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.retrieval import RETRIEVAL_TOP_K, VerseRetriever
+from services.verses import VerseStore
+
+VOCABULARY_SIZE = 20_000
+
+
+def synthetic_records(count: int, vocabulary):
+    for i in range(count):
+        yield {
+            "text": f"text-{i % 50}",
+            "chapter": i // 1000 + 1,
+            "verse": i % 1000 + 1,
+            "iast": " ".join(random.choices(vocabulary, k=12)),
+            "translation": " ".join(random.choices(vocabulary, k=30)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--verses", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--top-k", type=int, default=RETRIEVAL_TOP_K)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Zipf-ish vocabulary so some terms have long postings lists, like real text
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    weights = [1 / (rank + 1) for rank in range(VOCABULARY_SIZE)]
+
+    start = time.perf_counter()
+    store = VerseStore.build(synthetic_records(args.verses, vocabulary))
+    retriever = VerseRetriever(store)
+    print(
+        f"Built {len(store)} verses, {len(store.postings)} terms "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+    timings = []
+    for _ in range(args.queries):
+        query = " ".join(
+            random.choices(vocabulary, weights=weights, k=random.randint(3, 12))
+        )
+        start = time.perf_counter()
+        retriever.bm25(query, args.top_k)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"bm25 top-{args.top_k}: p50 {statistics.median(timings):.2f} ms, "
+        f"p99 {p99:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Embed every verse in the verse index for vector and hybrid retrieval.
+
+Writes a float32 .npy matrix whose row i is the normalized embedding of verse i
+in the index, which the API memory-maps from VERSE_EMBEDDINGS_PATH.
+
+    python scripts/build_verse_embeddings.py --index data/verses.idx \
+        -o data/verse_embeddings.npy
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from services.retrieval import (
+    RETRIEVAL_EMBEDDING_DIMENSIONS,
+    RETRIEVAL_EMBEDDING_MODEL,
+    VERSE_EMBEDDINGS_PATH,
+)
+from services.verses import VERSE_CORPUS_PATH, VerseStore
+
+load_dotenv()
+
+BATCH_SIZE = 256
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--index", default=VERSE_CORPUS_PATH, help="Verse index to embed"
+    )
+    parser.add_argument(
+        "-o", "--output", default=VERSE_EMBEDDINGS_PATH, help="Matrix file to write"
+    )
+    parser.add_argument("--model", default=RETRIEVAL_EMBEDDING_MODEL)
+    parser.add_argument(
+        "--dimensions", type=int, default=RETRIEVAL_EMBEDDING_DIMENSIONS
+    )
+    args = parser.parse_args()
+
+    store = VerseStore.load(args.index)
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    matrix = np.zeros((len(store), args.dimensions), dtype=np.float32)
+
+    for start in range(0, len(store), BATCH_SIZE):
+        batch = store.verses[start : start + BATCH_SIZE]
+        result = client.embeddings.create(
+            model=args.model,
+            input=[f"{verse.iast}\n{verse.translation}" for verse in batch],
+            dimensions=args.dimensions,
+        )
+        for offset, item in enumerate(result.data):
+            matrix[start + offset] = item.embedding
+        print(f"Embedded {min(start + BATCH_SIZE, len(store))}/{len(store)} verses")
+
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.save(args.output, matrix)
+    print(f"Wrote {matrix.shape} embeddings to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Build the verse index used for verse lookup and citation grounding.
+
+Reads JSON Lines or CSV files of verse records with the fields
+text, chapter, verse, devanagari, iast and translation, and writes the
+compact index loaded from VERSE_CORPUS_PATH.
+
+    python scripts/build_verse_index.py corpus/gita.jsonl corpus/upanishads.csv \
+        -o data/verses.idx
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.verses import VERSE_CORPUS_PATH, VerseStore
+
+
+def read_records(path: str):
+    """Yield verse records from a .jsonl or .csv file."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("inputs", nargs="+", help="JSON Lines or CSV files of verses")
+    parser.add_argument(
+        "-o", "--output", default=VERSE_CORPUS_PATH, help="Index file to write"
+    )
+    args = parser.parse_args()
+
+    records = (record for path in args.inputs for record in read_records(path))
+    store = VerseStore.build(records)
+    store.save(args.output)
+
+    print(
+        f"Indexed {len(store)} verses and {len(store.postings)} terms "
+        f"into {args.output}"
+    )
+    print(f"Index size: {os.path.getsize(args.output) / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
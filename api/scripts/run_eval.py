@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Run an evaluation question set across models and prompt variants.
+
+Every (question, model, prompt variant) combination is answered with bounded
+async concurrency through the LLM scheduler, which adapts to rate limits and
+honors Retry-After. Results are streamed into Parquet part files under
+--output-dir with latency, token and cost columns; the parts double as the
+checkpoint, so rerunning the same command after a crash only answers what is
+missing. With --batch-api the requests go through OpenAI's Batch API instead
+(half price, results within 24h): each run collects finished batches and
+submits what is still missing.
+
+    python scripts/run_eval.py questions.csv \
+        --models gpt-4o,gpt-4o-mini --prompts production,bare
+    python scripts/run_eval.py questions.jsonl --output-dir eval/run1 --concurrency 64
+    python scripts/run_eval.py questions.parquet --output-dir eval/run2 --batch-api
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import polars as pl
+
+from services.chat import (
+    SYSTEM_MESSAGE,
+    analyze_hindu_question,
+    clean_response,
+    generate_hindu_prompt,
+    question_messages,
+)
+from services.citations import extract_citations
+from services.llm import create_llm_client, usage_summary
+from services.ref import HINDU_SYSTEM_PROMPT
+from services.retrieval import RETRIEVAL_ENABLED, get_retriever
+from services.scheduler import LLMScheduler, estimate_tokens
+
+# USD per million tokens: uncached input, cached input, output
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+# The Batch API bills half the synchronous price
+BATCH_DISCOUNT = 0.5
+# OpenAI's limit on requests per batch input file
+BATCH_MAX_REQUESTS = 50_000
+
+SCHEMA = {
+    "key": pl.Utf8,
+    "question_id": pl.Utf8,
+    "question": pl.Utf8,
+    "model": pl.Utf8,
+    "prompt_variant": pl.Utf8,
+    "response": pl.Utf8,
+    "error": pl.Utf8,
+    "latency_s": pl.Float64,
+    "prompt_tokens": pl.Int64,
+    "cached_prompt_tokens": pl.Int64,
+    "completion_tokens": pl.Int64,
+    "cost_usd": pl.Float64,
+    "citations": pl.Int64,
+    "citations_found": pl.Int64,
+    "batch_id": pl.Utf8,
+    "finished_at": pl.Datetime(time_zone="UTC"),
+}
+
+
+async def production_messages(question: str) -> List[Dict]:
+    """The messages the API sends for a first-turn question."""
+    prompt = generate_hindu_prompt(question, analyze_hindu_question(question))
+    return [SYSTEM_MESSAGE] + await question_messages(question, prompt)
+
+
+async def bare_messages(question: str) -> List[Dict]:
+    """System prompt and question only, as the old test.py sent them."""
+    return [
+        {"role": "system", "content": HINDU_SYSTEM_PROMPT},
+        {"role": "user", "content": question},
+    ]
+
+
+PROMPT_VARIANTS = {
+    "production": production_messages,
+    "bare": bare_messages,
+}
+
+
+def load_retriever(items: List[Dict]) -> None:
+    """Load the verse retriever up front, as the API's lifespan does.
+
+    retrieve_verses returns no verses when the retriever fails to load, which
+    would silently evaluate "production" prompts without their grounding, so a
+    load failure here stops the run instead.
+    """
+    if RETRIEVAL_ENABLED and any(
+        item["prompt_variant"] == "production" for item in items
+    ):
+        get_retriever()
+
+
+def load_questions(path: str) -> pl.DataFrame:
+    """Questions from CSV, JSONL or Parquet.
+
+    Needs a question column; an id column is optional.
+    """
+    if path.endswith(".parquet"):
+        df = pl.read_parquet(path)
+    elif path.endswith((".jsonl", ".ndjson")):
+        df = pl.read_ndjson(path)
+    else:
+        df = pl.read_csv(path)
+    if "question" not in df.columns:
+        raise ValueError(f"{path} has no question column")
+    if "id" in df.columns:
+        df = df.with_columns(pl.col("id").cast(pl.Utf8).alias("question_id"))
+    else:
+        # Content-derived ids keep checkpoints valid if the file is reordered
+        df = df.with_columns(
+            pl.col("question")
+            .map_elements(
+                lambda q: hashlib.sha256(q.encode()).hexdigest()[:16],
+                return_dtype=pl.Utf8,
+            )
+            .alias("question_id")
+        )
+    return df.select("question_id", "question").unique(
+        subset="question_id", keep="first", maintain_order=True
+    )
+
+
+def item_key(question_id: str, model: str, variant: str) -> str:
+    return f"{question_id}:{model}:{variant}"
+
+
+def cost(model: str, usage: Optional[Dict], discount: float = 1.0) -> Optional[float]:
+    if usage is None or model not in PRICES:
+        return None
+    uncached_price, cached_price, output_price = PRICES[model]
+    return (
+        discount
+        * (
+            usage["uncached_prompt_tokens"] * uncached_price
+            + usage["cached_prompt_tokens"] * cached_price
+            + usage["completion_tokens"] * output_price
+        )
+        / 1_000_000
+    )
+
+
+def result_row(
+    item: Dict,
+    response: Optional[str],
+    usage: Optional[Dict],
+    error: Optional[str],
+    latency: Optional[float],
+    batch_id: Optional[str] = None,
+) -> Dict:
+    citations = extract_citations(response) if response else []
+    return {
+        **item,
+        "response": response,
+        "error": error,
+        "latency_s": latency,
+        "prompt_tokens": usage["prompt_tokens"] if usage else None,
+        "cached_prompt_tokens": usage["cached_prompt_tokens"] if usage else None,
+        "completion_tokens": usage["completion_tokens"] if usage else None,
+        "cost_usd": cost(item["model"], usage, BATCH_DISCOUNT if batch_id else 1.0),
+        "citations": len(citations),
+        "citations_found": sum(citation["found"] for citation in citations),
+        "batch_id": batch_id,
+        "finished_at": datetime.now(timezone.utc),
+    }
+
+
+class PartWriter:
+    """Buffers result rows and writes them out as numbered Parquet parts."""
+
+    def __init__(self, output_dir: str, flush_every: int):
+        self.output_dir = output_dir
+        self.flush_every = flush_every
+        self.rows: List[Dict] = []
+        self.written = 0
+        os.makedirs(output_dir, exist_ok=True)
+        self.next_part = len(glob.glob(os.path.join(output_dir, "part-*.parquet")))
+
+    def add(self, row: Dict) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        path = os.path.join(self.output_dir, f"part-{self.next_part:05d}.parquet")
+        # Write then rename, so a crash never leaves a half-written part behind
+        pl.DataFrame(self.rows, schema=SCHEMA).write_parquet(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.next_part += 1
+        self.written += len(self.rows)
+        self.rows = []
+
+
+def read_results(output_dir: str) -> pl.DataFrame:
+    """Latest result per key across all parts; successful answers win over errors."""
+    paths = sorted(glob.glob(os.path.join(output_dir, "part-*.parquet")))
+    if not paths:
+        return pl.DataFrame(schema=SCHEMA)
+    return (
+        pl.concat([pl.read_parquet(path) for path in paths])
+        .sort(["key", pl.col("error").is_null(), "finished_at"])
+        .unique(subset="key", keep="last", maintain_order=True)
+    )
+
+
+def pending_items(
+    questions: pl.DataFrame, models: List[str], variants: List[str], done: set
+) -> List[Dict]:
+    items = []
+    for row in questions.iter_rows(named=True):
+        for model in models:
+            for variant in variants:
+                key = item_key(row["question_id"], model, variant)
+                if key not in done:
+                    items.append(
+                        {**row, "key": key, "model": model, "prompt_variant": variant}
+                    )
+    return items
+
+
+async def run_concurrent(items: List[Dict], writer: PartWriter, args) -> None:
+    load_retriever(items)
+    client = create_llm_client()
+    # A scheduler of our own, with one queue per item, so the API's per-user
+    # fairness limits don't apply. Its limit starts at --concurrency and only
+    # drops below it while the API is rate limiting or slow; the semaphore keeps
+    # the prompts built ahead of their calls to the same number.
+    scheduler = LLMScheduler(initial_limit=args.concurrency, max_limit=args.concurrency)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def answer(item: Dict) -> Dict:
+        async with semaphore:
+            messages = await PROMPT_VARIANTS[item["prompt_variant"]](item["question"])
+            started = time.perf_counter()
+            try:
+                completion = await scheduler.call(
+                    item["model"],
+                    partial(
+                        client.chat.completions.create,
+                        model=item["model"],
+                        messages=messages,
+                        temperature=args.temperature,
+                        max_tokens=args.max_tokens,
+                    ),
+                    user_id=item["key"],
+                    tokens=estimate_tokens(messages, args.max_tokens),
+                )
+            except Exception as e:
+                return result_row(
+                    item,
+                    None,
+                    None,
+                    f"{type(e).__name__}: {str(e)}",
+                    time.perf_counter() - started,
+                )
+            latency = time.perf_counter() - started
+            response = clean_response(completion.choices[0].message.content or "")
+            return result_row(
+                item, response, usage_summary(completion.usage), None, latency
+            )
+
+    started = time.perf_counter()
+    errors = 0
+    tasks = [asyncio.create_task(answer(item)) for item in items]
+    written = set()
+    try:
+        for i, task in enumerate(asyncio.as_completed(tasks), 1):
+            row = await task
+            errors += row["error"] is not None
+            writer.add(row)
+            written.add(row["key"])
+            if i % args.flush_every == 0 or i == len(tasks):
+                elapsed = time.perf_counter() - started
+                eta = elapsed / i * (len(tasks) - i)
+                print(
+                    f"{i}/{len(tasks)} answered, {errors} errors, "
+                    f"{i / elapsed:.1f}/s, ETA {eta:.0f}s"
+                )
+    finally:
+        # Keep whatever finished, even on Ctrl-C
+        for task in tasks:
+            task.cancel()
+        for row in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(row, dict) and row["key"] not in written:
+                writer.add(row)
+        writer.flush()
+        await client.close()
+
+
+async def run_batches(items: List[Dict], writer: PartWriter, args) -> None:
+    """Collect finished batches, then submit batches for items not yet covered."""
+    load_retriever(items)
+    client = create_llm_client()
+    state_path = os.path.join(args.output_dir, "batches.json")
+    batches = []
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            batches = json.load(f)
+    by_key = {item["key"]: item for item in items}
+
+    def save_state():
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(batches, f, indent=2)
+        os.replace(state_path + ".tmp", state_path)
+
+    try:
+        for batch in batches:
+            if batch["collected"]:
+                continue
+            remote = await client.batches.retrieve(batch["id"])
+            print(f"Batch {batch['id']}: {remote.status} ({remote.request_counts})")
+            if remote.status not in ("completed", "expired", "cancelled", "failed"):
+                continue
+            for file_id in (remote.output_file_id, remote.error_file_id):
+                if not file_id:
+                    continue
+                for line in (await client.files.content(file_id)).text.splitlines():
+                    record = json.loads(line)
+                    item = by_key.get(record["custom_id"])
+                    if item is None:
+                        continue
+                    response = record.get("response") or {}
+                    if response.get("status_code") == 200:
+                        body = response["body"]
+                        usage = body.get("usage") or {}
+                        cached = (usage.get("prompt_tokens_details") or {}).get(
+                            "cached_tokens"
+                        ) or 0
+                        writer.add(
+                            result_row(
+                                item,
+                                clean_response(
+                                    body["choices"][0]["message"]["content"] or ""
+                                ),
+                                {
+                                    "prompt_tokens": usage.get("prompt_tokens", 0),
+                                    "cached_prompt_tokens": cached,
+                                    "uncached_prompt_tokens": usage.get(
+                                        "prompt_tokens", 0
+                                    )
+                                    - cached,
+                                    "completion_tokens": usage.get(
+                                        "completion_tokens", 0
+                                    ),
+                                },
+                                None,
+                                None,
+                                batch["id"],
+                            )
+                        )
+                    else:
+                        error = record.get("error") or response.get("body")
+                        writer.add(
+                            result_row(
+                                item, None, None, json.dumps(error), None, batch["id"]
+                            )
+                        )
+            # Items the batch never answered are submitted again below
+            writer.flush()
+            batch["collected"] = True
+            save_state()
+
+        answered = set(
+            read_results(args.output_dir)
+            .filter(pl.col("error").is_null())["key"]
+            .to_list()
+        )
+        in_flight = {
+            key for batch in batches if not batch["collected"] for key in batch["keys"]
+        }
+        to_submit = [
+            item
+            for item in items
+            if item["key"] not in answered and item["key"] not in in_flight
+        ]
+        for start in range(0, len(to_submit), BATCH_MAX_REQUESTS):
+            chunk = to_submit[start : start + BATCH_MAX_REQUESTS]
+            lines = []
+            for item in chunk:
+                messages = await PROMPT_VARIANTS[item["prompt_variant"]](
+                    item["question"]
+                )
+                lines.append(
+                    json.dumps(
+                        {
+                            "custom_id": item["key"],
+                            "method": "POST",
+                            "url": "/v1/chat/completions",
+                            "body": {
+                                "model": item["model"],
+                                "messages": messages,
+                                "temperature": args.temperature,
+                                "max_tokens": args.max_tokens,
+                            },
+                        },
+                        ensure_ascii=False,
+                    )
+                )
+            uploaded = await client.files.create(
+                file=("eval.jsonl", "\n".join(lines).encode()), purpose="batch"
+            )
+            remote = await client.batches.create(
+                input_file_id=uploaded.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+            batches.append(
+                {
+                    "id": remote.id,
+                    "keys": [item["key"] for item in chunk],
+                    "collected": False,
+                }
+            )
+            save_state()
+            print(f"Submitted batch {remote.id} with {len(chunk)} requests")
+
+        waiting = sum(len(batch["keys"]) for batch in batches if not batch["collected"])
+        if waiting:
+            print(
+                f"{waiting} requests waiting in batches; "
+                "rerun the same command to collect them"
+            )
+    finally:
+        writer.flush()
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "questions", help="CSV, JSONL or Parquet file with a question column"
+    )
+    parser.add_argument("--models", default="gpt-4o")
+    parser.add_argument(
+        "--prompts", default="production", help=f"any of {', '.join(PROMPT_VARIANTS)}"
+    )
+    parser.add_argument("--output-dir", default="eval")
+    parser.add_argument(
+        "--output", help="also write the combined results to this Parquet file"
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument(
+        "--flush-every", type=int, default=100, help="rows per Parquet part"
+    )
+    parser.add_argument("--limit", type=int, help="only the first N questions")
+    parser.add_argument("--batch-api", action="store_true")
+    args = parser.parse_args()
+
+    models = [model.strip() for model in args.models.split(",")]
+    variants = [variant.strip() for variant in args.prompts.split(",")]
+    for variant in variants:
+        if variant not in PROMPT_VARIANTS:
+            parser.error(f"unknown prompt variant: {variant}")
+
+    questions = load_questions(args.questions)
+    if args.limit:
+        questions = questions.head(args.limit)
+
+    # Errors are retried on resume; only successful answers count as done
+    done = set(
+        read_results(args.output_dir).filter(pl.col("error").is_null())["key"].to_list()
+    )
+    items = pending_items(questions, models, variants, done)
+    total = len(questions) * len(models) * len(variants)
+    print(f"{total - len(items)}/{total} already answered, {len(items)} to go")
+
+    writer = PartWriter(args.output_dir, args.flush_every)
+    if items:
+        asyncio.run(
+            (run_batches if args.batch_api else run_concurrent)(items, writer, args)
+        )
+
+    results = read_results(args.output_dir)
+    if args.output:
+        results.write_parquet(args.output)
+        print(f"Wrote {len(results)} results to {args.output}")
+    summary = (
+        results.group_by("model", "prompt_variant")
+        .agg(
+            pl.len().alias("answers"),
+            pl.col("error").is_not_null().sum().alias("errors"),
+            pl.col("latency_s").median().alias("p50_latency_s"),
+            pl.col("latency_s").quantile(0.95).alias("p95_latency_s"),
+            pl.col("completion_tokens").mean().alias("mean_completion_tokens"),
+            pl.col("cost_usd").sum().alias("cost_usd"),
+            (pl.col("citations_found").sum() / pl.col("citations").sum()).alias(
+                "citations_found_share"
+            ),
+        )
+        .sort("model", "prompt_variant")
+    )
+    with pl.Config(tbl_cols=-1, tbl_width_chars=200):
+        print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import jwt
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from utils.metrics import record_cache
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+
+# Verified tokens are cached for at most this long, and never past their exp
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+ASYMMETRIC_ALGORITHMS = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512", "EdDSA"}
+
+
+@dataclass
+class AuthUser:
+    id: str
+    email: Optional[str] = None
+
+
+@dataclass
+class AuthenticatedUser:
+    """Same shape as Supabase's UserResponse (``user.user.id``, ``user.user.email``)."""
+
+    user: AuthUser
+    claims: Dict = field(default_factory=dict)
+
+
+class TokenCache:
+    """Thread-safe LRU cache of verified tokens with per-entry expiry."""
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        # Keep digests rather than the bearer tokens themselves in memory
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(
+        self, token: str, value: AuthenticatedUser, exp: Optional[float] = None
+    ) -> None:
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        if expires_at <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+_jwks_client: Optional[jwt.PyJWKClient] = None
+
+
+def get_jwks_client() -> Optional[jwt.PyJWKClient]:
+    """JWKS client for projects that sign tokens with asymmetric keys."""
+    global _jwks_client
+    if _jwks_client is None and SUPABASE_URL:
+        _jwks_client = jwt.PyJWKClient(
+            f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json",
+            cache_keys=True,
+            lifespan=3600,
+        )
+    return _jwks_client
+
+
+def _signing_key(token: str, algorithm: str):
+    """Return the key to verify ``token`` with.
+
+    None if the token can't be checked locally.
+    """
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        jwks_client = get_jwks_client()
+        if jwks_client is None:
+            return None
+        try:
+            return jwks_client.get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientError as e:
+            print(f"JWKS lookup failed, falling back to Supabase: {str(e)}")
+            return None
+    if algorithm.startswith("HS"):
+        return SUPABASE_JWT_SECRET
+    return None
+
+
+def verify_token_locally(token: str) -> Optional[Dict]:
+    """Verify a Supabase access token without calling Supabase.
+
+    Returns the verified claims, or None when no key is available to check the
+    token locally. Raises ``jwt.InvalidTokenError`` for bad or expired tokens.
+    """
+    algorithm = jwt.get_unverified_header(token).get("alg", "")
+    key = _signing_key(token, algorithm)
+    if not key:
+        return None
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[algorithm],
+        audience=SUPABASE_JWT_AUDIENCE,
+        options={"require": ["exp", "sub"]},
+    )
+
+
+async def authenticate(token: str, supabase) -> AuthenticatedUser:
+    """Resolve a bearer token to its user, verifying locally whenever possible."""
+    cached = token_cache.get(token)
+    record_cache("auth_token", "miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    if jwt.get_unverified_header(token).get("alg") in ASYMMETRIC_ALGORITHMS:
+        # The first lookup of a signing key fetches the JWKS over the network
+        claims = await run_in_threadpool(verify_token_locally, token)
+    else:
+        claims = verify_token_locally(token)
+
+    if claims is not None:
+        user = AuthenticatedUser(
+            user=AuthUser(id=claims["sub"], email=claims.get("email")), claims=claims
+        )
+        token_cache.set(token, user, exp=claims["exp"])
+        return user
+
+    # No local key for this token, so ask Supabase to verify it
+    response = await run_in_threadpool(supabase.auth.get_user, token)
+    if not response or not response.user:
+        return response
+
+    claims = jwt.decode(token, options={"verify_signature": False})
+    user = AuthenticatedUser(
+        user=AuthUser(id=response.user.id, email=response.user.email), claims=claims
+    )
+    token_cache.set(token, user, exp=claims.get("exp"))
+    return user
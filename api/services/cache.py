@@ -0,0 +1,448 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.llm import get_llm_client
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+# "memory" keeps entries per process, "sqlite" shares them through a local file
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.db")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Optional embedding-similarity tier on top of exact matching
+RESPONSE_CACHE_SEMANTIC = (
+    os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+)
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(
+    os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.95")
+)
+RESPONSE_CACHE_EMBEDDING_MODEL = os.getenv(
+    "RESPONSE_CACHE_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.。।॥]+$")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a cache key."""
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = _WHITESPACE.sub(" ", question).strip()
+    return _TRAILING_PUNCTUATION.sub("", question)
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()
+
+
+@dataclass
+class CacheLookup:
+    """Result of a cache lookup, reused to store the response on a miss."""
+
+    key: str
+    scope: str
+    question: str
+    response: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+    similarity: Optional[float] = None
+
+
+class _EmbeddingIndex:
+    """Embeddings of one cache scope, kept in a matrix that grows as entries are added.
+
+    Removed and expired rows are masked out and reused, so a lookup is a single
+    matrix-vector product rather than a rebuild of the matrix.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.matrix: Optional[np.ndarray] = None
+        self.expires = np.full(capacity, -np.inf)
+        self.keys: List[Optional[str]] = [None] * capacity
+        self.rows: Dict[str, int] = {}
+        self.free: List[int] = []
+        # Rows handed out so far; everything past it is unused capacity
+        self.size = 0
+        # Highest SQLite rowid loaded into the index (SQLite backend only)
+        self.synced_rowid = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, key: str, embedding: np.ndarray, expires_at: float) -> None:
+        row = self.rows.get(key)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                row = self.size
+                self.size += 1
+                if self.matrix is None:
+                    self.matrix = np.zeros(
+                        (self.capacity, len(embedding)), dtype=np.float32
+                    )
+                elif row == self.capacity:
+                    self._grow()
+            self.rows[key] = row
+            self.keys[row] = key
+        self.matrix[row] = embedding
+        self.expires[row] = expires_at
+
+    def _grow(self) -> None:
+        matrix = np.zeros((self.capacity * 2, self.matrix.shape[1]), dtype=np.float32)
+        matrix[: self.capacity] = self.matrix
+        self.matrix = matrix
+        self.expires = np.concatenate([self.expires, np.full(self.capacity, -np.inf)])
+        self.keys.extend([None] * self.capacity)
+        self.capacity *= 2
+
+    def remove(self, key: str) -> None:
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.keys[row] = None
+            self.expires[row] = -np.inf
+            self.free.append(row)
+
+    def nearest(self, embedding: np.ndarray, now: float) -> Tuple[Optional[str], float]:
+        """Key and similarity of the closest unexpired entry."""
+        if not self.rows:
+            return None, 0.0
+        expired = self.expires[: self.size] <= now
+        for row in np.flatnonzero(expired):
+            if self.keys[row] is not None:
+                self.remove(self.keys[row])
+
+        # Mask expired rows before the argmax, so an expired best match
+        # doesn't hide a valid one just below it
+        scores = self.matrix[: self.size] @ embedding
+        scores[expired] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] == -np.inf:
+            return None, 0.0
+        return self.keys[best], float(scores[best])
+
+
+class InMemoryCacheBackend:
+    """Per-process LRU cache with TTL expiry."""
+
+    def __init__(
+        self, maxsize: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, scope, response, embedding)
+        self._entries: "OrderedDict[str, Tuple]" = OrderedDict()
+        self._indexes: Dict[str, _EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    async def nearest(
+        self, scope: str, embedding: np.ndarray
+    ) -> Tuple[Optional[str], float]:
+        while True:
+            with self._lock:
+                index = self._indexes.get(scope)
+                if index is None:
+                    return None, 0.0
+                key, similarity = index.nearest(embedding, time.time())
+            if key is None:
+                return None, 0.0
+
+            response = await self.get(key)
+            if response is not None:
+                return response, similarity
+            # Expired since it was indexed; try the next best one
+            with self._lock:
+                index.remove(key)
+
+    async def set(
+        self,
+        key: str,
+        scope: str,
+        question: str,
+        response: str,
+        embedding: Optional[np.ndarray],
+    ) -> None:
+        with self._lock:
+            self._remove(key)
+            expires_at = time.time() + self.ttl
+            self._entries[key] = (expires_at, scope, response, embedding)
+            if embedding is not None:
+                self._indexes.setdefault(scope, _EmbeddingIndex()).add(
+                    key, embedding, expires_at
+                )
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[3] is None:
+            return
+        index = self._indexes.get(entry[1])
+        if index is not None:
+            index.remove(key)
+            if not index:
+                del self._indexes[entry[1]]
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteCacheBackend:
+    """Cache stored in a local SQLite file, shared by every worker on the host."""
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        maxsize: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        # Per-scope embeddings, loaded once and then only topped up with rows
+        # added since (by this or another worker)
+        self._indexes: Dict[str, _EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    embedding BLOB,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_response_cache_scope "
+                "ON response_cache (scope)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_response_cache_accessed_at "
+                "ON response_cache (accessed_at)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def _nearest(
+        self, scope: str, embedding: np.ndarray
+    ) -> Tuple[Optional[str], float]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            index = self._indexes.setdefault(scope, _EmbeddingIndex())
+            max_rowid = (
+                conn.execute("SELECT max(rowid) FROM response_cache").fetchone()[0] or 0
+            )
+            if max_rowid > index.synced_rowid:
+                # "+scope" keeps SQLite on the rowid range instead of the scope
+                # index, so only rows added since the last sync are read
+                rows = conn.execute(
+                    "SELECT key, embedding, expires_at FROM response_cache "
+                    "WHERE rowid > ? AND rowid <= ? AND +scope = ? "
+                    "AND embedding IS NOT NULL AND expires_at > ?",
+                    (index.synced_rowid, max_rowid, scope, now),
+                ).fetchall()
+                for key, blob, expires_at in rows:
+                    index.add(key, np.frombuffer(blob, dtype=np.float32), expires_at)
+                index.synced_rowid = max_rowid
+
+        while True:
+            with self._lock:
+                key, similarity = index.nearest(embedding, now)
+            if key is None:
+                return None, 0.0
+
+            response = self._get(key)
+            if response is not None:
+                return response, similarity
+            # Evicted by a worker since it was indexed; try the next best one
+            with self._lock:
+                index.remove(key)
+
+    def _set(
+        self,
+        key: str,
+        scope: str,
+        question: str,
+        response: str,
+        embedding: Optional[np.ndarray],
+    ) -> None:
+        now = time.time()
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache "
+                "(key, scope, question, response, embedding, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, question, response, blob, now + self.ttl, now),
+            )
+            # Drop expired entries, then the least recently used beyond maxsize
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                "SELECT key FROM response_cache ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+            index = self._indexes.get(scope)
+            if index is not None and embedding is not None:
+                index.add(key, embedding.astype(np.float32), now + self.ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def nearest(
+        self, scope: str, embedding: np.ndarray
+    ) -> Tuple[Optional[str], float]:
+        return await asyncio.to_thread(self._nearest, scope, embedding)
+
+    async def set(
+        self,
+        key: str,
+        scope: str,
+        question: str,
+        response: str,
+        embedding: Optional[np.ndarray],
+    ) -> None:
+        await asyncio.to_thread(self._set, key, scope, question, response, embedding)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._indexes.clear()
+
+
+class ResponseCache:
+    """Two-tier cache of first-turn answers.
+
+    Exact hits match the normalized question, the generated prompt and the model
+    parameters. With the semantic tier enabled, a miss falls back to the most
+    similar cached question (by embedding cosine similarity) with the same
+    prompt and parameters, if it clears the similarity threshold.
+    """
+
+    def __init__(
+        self,
+        backend,
+        semantic: bool = RESPONSE_CACHE_SEMANTIC,
+        threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+        embedding_model: str = RESPONSE_CACHE_EMBEDDING_MODEL,
+    ):
+        self.backend = backend
+        self.semantic = semantic
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+
+    async def embed(self, text: str) -> np.ndarray:
+        result = await get_llm_client().embeddings.create(
+            model=self.embedding_model, input=text
+        )
+        embedding = np.asarray(result.data[0].embedding, dtype=np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+    async def lookup(self, question: str, prompt: str, params: Dict) -> CacheLookup:
+        normalized = normalize_question(question)
+        scope = _digest(prompt, params)
+        lookup = CacheLookup(
+            key=_digest(normalized, scope), scope=scope, question=normalized
+        )
+
+        lookup.response = await self.backend.get(lookup.key)
+        if lookup.response is not None or not self.semantic:
+            return lookup
+
+        try:
+            lookup.embedding = await self.embed(normalized)
+            response, similarity = await self.backend.nearest(scope, lookup.embedding)
+        except Exception as e:
+            print(f"Error in semantic cache lookup: {str(e)}")
+            return lookup
+
+        if response is not None and similarity >= self.threshold:
+            lookup.response = response
+            lookup.similarity = similarity
+        return lookup
+
+    async def store(self, lookup: CacheLookup, response: str) -> None:
+        """Cache a response; failures are logged, as the answer is good anyway."""
+        try:
+            await self.backend.set(
+                lookup.key, lookup.scope, lookup.question, response, lookup.embedding
+            )
+        except Exception as e:
+            print(f"Error storing response in cache: {str(e)}")
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """Build the response cache configured by the RESPONSE_CACHE_* variables."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if RESPONSE_CACHE_BACKEND == "sqlite":
+        backend = SQLiteCacheBackend()
+    elif RESPONSE_CACHE_BACKEND == "memory":
+        backend = InMemoryCacheBackend()
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {RESPONSE_CACHE_BACKEND}")
+    return ResponseCache(backend)
+
+
+response_cache = create_response_cache()
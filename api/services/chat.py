@@ -1,169 +1,567 @@
+import re
+import time
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
 from dotenv import load_dotenv
-import os
-from openai import OpenAI
-from typing import List, Optional, Dict
-from datetime import datetime
-from database import models
-from utils.database import SessionLocal
-from database.db_engine import get_or_create_conversation, store_message
-from services.ref import HINDU_SYSTEM_PROMPT
+
+from database.db_engine import get_conversation, store_message
+from database.write_queue import message_queue
+from services.cache import response_cache
+from services.citations import (
+    CITATIONS_AUTOCORRECT,
+    CitationExtractor,
+    correct_devanagari,
+    extract_citations,
+)
+from services.classifier import primary_category
+from services.coalesce import Flight, flight_key, join_flight
+from services.history import load_history, schedule_summary_update
+from services.llm import get_llm_client, usage_summary
+from services.ref import CATEGORY_PROMPTS, HINDU_SYSTEM_PROMPT
+from services.retrieval import format_verses_context, retrieve_verses
+from services.routing import create_completion, select_route
+from services.scheduler import error_status, llm_scheduler
+from utils.database import AsyncSessionLocal, async_engine, pool_status
+from utils.metrics import (
+    LLM_SECONDS,
+    observe_stage,
+    record_cache,
+    record_usage,
+    refresh_gauges,
+    timed,
+)
 
 # Initialize clients
 load_dotenv()
 
 conversation_history: Dict[str, List[Dict[str, str]]] = {}
 
+# Characters str.splitlines() breaks on
+_LINE_BREAK = re.compile("[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
 
-def clean_response(text: str) -> str:
-    """Clean and format the response text while preserving proper formatting."""
-
-    # Don't strip all markdown - preserve headers and basic formatting
-    # Only remove excessive formatting
-    text = text.replace("***", "**")  # Convert triple asterisks to double
-
-    # Clean up excessive newlines but preserve paragraph structure
-    lines = text.splitlines()
-    cleaned_lines = []
-    prev_line_empty = False
-
-    for line in lines:
-        stripped_line = line.strip()
 
-        # Skip excessive empty lines (allow max 1 empty line between content)
-        if not stripped_line:
-            if not prev_line_empty:
-                cleaned_lines.append("")
-            prev_line_empty = True
-            continue
-
-        # Preserve the line as-is for most cases
-        cleaned_lines.append(stripped_line)
-        prev_line_empty = False
-
-    # Join with newlines
-    text = "\n".join(cleaned_lines)
-
-    # Ensure proper paragraph spacing - double newlines between paragraphs
-    # Split on double newlines, clean each paragraph, then rejoin
-    paragraphs = text.split("\n\n")
-    cleaned_paragraphs = []
-
-    for para in paragraphs:
-        para = para.strip()
-        if para:  # Only add non-empty paragraphs
-            cleaned_paragraphs.append(para)
-
-    # Join paragraphs with double newlines for proper spacing
-    return "\n\n".join(cleaned_paragraphs)
+def clean_response(text: str) -> str:
+    """Clean and format the response text while preserving proper formatting.
+
+    Single pass over the lines: ``***`` becomes ``**``, lines are stripped, runs
+    of blank lines collapse to one paragraph break, and leading and trailing
+    blank lines are dropped.
+    """
+    return ResponseCleaner()._emit(text.splitlines())
+
+
+class ResponseCleaner:
+    """Incremental version of clean_response for streamed completions.
+
+    Text is fed in arbitrary chunks; complete lines are cleaned as soon as they
+    arrive and the concatenation of everything returned by ``feed`` and ``finish``
+    is identical to ``clean_response`` applied to the whole text.
+    """
+
+    def __init__(self):
+        # Chunks of the current, not yet terminated, line
+        self._buffer: List[str] = []
+        self._parts: List[str] = []
+        self._has_content = False
+        self._pending_blank = False
+
+    @property
+    def text(self) -> str:
+        """The cleaned text emitted so far."""
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of raw text and return any newly cleaned output."""
+        # Most chunks are mid-line; only re-split once a line can have ended
+        held_cr = self._buffer and self._buffer[-1].endswith("\r")
+        if not held_cr and not _LINE_BREAK.search(chunk):
+            if chunk:
+                self._buffer.append(chunk)
+            return ""
+
+        self._buffer.append(chunk)
+        lines = "".join(self._buffer).splitlines(keepends=True)
+        self._buffer = []
+
+        # Hold back the last line until it is terminated. A trailing carriage
+        # return may be the first half of a "\r\n" pair, so hold that back too.
+        last = lines[-1]
+        if last.endswith("\r") or last.splitlines()[0] == last:
+            self._buffer.append(lines.pop())
+
+        return self._emit(lines)
+
+    def finish(self) -> str:
+        """Flush the remaining buffered text and return the final cleaned output."""
+        lines = "".join(self._buffer).splitlines()
+        self._buffer = []
+        return self._emit(lines)
+
+    def _emit(self, lines: List[str]) -> str:
+        out = []
+        for line in lines:
+            stripped_line = line.replace("***", "**").strip()
+
+            # Collapse runs of empty lines into a single paragraph break, and
+            # drop them entirely at the start and end of the response
+            if not stripped_line:
+                if self._has_content:
+                    self._pending_blank = True
+                continue
+
+            if self._has_content:
+                out.append("\n\n" if self._pending_blank else "\n")
+            out.append(stripped_line)
+            self._has_content = True
+            self._pending_blank = False
+
+        cleaned = "".join(out)
+        if cleaned:
+            self._parts.append(cleaned)
+        return cleaned
 
 
 def analyze_hindu_question(question: str) -> str:
     """Analyze the type of Hindu-related question being asked."""
-    question = question.lower()
-
-    if any(
-        word in question
-        for word in ["meaning", "translation", "sanskrit", "devanagari"]
-    ):
-        return "translation"
-    elif any(
-        word in question for word in ["philosophy", "concept", "theory", "principle"]
-    ):
-        return "philosophical"
-    elif any(word in question for word in ["practice", "ritual", "worship", "puja"]):
-        return "practical"
-    elif any(word in question for word in ["story", "mythology", "purana", "itihasa"]):
-        return "narrative"
-    elif any(
-        word in question for word in ["dharma", "duty", "responsibility", "ethics"]
-    ):
-        return "ethical"
-    else:
-        return "general"
-
-
-def generate_hindu_prompt(user_question: str) -> str:
-    """Generate a comprehensive prompt for Hindu-related questions."""
+    return primary_category(question)
+
+
+# Guidance that is the same for every question. It goes into the system message
+# so that the whole static prefix is byte-identical across requests and can be
+# served from the provider's prompt cache.
+PROMPT_GUIDANCE = {
+    "role": (
+        "You are Nara, a knowledgeable guide in sanatana dharma, trained to "
+        "provide accurate and respectful answers based on authentic Sanskrit "
+        "texts."
+    ),
+    "context": (
+        "Base all answers on authentic Sanskrit texts, using direct translations "
+        "and interpretations while respecting the sacred nature of the "
+        "knowledge."
+    ),
+    "approach": (
+        "Respond naturally and conversationally, weaving relevant Sanskrit "
+        "texts, translations, context, and practical applications organically "
+        "into a flowing narrative. Avoid numbered sections or rigid structures - "
+        "let your wisdom unfold like a thoughtful conversation."
+    ),
+}
+
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": f"{HINDU_SYSTEM_PROMPT}\n{' '.join(PROMPT_GUIDANCE.values())}",
+}
+
+
+def generate_hindu_prompt(
+    user_question: str, question_type: Optional[str] = None
+) -> str:
+    """Generate the per-question directive for Hindu-related questions.
+
+    Only the part that depends on the question; it follows the question at the
+    end of the messages so it never disturbs the cached prefix.
+    """
+
+    if question_type is None:
+        question_type = analyze_hindu_question(user_question)
+
+    return CATEGORY_PROMPTS.get(question_type, CATEGORY_PROMPTS["general"])
+
+
+async def build_gpt_messages(
+    db, user_question: str, prompt: str, conversation
+) -> tuple:
+    """Load the conversation history and assemble the messages for the GPT API call."""
+
+    # Load the most recent turns that fit the history token budget, folding
+    # older ones into the conversation summary
+    # Make sure the previous answer, if still queued, is part of the history
+    with timed("history"):
+        if conversation is not None and message_queue is not None:
+            await message_queue.wait_for(conversation.id)
+        turns, summarize_before = await load_history(db, conversation)
+        schedule_summary_update(conversation, summarize_before)
+
+    history = [{"user": turn["user"], "assistant": turn["assistant"]} for turn in turns]
+
+    # Prepare messages for GPT API call. Everything up to the end of the history
+    # is stable between requests; per-question content comes after it.
+    gpt_messages = [SYSTEM_MESSAGE]
+
+    if conversation is not None and conversation.summary:
+        gpt_messages.append(
+            {
+                "role": "system",
+                "content": "Summary of the earlier conversation:\n"
+                f"{conversation.summary}",
+            }
+        )
 
-    question_type = analyze_hindu_question(user_question)
+    # Add conversation history
+    for msg in history:
+        gpt_messages.append({"role": "user", "content": msg["user"]})
+        gpt_messages.append({"role": "assistant", "content": msg["assistant"]})
+
+    gpt_messages.extend(await question_messages(user_question, prompt))
+
+    return history, gpt_messages
+
+
+async def question_messages(user_question: str, prompt: str) -> List[Dict]:
+    """The per-question tail of the messages: retrieved verses, then the question."""
+    messages = []
+
+    # Ground the answer in verses retrieved from our own corpus
+    with timed("retrieval"):
+        verses = await retrieve_verses(user_question)
+    if verses:
+        messages.append({"role": "system", "content": format_verses_context(verses)})
+
+    # Add the current question
+    messages.append(
+        {"role": "user", "content": f"Question: {user_question}\n\n{prompt}"}
+    )
+    return messages
+
+
+async def produce_completion(
+    flight: Flight,
+    client,
+    route,
+    gpt_messages: List[Dict],
+    cache_lookup,
+    stream: bool,
+    user_id: str,
+    deadline: Optional[float],
+) -> None:
+    """Run the upstream completion for a flight, publishing the cleaned text.
+
+    The cleaned answer is also stored in the response cache when ``cache_lookup``
+    is given, before the flight completes, so later requests hit the cache. A
+    shared flight is scheduled under the user and deadline of the request that
+    started it.
+    """
+    started = time.perf_counter()
+    clean_seconds = 0.0
+    if stream:
+        completion_stream, flight.route = await create_completion(
+            client,
+            route,
+            gpt_messages,
+            user_id=user_id,
+            deadline=deadline,
+            stream=True,
+            # Token usage, including cached prompt tokens, arrives in a final chunk
+            stream_options={"include_usage": True},
+        )
 
-    # Components of the prompt
-    components = {
-        "role": "You are Nara, a knowledgeable guide in sanatana dharma, trained to provide accurate and respectful answers based on authentic Sanskrit texts.",
-        "context": "Base all answers on authentic Sanskrit texts, using direct translations and interpretations while respecting the sacred nature of the knowledge.",
-        "question_type": f"This is a {question_type} question about Hindu philosophy and practice. Respond accordingly.",
-        "approach": "Respond naturally and conversationally, weaving relevant Sanskrit texts, translations, context, and practical applications organically into a flowing narrative. Avoid numbered sections or rigid structures - let your wisdom unfold like a thoughtful conversation.",
-    }
+        cleaner = ResponseCleaner()
+        first_token = True
+        async for chunk in completion_stream:
+            if getattr(chunk, "usage", None):
+                flight.usage = usage_summary(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token:
+                LLM_SECONDS.labels(flight.route.model, "first_token").observe(
+                    time.perf_counter() - started
+                )
+                first_token = False
+            clean_started = time.perf_counter()
+            cleaned = cleaner.feed(delta)
+            clean_seconds += time.perf_counter() - clean_started
+            if cleaned:
+                await flight.publish(cleaned)
+
+        cleaned = cleaner.finish()
+        if cleaned:
+            await flight.publish(cleaned)
+    else:
+        completion, flight.route = await create_completion(
+            client, route, gpt_messages, user_id=user_id, deadline=deadline
+        )
+        flight.usage = usage_summary(getattr(completion, "usage", None))
+        clean_started = time.perf_counter()
+        cleaned = clean_response(completion.choices[0].message.content)
+        clean_seconds = time.perf_counter() - clean_started
+        if cleaned:
+            await flight.publish(cleaned)
+
+    # Measured from the request, so time queued in the scheduler is included
+    LLM_SECONDS.labels(flight.route.model, "total").observe(
+        time.perf_counter() - started
+    )
+    observe_stage("clean", clean_seconds)
+    record_usage(flight.route.model, flight.usage)
+
+    if cache_lookup:
+        await response_cache.store(cache_lookup, flight.text)
+
+
+async def save_message(
+    db,
+    conversation,
+    user_question: str,
+    final_response: str,
+    user_id: str,
+    user_email: str,
+    route: str,
+) -> Tuple[int, Optional[int]]:
+    """Persist a question and its answer, returning (conversation_id, message_id).
+
+    Messages for existing conversations go through the write-behind queue, so
+    the answer is returned before the insert commits and message_id is None.
+    """
+    if conversation is not None and message_queue is not None:
+        await message_queue.enqueue(
+            conversation.id, user_question, final_response, route
+        )
+        return conversation.id, None
+
+    return await store_message(
+        db=db,
+        conversation_id=conversation.id if conversation else None,
+        user_message=user_question,
+        assistant_message=final_response,
+        user_id=user_id,
+        user_email=user_email,
+        route=route,
+    )
+
+
+async def ask_llm(
+    user_question: str,
+    user_id: str,
+    user_email: str,
+    conversation_id: int = None,
+    deadline: Optional[float] = None,
+) -> Dict:
+    """Main function to handle Hindu-related questions and analysis.
+
+    ``deadline`` (monotonic clock) bounds queueing and retries of the LLM call.
+    """
+    started = time.perf_counter()
+    db = AsyncSessionLocal()
+    try:
+        OPENAI_CLIENT = get_llm_client()
+        with timed("conversation"):
+            conversation = await get_conversation(db, user_id, conversation_id)
 
-    return " ".join(components.values())
+        # Generate the prompt
+        with timed("prompt"):
+            question_type = analyze_hindu_question(user_question)
+            prompt = generate_hindu_prompt(user_question, question_type)
+        history, gpt_messages = await build_gpt_messages(
+            db, user_question, prompt, conversation
+        )
+        route = select_route(question_type, user_question, len(history))
+        # End the read transaction so the connection goes back to the pool
+        # while we wait on the LLM
+        await db.commit()
+
+        # First-turn questions don't depend on history, so they can be served
+        # from the response cache
+        first_turn = not history and not (conversation and conversation.summary)
+        cache_lookup = None
+        if response_cache and first_turn:
+            with timed("cache_lookup"):
+                cache_lookup = await response_cache.lookup(
+                    user_question, prompt, route.params
+                )
+            record_cache("response", "miss" if cache_lookup.response is None else "hit")
+
+        usage = None
+        if cache_lookup and cache_lookup.response is not None:
+            final_response = cache_lookup.response
+        else:
+            # Identical first-turn questions in flight share a single completion
+            flight, leader = join_flight(
+                flight_key(user_question, prompt, route.params) if first_turn else None,
+                partial(
+                    produce_completion,
+                    client=OPENAI_CLIENT,
+                    route=route,
+                    gpt_messages=gpt_messages,
+                    cache_lookup=cache_lookup,
+                    stream=False,
+                    user_id=user_id,
+                    deadline=deadline,
+                ),
+            )
+            record_cache("coalesce", "leader" if leader else "joined")
+            final_response = await flight.wait()
+            route = flight.route
+            # Tokens are only spent, and reported, once per flight
+            usage = flight.usage if leader else None
+
+        # Check the verses the answer cites against the verse index
+        with timed("citations"):
+            citations = extract_citations(final_response)
+            if CITATIONS_AUTOCORRECT:
+                final_response = correct_devanagari(final_response, citations)
+
+        # Store the message, creating the conversation if needed
+        with timed("db_write"):
+            conversation_id, message_id = await save_message(
+                db,
+                conversation,
+                user_question,
+                final_response,
+                user_id,
+                user_email,
+                route.name,
+            )
 
+        return {
+            "response": final_response,
+            "citations": citations,
+            "history": history,
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "route": route.name,
+            "usage": usage,
+        }
 
-def ask_llm(user_question: str, user_id: str, user_email: str, conversation_id: int = None) -> Dict:
-    """Main function to handle Hindu-related questions and analysis."""
-    try:
-        db = SessionLocal()
-        OPENAI_CLIENT = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        conversation = get_or_create_conversation(
-            db, user_question, user_id, user_email, conversation_id
+    except Exception as e:
+        print(f"Error in ask_llm: {str(e)}")
+        status_code, retry_after = error_status(e)
+        return {
+            "error": f"An error occurred: {str(e)}",
+            "status_code": status_code,
+            "retry_after": retry_after,
+            "history": [],
+        }
+    finally:
+        await db.close()
+        observe_stage("total", time.perf_counter() - started)
+        refresh_gauges(
+            pool_status(async_engine), llm_scheduler.limiters if llm_scheduler else None
         )
 
-        # Get all messages for this conversation
-        messages = (
-            db.query(models.Message)
-            .filter(models.Message.conversation_id == conversation.id)
-            .order_by(models.Message.created_at)
-            .all()
-        )
 
-        history = [
-            {
-                "user": msg.user_message,
-                "assistant": msg.assistant_message,
-            }
-            for msg in messages
-        ]
+async def ask_llm_stream(
+    user_question: str,
+    user_id: str,
+    user_email: str,
+    conversation_id: int = None,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[Dict]:
+    """Streaming variant of ask_llm that yields events as completion deltas arrive.
+
+    Yields ``{"type": "delta", "content": ...}`` events with cleaned text, then a
+    single ``{"type": "done", ...}`` event with the answer's citations once the
+    message has been stored, or an ``{"type": "error", ...}`` event if anything
+    fails. Misquoted Devanagari is flagged but, having already been streamed, not
+    corrected.
+    """
+    started = time.perf_counter()
+    db = AsyncSessionLocal()
+    try:
+        OPENAI_CLIENT = get_llm_client()
+        with timed("conversation"):
+            conversation = await get_conversation(db, user_id, conversation_id)
 
         # Generate the prompt
-        prompt = generate_hindu_prompt(user_question)
-
-        # Prepare messages for GPT API call
-        gpt_messages = [
-            {"role": "system", "content": HINDU_SYSTEM_PROMPT},
-        ]
-
-        # Add conversation history
-        for msg in history:
-            gpt_messages.append({"role": "user", "content": msg["user"]})
-            gpt_messages.append({"role": "assistant", "content": msg["assistant"]})
-
-        # Add the current question
-        gpt_messages.append({"role": "user", "content": f"{prompt}\n\nQuestion: {user_question}"})
-
-        completion = OPENAI_CLIENT.chat.completions.create(
-            model="gpt-4o",
-            messages=gpt_messages,
-            temperature=0.7,
-            max_tokens=5000,
+        with timed("prompt"):
+            question_type = analyze_hindu_question(user_question)
+            prompt = generate_hindu_prompt(user_question, question_type)
+        history, gpt_messages = await build_gpt_messages(
+            db, user_question, prompt, conversation
         )
-
-        final_response = clean_response(completion.choices[0].message.content)
-
-        # Store the message
-        store_message(
-            db=db,
-            conversation_id=conversation.id,
-            user_message=user_question,
-            assistant_message=final_response,
+        route = select_route(question_type, user_question, len(history))
+        # End the read transaction so the connection goes back to the pool
+        # while we wait on the LLM
+        await db.commit()
+
+        first_turn = not history and not (conversation and conversation.summary)
+        cache_lookup = None
+        if response_cache and first_turn:
+            with timed("cache_lookup"):
+                cache_lookup = await response_cache.lookup(
+                    user_question, prompt, route.params
+                )
+            record_cache("response", "miss" if cache_lookup.response is None else "hit")
+
+        citation_extractor = CitationExtractor()
+        citation_seconds = 0.0
+        usage = None
+        if cache_lookup and cache_lookup.response is not None:
+            final_response = cache_lookup.response
+            citation_extractor.feed(final_response)
+            yield {"type": "delta", "content": final_response}
+        else:
+            # Identical first-turn questions in flight share a single completion;
+            # requests that join late are replayed what has streamed so far
+            flight, leader = join_flight(
+                flight_key(user_question, prompt, route.params) if first_turn else None,
+                partial(
+                    produce_completion,
+                    client=OPENAI_CLIENT,
+                    route=route,
+                    gpt_messages=gpt_messages,
+                    cache_lookup=cache_lookup,
+                    stream=True,
+                    user_id=user_id,
+                    deadline=deadline,
+                ),
+            )
+            record_cache("coalesce", "leader" if leader else "joined")
+            async for cleaned in flight.stream():
+                citations_started = time.perf_counter()
+                citation_extractor.feed(cleaned)
+                citation_seconds += time.perf_counter() - citations_started
+                yield {"type": "delta", "content": cleaned}
+
+            final_response = flight.text
+            route = flight.route
+            usage = flight.usage if leader else None
+
+        # Store the message once the stream has completed
+        with timed("db_write"):
+            conversation_id, message_id = await save_message(
+                db,
+                conversation,
+                user_question,
+                final_response,
+                user_id,
+                user_email,
+                route.name,
+            )
+
+        citations_started = time.perf_counter()
+        citations = citation_extractor.finish()
+        observe_stage(
+            "citations",
+            citation_seconds + time.perf_counter() - citations_started,
         )
 
-        return {
-            "response": final_response,
+        yield {
+            "type": "done",
+            "conversation_id": conversation_id,
+            "message_id": message_id,
+            "route": route.name,
+            "usage": usage,
+            "citations": citations,
             "history": history,
-            "conversation_id": conversation.id,
         }
 
     except Exception as e:
-        print(f"Error in ask_llm: {str(e)}")
-        return {"error": f"An error occurred: {str(e)}", "history": []}
+        print(f"Error in ask_llm_stream: {str(e)}")
+        status_code, retry_after = error_status(e)
+        yield {
+            "type": "error",
+            "error": f"An error occurred: {str(e)}",
+            "status_code": status_code,
+            "retry_after": retry_after,
+        }
     finally:
-        db.close()
\ No newline at end of file
+        await db.close()
+        observe_stage("total", time.perf_counter() - started)
+        refresh_gauges(
+            pool_status(async_engine), llm_scheduler.limiters if llm_scheduler else None
+        )
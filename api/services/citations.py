@@ -0,0 +1,243 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.sanskrit import normalize
+from services.verses import TEXTS, VerseStore, canonical_text_id, get_verse_store
+
+load_dotenv()
+
+# Replace misquoted Devanagari with the indexed verse (non-streaming answers only)
+CITATIONS_AUTOCORRECT = os.getenv("CITATIONS_AUTOCORRECT", "false").lower() == "true"
+# Lines after a citation in which its Devanagari quote may start
+CITATION_QUOTE_WINDOW = int(os.getenv("CITATION_QUOTE_WINDOW", "3"))
+
+# Letters that cited text names may carry diacritics on, e.g. "Bhagavad Gītā"
+_LETTER_VARIANTS = {
+    "a": "aāá",
+    "i": "iīí",
+    "u": "uūú",
+    "e": "eé",
+    "o": "oó",
+    "s": "sśṣ",
+    "n": "nṇñṅ",
+    "r": "rṛ",
+    "t": "tṭ",
+    "d": "dḍ",
+    "h": "hḥ",
+    "m": "mṃṁ",
+    "l": "lḷ",
+}
+
+
+def _name_pattern(name: str) -> str:
+    words = [
+        "".join(
+            f"[{_LETTER_VARIANTS[c]}]" if c in _LETTER_VARIANTS else re.escape(c)
+            for c in word
+        )
+        for word in name.split()
+    ]
+    return r"[ \t-]*".join(words)
+
+
+_NAMES = sorted(
+    {alias for aliases in TEXTS.values() for alias in aliases}
+    | {text_id.replace("-", " ") for text_id in TEXTS},
+    key=len,
+    reverse=True,
+)
+
+# "Bhagavad Gita (Chapter 2, Verse 47)", "Gita, Ch. 2, Verse 47-48", "BG 2.47",
+# "Rig Veda 10:129"
+CITATION_PATTERN = re.compile(
+    r"\b(?P<name>%s)\b[ \t]*[,(]?[ \t]*"
+    r"(?:"
+    r"(?:chapter|ch\.?|adhy[aā]ya)[ \t]*(?P<chapter>\d+)[ \t]*[,;]?[ \t]*"
+    r"(?:verses?|vv?\.?|[sś]lokas?|shlokas?)[ \t]*(?P<verse>\d+)"
+    r"(?:[ \t]*[-–][ \t]*(?P<verse_end>\d+))?"
+    r"|"
+    r"(?P<chapter_num>\d+)[ \t]*[.:][ \t]*(?P<verse_num>\d+)"
+    r"(?:[ \t]*[-–][ \t]*(?P<verse_num_end>\d+))?"
+    r")\)?" % "|".join(_name_pattern(name) for name in _NAMES),
+    re.IGNORECASE,
+)
+
+_DEVANAGARI_LETTERS = re.compile(r"[ऀ-ॣॱ-ॿ]")
+# From the first to the last Devanagari character, leaving out surrounding quotes
+_DEVANAGARI_SPAN = re.compile(r"[ऀ-ॿ](?:.*[ऀ-ॿ])?")
+_NOT_DEVANAGARI_LETTER = re.compile(r"[^ऀ-ॣॱ-ॿ]+")
+
+
+def _devanagari_key(text: str) -> str:
+    """Devanagari letters and signs only, without spacing, dandas, digits or quotes."""
+    return _NOT_DEVANAGARI_LETTER.sub("", normalize(text))
+
+
+class CitationExtractor:
+    """Finds verse citations in an answer and checks the Devanagari quoted after them.
+
+    Text is fed in arbitrary chunks and processed a line at a time, so it can run
+    alongside a stream; each line is scanned once, keeping extraction linear in
+    the length of the answer.
+    """
+
+    def __init__(self, store: Optional[VerseStore] = None):
+        self.store = store if store is not None else get_verse_store()
+        self.citations: List[Dict] = []
+        self._buffer = ""
+        # Citations whose Devanagari quote hasn't been seen yet
+        self._pending: List[Dict] = []
+        self._quote_lines: List[str] = []
+        # (line, start, end) of each quote line, in the normalized line
+        self._quote_spans: List[Tuple[int, int, int]] = []
+        self._lines_waited = 0
+        self._line = -1
+
+    def feed(self, chunk: str) -> None:
+        self._buffer += chunk
+        if "\n" not in self._buffer:
+            return
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._process_line(line)
+
+    def finish(self) -> List[Dict]:
+        """Process any remaining text and return every citation found."""
+        if self._buffer:
+            self._process_line(self._buffer)
+            self._buffer = ""
+        self._settle()
+        return self.citations
+
+    def _process_line(self, line: str) -> None:
+        self._line += 1
+        line = normalize(line)
+        matches = list(CITATION_PATTERN.finditer(line))
+
+        if self._pending:
+            # The quote is the run of Devanagari lines following the citation,
+            # possibly starting on the citation's own line
+            head = line[: matches[0].start()] if matches else line
+            if _DEVANAGARI_LETTERS.search(head):
+                self._add_quote_line(_DEVANAGARI_SPAN.search(head), 0)
+            elif self._quote_lines or self._lines_waited >= CITATION_QUOTE_WINDOW:
+                self._settle()
+            elif line.strip():
+                self._lines_waited += 1
+
+        for i, match in enumerate(matches):
+            self._settle()
+            self._pending.append(self._resolve(match))
+            tail = line[
+                match.end() : matches[i + 1].start()
+                if i + 1 < len(matches)
+                else len(line)
+            ]
+            if _DEVANAGARI_LETTERS.search(tail):
+                self._add_quote_line(_DEVANAGARI_SPAN.search(tail), match.end())
+
+    def _add_quote_line(self, span: re.Match, offset: int) -> None:
+        self._quote_lines.append(span.group())
+        self._quote_spans.append(
+            (self._line, offset + span.start(), offset + span.end())
+        )
+
+    def _resolve(self, match: re.Match) -> Dict:
+        name = match.group("name")
+        if match.group("chapter") is not None:
+            chapter, verse, verse_end = match.group("chapter", "verse", "verse_end")
+        else:
+            chapter, verse, verse_end = match.group(
+                "chapter_num", "verse_num", "verse_num_end"
+            )
+
+        text_id = canonical_text_id(name) or name
+        found = self.store.get(text_id, int(chapter), int(verse))
+        return {
+            "cited_as": match.group(),
+            "text": text_id,
+            "chapter": int(chapter),
+            "verse": int(verse),
+            "verse_end": int(verse_end) if verse_end else None,
+            "found": found is not None,
+            "devanagari": found.devanagari if found else None,
+            "translation": found.translation if found else None,
+            "quoted_devanagari": None,
+            "quote_spans": [],
+            "devanagari_matches": None,
+            "devanagari_corrected": False,
+        }
+
+    def _settle(self) -> None:
+        """Attach the collected quote to the pending citations and record them."""
+        quote = "\n".join(self._quote_lines) or None
+        for citation in self._pending:
+            citation["quoted_devanagari"] = quote
+            citation["quote_spans"] = list(self._quote_spans)
+            if quote and citation["devanagari"]:
+                # Answers often quote only a half-verse
+                citation["devanagari_matches"] = _devanagari_key(
+                    quote
+                ) in _devanagari_key(citation["devanagari"])
+            self.citations.append(citation)
+        self._pending = []
+        self._quote_lines = []
+        self._quote_spans = []
+        self._lines_waited = 0
+
+
+def extract_citations(text: str, store: Optional[VerseStore] = None) -> List[Dict]:
+    """Extract and validate every verse citation in a complete answer."""
+    extractor = CitationExtractor(store)
+    extractor.feed(text)
+    return extractor.finish()
+
+
+def correct_devanagari(text: str, citations: List[Dict]) -> str:
+    """Replace misquoted Devanagari with the indexed text of the cited verse.
+
+    ``text`` must be the text the citations were extracted from: each quote is
+    replaced at the spans the extractor recorded, line by line when the verse
+    has as many lines as the quote. Lines holding a replaced quote come back
+    normalized, as the spans were measured on normalized lines. A citation is
+    only marked as corrected once its quote has actually been replaced.
+    """
+    lines = text.split("\n")
+    normalized: Dict[int, str] = {}
+    replacements: Dict[Tuple[int, int, int], str] = {}
+    corrected = []
+    for citation in citations:
+        spans = [tuple(span) for span in citation["quote_spans"]]
+        if citation["devanagari_matches"] is not False or not spans:
+            continue
+        # A quote shared by several citations is only replaced once
+        if any(span in replacements or span[0] >= len(lines) for span in spans):
+            continue
+        quoted = "\n".join(
+            normalized.setdefault(line, normalize(lines[line]))[start:end]
+            for line, start, end in spans
+        )
+        if quoted != citation["quoted_devanagari"]:
+            continue
+        verse_lines = citation["devanagari"].split("\n")
+        if len(verse_lines) != len(spans):
+            verse_lines = [citation["devanagari"]] + [""] * (len(spans) - 1)
+        replacements.update(zip(spans, verse_lines))
+        corrected.append(citation)
+
+    # Right to left, so earlier spans on a line keep their offsets
+    for (line, start, end), verse_line in sorted(replacements.items(), reverse=True):
+        normalized[line] = (
+            normalized[line][:start] + verse_line + normalized[line][end:]
+        )
+    for line in {line for line, _, _ in replacements}:
+        lines[line] = normalized[line]
+
+    for citation in corrected:
+        citation["quoted_devanagari"] = citation["devanagari"]
+        citation["devanagari_matches"] = True
+        citation["devanagari_corrected"] = True
+    return "\n".join(lines)
@@ -0,0 +1,275 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+from services.sanskrit import normalize
+
+# Categories in priority order; ties go to the earlier one
+CATEGORIES = ["translation", "philosophical", "practical", "narrative", "ethical"]
+DEFAULT_CATEGORY = "general"
+
+# Keywords per category and language. Matching is case-insensitive on whole
+# words, so list inflections explicitly rather than relying on substrings.
+KEYWORDS: Dict[str, Dict[str, List[str]]] = {
+    "translation": {
+        "en": [
+            "meaning",
+            "meanings",
+            "mean",
+            "means",
+            "translation",
+            "translations",
+            "translate",
+            "sanskrit",
+            "devanagari",
+            "transliteration",
+            "etymology",
+            "word by word",
+        ],
+        "hi": ["अर्थ", "मतलब", "अनुवाद", "संस्कृत", "देवनागरी"],
+        "sa": ["artha", "anuvada", "samskrta", "samskrit"],
+        "es": ["significado", "traducción", "traducir", "sánscrito"],
+        "fr": ["signification", "traduction", "traduire"],
+        "de": ["bedeutung", "übersetzung", "übersetzen"],
+        "pt": ["significado", "tradução", "traduzir", "sânscrito"],
+        "ta": ["பொருள்", "மொழிபெயர்ப்பு", "சமஸ்கிருதம்"],
+    },
+    "philosophical": {
+        "en": [
+            "philosophy",
+            "philosophical",
+            "concept",
+            "concepts",
+            "theory",
+            "theories",
+            "principle",
+            "principles",
+            "metaphysics",
+            "consciousness",
+            "darshana",
+            "atman",
+            "atma",
+            "brahman",
+            "self",
+            "soul",
+            "reality",
+            "existence",
+            "moksha",
+            "maya",
+            "vedanta",
+            "advaita",
+            "dvaita",
+            "meaning of life",
+            "purpose of life",
+        ],
+        "hi": ["दर्शन", "सिद्धांत", "तत्त्व", "तत्व"],
+        "sa": ["darsana", "tattva", "siddhanta"],
+        "es": ["filosofía", "concepto", "teoría", "principio"],
+        "fr": ["philosophie", "concept", "théorie", "principe"],
+        "de": ["philosophie", "konzept", "begriff", "theorie", "prinzip"],
+        "pt": ["filosofia", "conceito", "teoria", "princípio"],
+        "ta": ["தத்துவம்", "கோட்பாடு"],
+    },
+    "practical": {
+        "en": [
+            "practice",
+            "practices",
+            "practise",
+            "ritual",
+            "rituals",
+            "worship",
+            "puja",
+            "pooja",
+            "meditation",
+            "meditate",
+            "mantra",
+            "mantras",
+            "fasting",
+        ],
+        "hi": ["पूजा", "उपासना", "साधना", "अनुष्ठान", "ध्यान", "व्रत"],
+        "sa": ["sadhana", "upasana", "anushthana", "dhyana", "vrata"],
+        "es": ["práctica", "ritual", "rituales", "adoración", "culto", "meditación"],
+        "fr": ["pratique", "rituel", "rituels", "culte", "méditation"],
+        "de": ["praxis", "ritual", "rituale", "verehrung", "meditation"],
+        "pt": ["prática", "ritual", "rituais", "adoração", "culto", "meditação"],
+        "ta": ["வழிபாடு", "பூஜை", "தியானம்"],
+    },
+    "narrative": {
+        "en": [
+            "story",
+            "stories",
+            "mythology",
+            "myth",
+            "myths",
+            "legend",
+            "legends",
+            "purana",
+            "puranas",
+            "itihasa",
+            "ramayana",
+            "mahabharata",
+        ],
+        "hi": ["कथा", "कहानी", "पुराण", "इतिहास", "रामायण", "महाभारत"],
+        "sa": ["katha", "akhyana"],
+        "es": ["historia", "mitología", "leyenda"],
+        "fr": ["histoire", "mythologie", "légende"],
+        "de": ["geschichte", "mythologie", "legende"],
+        "pt": ["história", "mitologia", "lenda"],
+        "ta": ["கதை", "புராணம்"],
+    },
+    "ethical": {
+        "en": [
+            "dharma",
+            "duty",
+            "duties",
+            "responsibility",
+            "responsibilities",
+            "ethics",
+            "ethical",
+            "moral",
+            "morality",
+        ],
+        "hi": ["धर्म", "कर्तव्य", "नैतिकता"],
+        "sa": ["kartavya", "svadharma"],
+        "es": ["deber", "ética", "moral", "responsabilidad"],
+        "fr": ["devoir", "éthique", "morale", "responsabilité"],
+        "de": ["pflicht", "ethik", "moral", "verantwortung"],
+        "pt": ["dever", "ética", "moral", "responsabilidade"],
+        "ta": ["அறம்", "கடமை"],
+    },
+}
+
+# Keywords that count for more or less than 1 towards their category
+KEYWORD_WEIGHTS = {
+    "mean": 0.5,
+    "means": 0.5,
+    "sanskrit": 0.5,
+}
+
+# Letters and the vowel signs / viramas of the Indic blocks (Devanagari through
+# Sinhala), which \w alone doesn't cover, minus the danda punctuation
+_WORD_CHAR = r"[\wऀ-ॣ०-෿]"
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex matching any of ``words``, shaped as a trie.
+
+    Branches at each node start with different characters, so at any position
+    the engine follows a single path instead of trying every keyword in turn.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node: Dict) -> str:
+        branches = [re.escape(ch) + render(child) for ch, child in node.items() if ch]
+        if not branches:
+            return ""
+        pattern = (
+            branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        )
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return render(trie)
+
+
+def _build_keyword_table() -> Dict[str, List[Tuple[str, float]]]:
+    table: Dict[str, List[Tuple[str, float]]] = {}
+    for category, languages in KEYWORDS.items():
+        for keywords in languages.values():
+            for keyword in keywords:
+                key = normalize(keyword).lower()
+                entries = table.setdefault(key, [])
+                if all(existing != category for existing, _ in entries):
+                    entries.append((category, KEYWORD_WEIGHTS.get(key, 1.0)))
+    return table
+
+
+_KEYWORD_CATEGORIES = _build_keyword_table()
+# Questions are lowercased before matching, which is much faster than
+# re.IGNORECASE. Whitespace inside multi-word keywords matches any run of spaces.
+_KEYWORD_PATTERN = re.compile(
+    rf"(?<!{_WORD_CHAR})(?:{_trie_pattern(_KEYWORD_CATEGORIES)})(?!{_WORD_CHAR})".replace(
+        r"\ ", r"\s+"
+    )
+)
+_PRIORITY = {category: i for i, category in enumerate(CATEGORIES)}
+
+
+def classify(question: str) -> Dict[str, float]:
+    """Weighted categories for a question, strongest first, with weights summing to 1.
+
+    A question matching no keyword is ``{"general": 1.0}``.
+    """
+    scores: Dict[str, float] = {}
+    for match in _KEYWORD_PATTERN.finditer(normalize(question).lower()):
+        keyword = " ".join(match.group().split())
+        for category, weight in _KEYWORD_CATEGORIES.get(keyword, ()):
+            scores[category] = scores.get(category, 0.0) + weight
+
+    total = sum(scores.values())
+    if not total:
+        return {DEFAULT_CATEGORY: 1.0}
+    ranked = sorted(
+        scores, key=lambda category: (-scores[category], _PRIORITY[category])
+    )
+    return {category: scores[category] / total for category in ranked}
+
+
+# Sanskrit terms common enough to be asked about without diacritics or quotes
+SANSKRIT_TERMS = frozenset(
+    {
+        "ahimsa",
+        "atma",
+        "atman",
+        "aum",
+        "bhakti",
+        "brahman",
+        "dharma",
+        "guna",
+        "gunas",
+        "jnana",
+        "karma",
+        "mantra",
+        "maya",
+        "moksha",
+        "nirvana",
+        "om",
+        "prana",
+        "puja",
+        "rta",
+        "samadhi",
+        "samsara",
+        "sloka",
+        "shloka",
+        "sutra",
+        "svadharma",
+        "tapas",
+        "yajna",
+        "yoga",
+    }
+)
+
+# A verse reference ("2.47", "verse 3"), Devanagari or IAST text, or a quoted term
+_REFERENCE_PATTERN = re.compile(
+    r"\d+\s*[.:]\s*\d+"
+    r"|\b(?:verses?|[sś]lokas?|shlokas?|chapter|adhy[aā]ya)\b"
+    r"|[ऀ-ॿāīūṛṝḷṅñṭḍṇśṣṃṁḥ]"
+    r"|[\"“][^\"“”]+[\"”]"
+)
+_WORD = re.compile(rf"{_WORD_CHAR}+")
+
+
+def has_reference(question: str) -> bool:
+    """Whether a question cites a verse or names a Sanskrit term to explain."""
+    question = normalize(question).lower()
+    return bool(_REFERENCE_PATTERN.search(question)) or any(
+        word in SANSKRIT_TERMS for word in _WORD.findall(question)
+    )
+
+
+def primary_category(question: str) -> str:
+    """The single strongest category for a question."""
+    return next(iter(classify(question)))
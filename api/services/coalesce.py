@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from dotenv import load_dotenv
+
+from services.cache import normalize_question
+
+load_dotenv()
+
+# Share one upstream completion between identical first-turn questions in flight
+REQUEST_COALESCING_ENABLED = (
+    os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+)
+
+
+class Flight:
+    """One upstream completion, fanned out to every request waiting on it.
+
+    The producer runs in its own task and publishes cleaned text chunks. Each
+    waiter iterates ``stream`` and receives every chunk from the start, however
+    late it joined. The task is cancelled once every waiter has gone away.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        # Filled in by the producer
+        self.route = None
+        self.usage: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.cancelled = False
+        self._waiters = 0
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    async def publish(self, chunk: str) -> None:
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def _finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self.error = error
+            self.done = True
+            self._changed.notify_all()
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Yield every published chunk, then raise the producer's error if it failed."""
+        self._waiters += 1
+        seen = 0
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda seen=seen: len(self.chunks) > seen or self.done
+                    )
+                    chunks, done = self.chunks[seen:], self.done
+                for chunk in chunks:
+                    yield chunk
+                seen += len(chunks)
+                if done and seen == len(self.chunks):
+                    break
+            if self.error is not None:
+                raise self.error
+        finally:
+            self._waiters -= 1
+            if not self._waiters and not self.done and self._task is not None:
+                # Nobody is left to read the answer
+                self.cancelled = True
+                self._task.cancel()
+
+    async def wait(self) -> str:
+        """Wait for the whole completion and return its text."""
+        async for _ in self.stream():
+            pass
+        return self.text
+
+
+def start_flight(
+    produce: Callable[[Flight], Awaitable[None]], on_done: Callable[[], None] = None
+) -> Flight:
+    """Run ``produce`` in a background task feeding a new flight."""
+    flight = Flight()
+
+    async def run():
+        try:
+            await produce(flight)
+        except asyncio.CancelledError:
+            await flight._finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            await flight._finish(e)
+        else:
+            await flight._finish()
+        finally:
+            if on_done is not None:
+                on_done()
+
+    flight._task = asyncio.create_task(run())
+    return flight
+
+
+class SingleFlight:
+    """Registry of in-flight completions keyed by everything that shapes the answer."""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+
+    def join(
+        self, key: Hashable, produce: Callable[[Flight], Awaitable[None]]
+    ) -> Tuple[Flight, bool]:
+        """Join the flight for ``key``, starting it with ``produce`` if there is none.
+
+        Returns the flight and whether this caller started it.
+        """
+        flight = self._flights.get(key)
+        if flight is not None and not flight.done and not flight.cancelled:
+            return flight, False
+
+        def forget():
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight = start_flight(produce, forget)
+        self._flights[key] = flight
+        return flight, True
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+
+def flight_key(question: str, prompt: str, params: Dict) -> Tuple[str, str, str]:
+    """Key under which identical first-turn requests share a completion.
+
+    Same normalization as the response cache key, so a question coalesces with
+    exactly the requests whose answer it could have been served from the cache.
+    """
+    return normalize_question(question), prompt, json.dumps(params, sort_keys=True)
+
+
+def join_flight(
+    key: Optional[Hashable], produce: Callable[[Flight], Awaitable[None]]
+) -> Tuple[Flight, bool]:
+    """Join the shared flight for ``key``.
+
+    Without a key (or with coalescing off) a private flight is started.
+    """
+    if key is None or single_flight is None:
+        return start_flight(produce), True
+    return single_flight.join(key, produce)
+
+
+single_flight = SingleFlight() if REQUEST_COALESCING_ENABLED else None
@@ -0,0 +1,219 @@
+import asyncio
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+import tiktoken
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from database import models
+from services.llm import get_llm_client
+from utils.database import AsyncSessionLocal
+
+load_dotenv()
+
+# Token budget for replayed conversation history (excluding the system prompt)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Most recent turns loaded from the database before fitting them to the budget
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "50"))
+# Fold turns that fall out of the budget into a stored rolling summary
+HISTORY_SUMMARY_ENABLED = (
+    os.getenv("HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+)
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "500"))
+
+# Approximate per-message overhead of the chat format (role and separators)
+TOKENS_PER_MESSAGE = 4
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and Nara, "
+    "a guide in sanatana dharma.\n"
+    "Update the existing summary with the new exchanges below. Keep the user's "
+    "goals, background and level of understanding, the topics and texts already "
+    "discussed (with verse references), and any open questions.\n"
+    "Write at most a few short paragraphs of plain prose."
+)
+
+# Keep references to in-flight summary tasks so they are not garbage collected
+_summary_tasks: Set[asyncio.Task] = set()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Return the tokenizer for a model, defaulting to the gpt-4o encoding."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Count the tokens ``text`` uses as one chat message for ``model``."""
+    return (
+        len(get_encoding(model).encode(text or "", disallowed_special=()))
+        + TOKENS_PER_MESSAGE
+    )
+
+
+def fit_history(
+    turns: List[Dict], budget: int = HISTORY_TOKEN_BUDGET, model: str = "gpt-4o"
+) -> Tuple[List[Dict], List[Dict]]:
+    """Split chronological turns into (kept, dropped) so kept fits the token budget.
+
+    The most recent turns are kept verbatim; everything older than the first turn
+    that does not fit is dropped.
+    """
+    used = 0
+    cutoff = len(turns)
+    for i in range(len(turns) - 1, -1, -1):
+        turn = turns[i]
+        used += count_tokens(turn["user"], model) + count_tokens(
+            turn["assistant"], model
+        )
+        if used > budget:
+            break
+        cutoff = i
+
+    return turns[cutoff:], turns[:cutoff]
+
+
+async def load_history(
+    db, conversation, model: str = "gpt-4o"
+) -> Tuple[List[Dict], Optional[int]]:
+    """Load the most recent turns of a conversation that fit the history budget.
+
+    Turns already folded into the conversation summary are skipped. Returns the
+    kept turns in chronological order, and the id to summarize up to (exclusive)
+    when earlier turns, loaded or past HISTORY_MAX_TURNS, are not in the summary
+    yet.
+    """
+    if conversation is None:
+        return [], None
+
+    query = select(
+        models.Message.id, models.Message.user_message, models.Message.assistant_message
+    ).filter(models.Message.conversation_id == conversation.id)
+    if conversation.summary_message_id is not None:
+        query = query.filter(models.Message.id > conversation.summary_message_id)
+
+    # One turn past the window, to tell whether older ones were left out
+    result = await db.execute(
+        query.order_by(
+            models.Message.created_at.desc(), models.Message.id.desc()
+        ).limit(HISTORY_MAX_TURNS + 1)
+    )
+    rows = result.all()
+    truncated = len(rows) > HISTORY_MAX_TURNS
+    turns = [
+        {"id": row.id, "user": row.user_message, "assistant": row.assistant_message}
+        for row in reversed(rows[:HISTORY_MAX_TURNS])
+    ]
+
+    kept, dropped = fit_history(turns, HISTORY_TOKEN_BUDGET, model)
+    if not kept:
+        return [], dropped[-1]["id"] + 1 if dropped else None
+    return kept, kept[0]["id"] if dropped or truncated else None
+
+
+def schedule_summary_update(conversation, summarize_before: Optional[int]) -> None:
+    """Fold the turns before ``summarize_before`` into the summary in the background."""
+    if not HISTORY_SUMMARY_ENABLED or summarize_before is None:
+        return
+
+    task = asyncio.create_task(
+        update_summary(
+            conversation.id,
+            conversation.summary,
+            conversation.summary_message_id,
+            summarize_before,
+        )
+    )
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+
+async def _unsummarized_turns(
+    db, conversation_id: int, after_id: Optional[int], before_id: int
+) -> List[Dict]:
+    """The oldest turns between the ids that fit one summary call, at least one."""
+    query = select(
+        models.Message.id, models.Message.user_message, models.Message.assistant_message
+    ).filter(
+        models.Message.conversation_id == conversation_id,
+        models.Message.id < before_id,
+    )
+    if after_id is not None:
+        query = query.filter(models.Message.id > after_id)
+    result = await db.execute(
+        query.order_by(models.Message.id).limit(HISTORY_MAX_TURNS)
+    )
+
+    turns = []
+    used = 0
+    for row in result.all():
+        used += count_tokens(row.user_message) + count_tokens(row.assistant_message)
+        if turns and used > HISTORY_TOKEN_BUDGET:
+            break
+        turns.append(
+            {"id": row.id, "user": row.user_message, "assistant": row.assistant_message}
+        )
+    return turns
+
+
+async def _summarize(summary: Optional[str], turns: List[Dict]) -> str:
+    exchanges = "\n\n".join(
+        f"User: {turn['user']}\nNara: {turn['assistant']}" for turn in turns
+    )
+    completion = await get_llm_client().chat.completions.create(
+        model=HISTORY_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {
+                "role": "user",
+                "content": f"Existing summary:\n{summary or '(none)'}\n\n"
+                f"New exchanges:\n{exchanges}",
+            },
+        ],
+        temperature=0.2,
+        max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+    )
+    return completion.choices[0].message.content
+
+
+async def update_summary(
+    conversation_id: int,
+    summary: Optional[str],
+    summary_message_id: Optional[int],
+    before_id: int,
+) -> None:
+    """Fold turns between ``summary_message_id`` and ``before_id`` into ``summary``.
+
+    Long stretches are folded oldest first, one history budget per summary call.
+    The update stops if another request has moved the summary on since
+    ``summary_message_id`` was read.
+    """
+    try:
+        while True:
+            async with AsyncSessionLocal() as db:
+                turns = await _unsummarized_turns(
+                    db, conversation_id, summary_message_id, before_id
+                )
+            if not turns:
+                return
+            summary = await _summarize(summary, turns)
+
+            async with AsyncSessionLocal() as db:
+                conversation = await db.get(models.Conversation, conversation_id)
+                if (
+                    conversation is None
+                    or conversation.summary_message_id != summary_message_id
+                ):
+                    return
+                summary_message_id = turns[-1]["id"]
+                conversation.summary = summary
+                conversation.summary_message_id = summary_message_id
+                await db.commit()
+    except Exception as e:
+        print(f"Error updating conversation summary: {str(e)}")
@@ -0,0 +1,70 @@
+import os
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+# Connection pool limits and timeouts for the OpenAI HTTP client
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "120"))
+# Chat completions are retried by the LLM scheduler, which honors Retry-After
+# and the request deadline, so the client itself doesn't retry by default
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def create_llm_client() -> AsyncOpenAI:
+    """Create an OpenAI client backed by a keep-alive connection pool."""
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=http_client,
+        max_retries=OPENAI_MAX_RETRIES,
+    )
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = create_llm_client()
+    return _client
+
+
+async def close_llm_client() -> None:
+    """Close the shared client and release its pooled connections."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close()
+
+
+def usage_summary(usage) -> Optional[Dict]:
+    """Token counts for a completion, with prompt tokens split by cache hits."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "cached_prompt_tokens": cached,
+        "uncached_prompt_tokens": usage.prompt_tokens - cached,
+        "completion_tokens": usage.completion_tokens,
+    }
@@ -95,3 +95,34 @@ At the end of every response, you should recommend 3 relevant next questions tha
 
 Always maintain respect for the sacred nature of the texts and traditions while providing clear, accessible explanations that can serve seekers from all philosophical backgrounds and levels of familiarity with Hindu tradition.
 """
+
+# Per-category guidance added to the prompt, keyed by services.classifier categories
+CATEGORY_PROMPTS = {
+    "translation": (
+        "This is a translation question about Hindu philosophy and practice. "
+        "Give the Devanagari, a transliteration and a word-by-word translation "
+        "before interpreting the verse."
+    ),
+    "philosophical": (
+        "This is a philosophical question about Hindu philosophy and practice. "
+        "Explain the concept through its Sanskrit terms and show how the "
+        "relevant darshanas approach it."
+    ),
+    "practical": (
+        "This is a practical question about Hindu philosophy and practice. "
+        "Ground the practice in its scriptural sources and explain how it is "
+        "performed and why."
+    ),
+    "narrative": (
+        "This is a narrative question about Hindu philosophy and practice. Tell "
+        "the story from its source text and draw out the teaching it carries."
+    ),
+    "ethical": (
+        "This is an ethical question about Hindu philosophy and practice. Relate "
+        "it to dharma as the texts describe it and to the user's own situation."
+    ),
+    "general": (
+        "This is a general question about Hindu philosophy and practice. Respond "
+        "accordingly."
+    ),
+}
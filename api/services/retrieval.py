@@ -0,0 +1,178 @@
+import math
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.llm import get_llm_client
+from services.verses import Verse, VerseStore, get_verse_store, tokenize
+
+load_dotenv()
+
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() == "true"
+# "bm25" (lexical only), "vector" (embeddings only) or "hybrid" (both, rank-fused)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "bm25")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# Row i of the embedding matrix is the embedding of verse i in the verse store
+VERSE_EMBEDDINGS_PATH = os.getenv("VERSE_EMBEDDINGS_PATH", "data/verse_embeddings.npy")
+RETRIEVAL_EMBEDDING_MODEL = os.getenv(
+    "RETRIEVAL_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+RETRIEVAL_EMBEDDING_DIMENSIONS = int(os.getenv("RETRIEVAL_EMBEDDING_DIMENSIONS", "256"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant for hybrid retrieval
+RRF_K = 60
+
+
+class VerseRetriever:
+    """Top-k verse retrieval over a VerseStore with BM25 and/or embeddings.
+
+    BM25 uses the store's postings directly: verses are short, so each term is
+    counted once per verse and document length is the number of distinct terms.
+    Per-verse length normalization is precomputed, so a query only touches the
+    postings of its own terms.
+    """
+
+    def __init__(self, store: VerseStore, embeddings: Optional[np.ndarray] = None):
+        self.store = store
+        self.size = len(store)
+        self.embeddings = embeddings
+
+        if self.size:
+            doc_lengths = np.bincount(
+                np.concatenate(
+                    [
+                        np.frombuffer(ids, dtype=np.uint32)
+                        for ids in store.postings.values()
+                    ]
+                ),
+                minlength=self.size,
+            ).astype(np.float32)
+            average = float(doc_lengths.mean()) or 1.0
+            self._norm = (BM25_K1 + 1) / (
+                1 + BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / average)
+            )
+        else:
+            self._norm = np.zeros(0, dtype=np.float32)
+
+    def _idf(self, document_frequency: int) -> float:
+        return math.log(
+            1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5)
+        )
+
+    def bm25(self, query: str, k: int) -> List[int]:
+        """Positions of the top-k verses for ``query`` by BM25, best first."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query, sandhi=True)):
+            ids = self.store.postings.get(term)
+            if not ids:
+                continue
+            ids = np.frombuffer(ids, dtype=np.uint32)
+            scores[ids] += self._idf(len(ids)) * self._norm[ids]
+            matched = True
+
+        if not matched:
+            return []
+        return self._top_k(scores, k)
+
+    def vector(self, query_embedding: np.ndarray, k: int) -> List[int]:
+        """Positions of the top-k verses by cosine similarity, best first."""
+        if self.embeddings is None:
+            return []
+        scores = self.embeddings @ query_embedding.astype(self.embeddings.dtype)
+        return self._top_k(scores, k)
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> List[int]:
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [int(i) for i in top if scores[i] > 0]
+
+    @staticmethod
+    def fuse(rankings: List[List[int]], k: int) -> List[int]:
+        """Combine several rankings with reciprocal rank fusion."""
+        scores: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, i in enumerate(ranking):
+                scores[i] = scores.get(i, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(scores, key=lambda i: -scores[i])[:k]
+
+    async def embed(self, text: str) -> np.ndarray:
+        result = await get_llm_client().embeddings.create(
+            model=RETRIEVAL_EMBEDDING_MODEL,
+            input=text,
+            dimensions=RETRIEVAL_EMBEDDING_DIMENSIONS,
+        )
+        embedding = np.asarray(result.data[0].embedding, dtype=np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+    async def retrieve(
+        self, query: str, k: int = RETRIEVAL_TOP_K, mode: str = RETRIEVAL_MODE
+    ) -> List[Verse]:
+        if not self.size:
+            return []
+
+        rankings = []
+        if mode in ("bm25", "hybrid"):
+            rankings.append(self.bm25(query, k))
+        if mode in ("vector", "hybrid") and self.embeddings is not None:
+            rankings.append(self.vector(await self.embed(query), k))
+
+        ids = rankings[0] if len(rankings) == 1 else self.fuse(rankings, k)
+        return [self.store.verses[i] for i in ids]
+
+
+def load_embeddings(path: str, size: int) -> Optional[np.ndarray]:
+    """Memory-map the verse embedding matrix, if one matching the store exists."""
+    if not os.path.exists(path):
+        return None
+    embeddings = np.load(path, mmap_mode="r")
+    if embeddings.shape[0] != size:
+        print(f"Ignoring {path}: {embeddings.shape[0]} rows for {size} verses")
+        return None
+    return embeddings
+
+
+_retriever: Optional[VerseRetriever] = None
+
+
+def get_retriever() -> VerseRetriever:
+    """Return the process-wide retriever over the verse store."""
+    global _retriever
+    if _retriever is None:
+        store = get_verse_store()
+        embeddings = None
+        if RETRIEVAL_MODE in ("vector", "hybrid"):
+            embeddings = load_embeddings(VERSE_EMBEDDINGS_PATH, len(store))
+        _retriever = VerseRetriever(store, embeddings)
+    return _retriever
+
+
+async def retrieve_verses(question: str) -> List[Verse]:
+    """Retrieve grounding verses for a question; never fails the request."""
+    if not RETRIEVAL_ENABLED:
+        return []
+    try:
+        return await get_retriever().retrieve(question)
+    except Exception as e:
+        print(f"Error retrieving verses: {str(e)}")
+        return []
+
+
+def format_verses_context(verses: List[Verse]) -> str:
+    """Render retrieved verses as grounding context for the prompt."""
+    blocks = [
+        f"[{verse.reference}]\n{verse.devanagari}\n{verse.iast}\n{verse.translation}"
+        for verse in verses
+    ]
+    return (
+        "Relevant verses from our directory of texts. Quote and cite these exactly "
+        "where they support your answer:\n\n" + "\n\n".join(blocks)
+    )
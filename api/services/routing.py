@@ -0,0 +1,201 @@
+import os
+from dataclasses import dataclass
+from functools import partial
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import openai
+from dotenv import load_dotenv
+
+from services.classifier import has_reference
+from services.scheduler import estimate_tokens, llm_scheduler
+
+load_dotenv()
+
+# With routing disabled every question takes LEGACY_ROUTE, the original gpt-4o setup
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+ROUTING_SMALL_MODEL = os.getenv("ROUTING_SMALL_MODEL", "gpt-4o-mini")
+ROUTING_LARGE_MODEL = os.getenv("ROUTING_LARGE_MODEL", "gpt-4o")
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    model: str
+    max_tokens: int
+    temperature: float
+    # Route to retry on when this route's model is unavailable
+    fallback: Optional[str] = None
+
+    @property
+    def params(self) -> Dict:
+        """Completion parameters, also part of the response cache key."""
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+        }
+
+
+@dataclass(frozen=True)
+class RoutingRule:
+    """Sends matching questions to ``route``; unset conditions match anything."""
+
+    route: str
+    categories: Optional[FrozenSet[str]] = None
+    max_words: Optional[int] = None
+    min_words: Optional[int] = None
+    max_turns: Optional[int] = None
+    min_turns: Optional[int] = None
+    # Only match questions that cite a verse or name a Sanskrit term
+    needs_reference: bool = False
+
+    def matches(self, category: str, words: int, turns: int, reference: bool) -> bool:
+        return (
+            (self.categories is None or category in self.categories)
+            and (not self.needs_reference or reference)
+            and (self.max_words is None or words <= self.max_words)
+            and (self.min_words is None or words >= self.min_words)
+            and (self.max_turns is None or turns <= self.max_turns)
+            and (self.min_turns is None or turns >= self.min_turns)
+        )
+
+
+ROUTES: Dict[str, Route] = {
+    route.name: route
+    for route in [
+        Route(
+            "quick",
+            ROUTING_SMALL_MODEL,
+            max_tokens=1500,
+            temperature=0.5,
+            fallback="standard",
+        ),
+        Route(
+            "translation",
+            ROUTING_SMALL_MODEL,
+            max_tokens=2500,
+            temperature=0.3,
+            fallback="standard",
+        ),
+        Route(
+            "standard",
+            ROUTING_LARGE_MODEL,
+            max_tokens=4000,
+            temperature=0.7,
+            fallback="compact",
+        ),
+        Route(
+            "deep",
+            ROUTING_LARGE_MODEL,
+            max_tokens=5000,
+            temperature=0.7,
+            fallback="compact",
+        ),
+        # Only served as a fallback: the small model with a tighter budget, for
+        # when the large model is down or rate limited
+        Route("compact", ROUTING_SMALL_MODEL, max_tokens=2500, temperature=0.7),
+    ]
+}
+
+# Checked in order; the first matching rule picks the route
+ROUTING_RULES: List[RoutingRule] = [
+    # Long conversations and long philosophical questions need the full model and budget
+    RoutingRule("deep", min_turns=6),
+    RoutingRule("deep", categories=frozenset({"philosophical"}), min_words=25),
+    # Short philosophical questions ("what is the nature of atman?") still need
+    # the full model, so this comes before the quick rule
+    RoutingRule("standard", categories=frozenset({"philosophical"})),
+    # Only when there is something to translate, not for "the meaning of life"
+    RoutingRule(
+        "translation",
+        categories=frozenset({"translation"}),
+        max_words=40,
+        needs_reference=True,
+    ),
+    # Short standalone questions ("what is puja?")
+    RoutingRule("quick", max_words=12, max_turns=0),
+]
+
+# Route for questions no rule matches
+DEFAULT_ROUTE = "standard"
+LEGACY_ROUTE = "deep"
+
+# Failures that mean the model can't serve right now, so its fallback should be tried
+_FALLBACK_ERRORS = (
+    openai.NotFoundError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+def select_route(category: str, question: str, turns: int) -> Route:
+    """Pick the route for a question.
+
+    Decided by its category, its length in words, whether it cites a verse or
+    names a Sanskrit term, and the history depth.
+    """
+    if not ROUTING_ENABLED:
+        return ROUTES[LEGACY_ROUTE]
+
+    words = len(question.split())
+    reference = has_reference(question)
+    for rule in ROUTING_RULES:
+        if rule.matches(category, words, turns, reference):
+            return ROUTES[rule.route]
+    return ROUTES[DEFAULT_ROUTE]
+
+
+async def create_completion(
+    client,
+    route: Route,
+    messages: List[Dict],
+    user_id: str = "",
+    deadline: Optional[float] = None,
+    **kwargs,
+) -> Tuple[object, Route]:
+    """Create a chat completion on ``route``, falling back along the route chain.
+
+    Each model is called through the LLM scheduler, which queues the call fairly
+    per ``user_id`` and retries transient failures within ``deadline``; the
+    fallback is tried once the scheduler gives up on a model.
+
+    Returns the completion (or stream) and the route that served it. For streams
+    only errors raised before the first chunk can fall back. Fallback routes on a
+    model that has already failed are skipped.
+    """
+    failed_models = set()
+    while True:
+        try:
+            if llm_scheduler is None:
+                completion = await client.chat.completions.create(
+                    messages=messages, **route.params, **kwargs
+                )
+            else:
+                completion = await llm_scheduler.call(
+                    route.model,
+                    partial(
+                        client.chat.completions.create,
+                        messages=messages,
+                        **route.params,
+                        **kwargs,
+                    ),
+                    user_id=user_id,
+                    tokens=estimate_tokens(messages, route.max_tokens),
+                    deadline=deadline,
+                    stream=kwargs.get("stream", False),
+                    kind=route.name,
+                )
+            return completion, route
+        except _FALLBACK_ERRORS as e:
+            failed_models.add(route.model)
+            fallback = route.fallback
+            while fallback is not None and ROUTES[fallback].model in failed_models:
+                fallback = ROUTES[fallback].fallback
+            if fallback is None:
+                raise
+            print(
+                f"Route {route.name} ({route.model}) failed, "
+                f"falling back to {fallback}: {str(e)}"
+            )
+            route = ROUTES[fallback]
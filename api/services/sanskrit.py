@@ -0,0 +1,361 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Distinct words whose search keys are memoized; corpora and queries are Zipfian
+SEARCH_KEY_CACHE_SIZE = int(os.getenv("SEARCH_KEY_CACHE_SIZE", "200000"))
+# Longest run of adjacent words joined into one term to bridge sandhi splits
+SANDHI_JOIN_WIDTH = int(os.getenv("SANDHI_JOIN_WIDTH", "3"))
+
+SCHEMES = ("devanagari", "iast", "hk", "itrans")
+
+_VOWELS = {
+    "अ": "a",
+    "आ": "ā",
+    "इ": "i",
+    "ई": "ī",
+    "उ": "u",
+    "ऊ": "ū",
+    "ऋ": "ṛ",
+    "ॠ": "ṝ",
+    "ऌ": "ḷ",
+    "ॡ": "ḹ",
+    "ए": "e",
+    "ऐ": "ai",
+    "ओ": "o",
+    "औ": "au",
+    "ऍ": "e",
+    "ऑ": "o",
+}
+_VOWEL_SIGNS = {
+    "ा": "ā",
+    "ि": "i",
+    "ी": "ī",
+    "ु": "u",
+    "ू": "ū",
+    "ृ": "ṛ",
+    "ॄ": "ṝ",
+    "ॢ": "ḷ",
+    "ॣ": "ḹ",
+    "े": "e",
+    "ै": "ai",
+    "ो": "o",
+    "ौ": "au",
+    "ॅ": "e",
+    "ॉ": "o",
+}
+_CONSONANTS = {
+    "क": "k",
+    "ख": "kh",
+    "ग": "g",
+    "घ": "gh",
+    "ङ": "ṅ",
+    "च": "c",
+    "छ": "ch",
+    "ज": "j",
+    "झ": "jh",
+    "ञ": "ñ",
+    "ट": "ṭ",
+    "ठ": "ṭh",
+    "ड": "ḍ",
+    "ढ": "ḍh",
+    "ण": "ṇ",
+    "त": "t",
+    "थ": "th",
+    "द": "d",
+    "ध": "dh",
+    "न": "n",
+    "प": "p",
+    "फ": "ph",
+    "ब": "b",
+    "भ": "bh",
+    "म": "m",
+    "य": "y",
+    "र": "r",
+    "ल": "l",
+    "ळ": "ḻ",
+    "व": "v",
+    "श": "ś",
+    "ष": "ṣ",
+    "स": "s",
+    "ह": "h",
+}
+# Consonant + nukta, as NFC leaves them (क़ etc. are composition exclusions)
+_NUKTA_CONSONANTS = {
+    "क": "q",
+    "ख": "x",
+    "ग": "ġ",
+    "ज": "z",
+    "ड": "ṛ",
+    "ढ": "ṛh",
+    "फ": "f",
+    "य": "ẏ",
+}
+_OTHER_SIGNS = {
+    "ं": "ṃ",
+    "ः": "ḥ",
+    "ँ": "m̐",
+    "ऽ": "'",
+    "ॐ": "oṃ",
+    "।": ".",
+    "॥": "..",
+    **{chr(0x0966 + d): str(d) for d in range(10)},
+}
+NUKTA = "़"
+VIRAMA = "्"
+
+
+def _build_devanagari_table() -> Dict[str, str]:
+    """Every syllable the Devanagari pattern can match, mapped to IAST."""
+    table = {**_VOWELS, **_OTHER_SIGNS}
+    for consonant, roman in _CONSONANTS.items():
+        bases = {consonant: roman}
+        if consonant in _NUKTA_CONSONANTS:
+            bases[consonant + NUKTA] = _NUKTA_CONSONANTS[consonant]
+        for base, base_roman in bases.items():
+            table[base] = base_roman + "a"
+            table[base + VIRAMA] = base_roman
+            for sign, vowel in _VOWEL_SIGNS.items():
+                table[base + sign] = base_roman + vowel
+    return table
+
+
+_DEVANAGARI_TO_IAST = _build_devanagari_table()
+_DEVANAGARI_SYLLABLE = re.compile(
+    "[%s]%s?[%s%s]?|[ऀ-ॿ]" % ("".join(_CONSONANTS), NUKTA, "".join(_VOWEL_SIGNS), VIRAMA)
+)
+_DEVANAGARI = re.compile("[ऀ-ॿ]")
+
+# Romanizations, as differences from IAST; unlisted letters are the same as IAST
+_HK_TO_IAST = {
+    "A": "ā",
+    "I": "ī",
+    "U": "ū",
+    "R": "ṛ",
+    "RR": "ṝ",
+    "lR": "ḷ",
+    "lRR": "ḹ",
+    "M": "ṃ",
+    "H": "ḥ",
+    "G": "ṅ",
+    "J": "ñ",
+    "T": "ṭ",
+    "Th": "ṭh",
+    "D": "ḍ",
+    "Dh": "ḍh",
+    "N": "ṇ",
+    "z": "ś",
+    "S": "ṣ",
+}
+# The first spelling listed for a letter is the one produced when writing ITRANS
+_ITRANS_TO_IAST = {
+    "A": "ā",
+    "aa": "ā",
+    "I": "ī",
+    "ii": "ī",
+    "ee": "ī",
+    "U": "ū",
+    "uu": "ū",
+    "oo": "ū",
+    "RRi": "ṛ",
+    "R^i": "ṛ",
+    "RRI": "ṝ",
+    "R^I": "ṝ",
+    "LLi": "ḷ",
+    "L^i": "ḷ",
+    "LLI": "ḹ",
+    "L^I": "ḹ",
+    "M": "ṃ",
+    ".m": "ṃ",
+    ".n": "ṃ",
+    "H": "ḥ",
+    ".N": "m̐",
+    ".a": "'",
+    ".h": "",
+    "~N": "ṅ",
+    "N^": "ṅ",
+    "~n": "ñ",
+    "JN": "ñ",
+    "ch": "c",
+    "Ch": "ch",
+    "chh": "ch",
+    "T": "ṭ",
+    "Th": "ṭh",
+    "D": "ḍ",
+    "Dh": "ḍh",
+    "N": "ṇ",
+    "sh": "ś",
+    "Sh": "ṣ",
+    "shh": "ṣ",
+    "x": "kṣ",
+    "kSh": "kṣ",
+    "GY": "jñ",
+    "j~n": "jñ",
+    "dny": "jñ",
+    "v": "v",
+    "w": "v",
+    "OM": "oṃ",
+    "AUM": "oṃ",
+}
+
+# IAST letters, for reading romanized text back into syllables
+_IAST_VOWELS = {
+    roman: letter for letter, roman in _VOWELS.items() if letter not in "ऍऑ"
+}
+_IAST_VOWEL_SIGNS = {
+    roman: sign for sign, roman in _VOWEL_SIGNS.items() if sign not in "ॅॉ"
+}
+_IAST_CONSONANTS = {roman: letter for letter, roman in _CONSONANTS.items()}
+_IAST_OTHER = {"ṃ": "ं", "ṁ": "ं", "ḥ": "ः", "m̐": "ँ", "'": "ऽ", "..": "॥", ".": "।"}
+
+# Loose ASCII spellings folded together so "krishna", "kṛṣṇa" and "krsna" meet
+_ASCII_FOLDS = {
+    "chh": "c",
+    "ch": "c",
+    "sh": "s",
+    "ri": "r",
+    "gy": "jn",
+    "w": "v",
+    "aa": "a",
+    "ii": "i",
+    "ee": "i",
+    "uu": "u",
+    "oo": "u",
+}
+
+
+def _compile(table: Dict[str, str]) -> Callable[[str], str]:
+    """Compile a mapping into a single longest-match substitution."""
+    pattern = re.compile(
+        "|".join(re.escape(key) for key in sorted(table, key=len, reverse=True))
+    )
+    return lambda text: pattern.sub(lambda m: table[m.group()], text)
+
+
+def _invert(table: Dict[str, str]) -> Dict[str, str]:
+    inverse = {}
+    for key, value in table.items():
+        if value:
+            inverse.setdefault(value, key)
+    return inverse
+
+
+_FROM_IAST = {
+    "hk": _compile(_invert(_HK_TO_IAST)),
+    "itrans": _compile(_invert(_ITRANS_TO_IAST)),
+}
+_TO_IAST = {"hk": _compile(_HK_TO_IAST), "itrans": _compile(_ITRANS_TO_IAST)}
+_fold_ascii = _compile(_ASCII_FOLDS)
+
+_IAST_LETTER = re.compile(
+    "|".join(
+        re.escape(letter)
+        for letter in sorted(
+            {**_IAST_VOWELS, **_IAST_CONSONANTS, **_IAST_OTHER}, key=len, reverse=True
+        )
+    )
+    + "|.",
+    re.DOTALL,
+)
+
+
+def normalize(text: str) -> str:
+    """NFC-normalize text and drop zero-width joiners that split Devanagari words."""
+    return (
+        unicodedata.normalize("NFC", text).replace("\u200c", "").replace("\u200d", "")
+    )
+
+
+def strip_marks(text: str) -> str:
+    """Remove combining marks, e.g. "kṛṣṇa" -> "krsna"."""
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+    )
+
+
+def devanagari_to_iast(text: str) -> str:
+    return _DEVANAGARI_SYLLABLE.sub(
+        lambda m: _DEVANAGARI_TO_IAST.get(m.group(), m.group()), normalize(text)
+    )
+
+
+def iast_to_devanagari(text: str) -> str:
+    output = []
+    pending = False  # Last letter was a consonant still waiting for its vowel
+    for m in _IAST_LETTER.finditer(normalize(text).lower()):
+        letter = m.group()
+        if letter in _IAST_CONSONANTS:
+            if pending:
+                output.append(VIRAMA)
+            output.append(_IAST_CONSONANTS[letter])
+            pending = True
+        elif letter in _IAST_VOWELS:
+            if pending:
+                if letter != "a":
+                    output.append(_IAST_VOWEL_SIGNS[letter])
+            else:
+                output.append(_IAST_VOWELS[letter])
+            pending = False
+        else:
+            if pending:
+                output.append(VIRAMA)
+            output.append(_IAST_OTHER.get(letter, letter))
+            pending = False
+    if pending:
+        output.append(VIRAMA)
+    return "".join(output)
+
+
+def transliterate(text: str, source: str, target: str) -> str:
+    """Convert text between "devanagari", "iast", "hk" (Harvard-Kyoto) and "itrans"."""
+    for scheme in (source, target):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown transliteration scheme: {scheme}")
+
+    if source == "devanagari":
+        iast = devanagari_to_iast(text)
+    elif source == "iast":
+        iast = normalize(text)
+    else:
+        iast = _TO_IAST[source](normalize(text))
+
+    if target == "iast":
+        return iast
+    if target == "devanagari":
+        return iast_to_devanagari(iast)
+    return _FROM_IAST[target](iast)
+
+
+@lru_cache(maxsize=SEARCH_KEY_CACHE_SIZE)
+def search_key(word: str) -> str:
+    """ASCII matching key for a word in any script.
+
+    Devanagari is transliterated, diacritics are dropped and common loose
+    spellings are folded, so "कर्म", "karma" and "kárma" share a key. Keys are for
+    matching only; they are not meant to be read.
+    """
+    if _DEVANAGARI.search(word):
+        word = devanagari_to_iast(word)
+    return _fold_ascii(strip_marks(word.lower())).replace("'", "")
+
+
+def sandhi_joins(keys: List[str], width: int = SANDHI_JOIN_WIDTH) -> List[str]:
+    """Concatenations of 2..width adjacent keys.
+
+    Sandhi fuses words in the original ("कर्मण्येवाधिकारस्ते") while queries and
+    romanized editions split them in different places ("karmanye vadhikaraste",
+    "karmaṇy evādhikāras te"); joined runs let the splits meet.
+    """
+    joins = []
+    for start in range(len(keys)):
+        joined = keys[start]
+        for end in range(start + 1, min(start + width, len(keys))):
+            joined += keys[end]
+            joins.append(joined)
+    return joins
@@ -0,0 +1,498 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Optional,
+    Tuple,
+)
+
+import openai
+from dotenv import load_dotenv
+
+from utils.metrics import LLM_QUEUE_SECONDS
+
+load_dotenv()
+
+# With the scheduler disabled completions are sent straight to the client
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() == "true"
+# Adaptive concurrency limit per model: starts at the initial value, doubles per
+# window of successful calls until the first overload, then grows by one per window
+# and is cut by LLM_BACKOFF_RATIO on overload.
+# Unset, the initial value is sized from the model's LLM_RPM_LIMITS entry: by
+# Little's law rpm / 60 * LLM_EXPECTED_LATENCY calls are in flight at full rate.
+# Models without a known rate limit start at 16.
+LLM_INITIAL_CONCURRENCY = os.getenv("LLM_INITIAL_CONCURRENCY")
+LLM_EXPECTED_LATENCY = float(os.getenv("LLM_EXPECTED_LATENCY", "10"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "128"))
+LLM_BACKOFF_RATIO = float(os.getenv("LLM_BACKOFF_RATIO", "0.5"))
+# A call slower than this multiple of the typical latency signals overload. Whole
+# completions are compared per generated token, streams by time to first byte.
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.5"))
+# Per-model request and token rate limits, e.g. "gpt-4o=5000,gpt-4o-mini=10000".
+# Models left out are not rate limited locally.
+LLM_RPM_LIMITS = os.getenv("LLM_RPM_LIMITS", "")
+LLM_TPM_LIMITS = os.getenv("LLM_TPM_LIMITS", "")
+# Calls waiting per model, and per user within a model, before new ones are rejected
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "500"))
+LLM_USER_QUEUE_LIMIT = int(os.getenv("LLM_USER_QUEUE_LIMIT", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+# Seconds an HTTP request may spend on its answer, queueing and retries included
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "120"))
+
+# Short answers are dominated by the fixed round trip, so they count as this many
+# tokens when their latency is compared per token
+_MIN_PACED_TOKENS = 64
+
+# Errors worth retrying, after the Retry-After delay if the response has one
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class SchedulerError(Exception):
+    """A call the scheduler gave up on, with the HTTP status to answer with."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OverloadedError(SchedulerError):
+    status_code = 503
+
+
+class UserQueueFullError(SchedulerError):
+    status_code = 429
+
+
+class DeadlineExceededError(SchedulerError):
+    status_code = 504
+
+
+def _parse_limits(value: str) -> Dict[str, float]:
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            model, limit = item.split("=")
+            limits[model.strip()] = float(limit)
+    return limits
+
+
+def initial_concurrency(rpm: Optional[float] = None) -> float:
+    """Starting concurrency limit for a model allowed ``rpm`` requests a minute."""
+    if LLM_INITIAL_CONCURRENCY:
+        return float(LLM_INITIAL_CONCURRENCY)
+    if rpm:
+        return rpm / 60 * LLM_EXPECTED_LATENCY
+    return 16.0
+
+
+def request_deadline(timeout: Optional[float] = None) -> float:
+    """Absolute deadline (monotonic clock) for a request starting now."""
+    if timeout is None or timeout <= 0:
+        timeout = LLM_REQUEST_DEADLINE
+    return time.monotonic() + min(timeout, LLM_REQUEST_DEADLINE)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After(-Ms) headers."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    # An exhausted quota won't recover by waiting
+    if (
+        isinstance(error, openai.RateLimitError)
+        and getattr(error, "code", None) == "insufficient_quota"
+    ):
+        return False
+    return isinstance(error, _RETRYABLE_ERRORS)
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Retry-After when given, otherwise full-jitter exponential backoff."""
+    delay = retry_after(error)
+    if delay is not None:
+        # A little jitter so callers told the same delay don't return in lockstep
+        return delay + random.uniform(0, 0.1 * delay + LLM_RETRY_BASE_DELAY)
+    return random.uniform(
+        0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt)
+    )
+
+
+class TokenBucket:
+    """Continuously refilled budget of ``per_minute`` units; no limit when None."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.tokens = per_minute or 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.capacity / 60
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available."""
+        if self.capacity is None:
+            return 0.0
+        self._refill()
+        # Anything bigger than the bucket only has to wait for a full one
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float) -> None:
+        if self.capacity is not None:
+            self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        if self.capacity is not None:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ModelLimiter:
+    """Admission control for one model.
+
+    Calls wait in per-user queues that are served round-robin, so one user's
+    burst can't starve everyone else. A call is admitted when the adaptive
+    concurrency limit has room and the request and token buckets can cover it.
+    The limit follows AIMD: it grows by one per window of calls that finish
+    within tolerance of the typical latency (doubling per window until the first
+    overload) and is cut by LLM_BACKOFF_RATIO on rate limits, errors or slow
+    calls, at most once per typical round trip.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        initial_limit: Optional[float] = None,
+        max_limit: float = LLM_MAX_CONCURRENCY,
+    ):
+        self.model = model
+        self.max_limit = max_limit
+        if initial_limit is None:
+            initial_limit = initial_concurrency(rpm)
+        self.limit = float(min(max_limit, max(LLM_MIN_CONCURRENCY, initial_limit)))
+        self._slow_start = True
+        self.in_flight = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queues: "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]" = (
+            OrderedDict()
+        )
+        self._queued = 0
+        # Exponentially weighted typical latency per kind of call: streams by time
+        # to first byte, whole completions per generated token
+        self._latency: Dict[Tuple[bool, Hashable], float] = {}
+        # And the typical wait for an answer in seconds, to pace cuts and retries
+        self._round_trip: Optional[float] = None
+        self._last_decrease = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    async def acquire(
+        self, user_id: str, tokens: float, deadline: Optional[float]
+    ) -> None:
+        """Wait for a slot and budget for a call of roughly ``tokens`` tokens."""
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= LLM_USER_QUEUE_LIMIT:
+            raise UserQueueFullError(
+                f"Too many questions waiting for {self.model}",
+                retry_after=self._typical_latency(),
+            )
+        if self._queued >= LLM_QUEUE_LIMIT:
+            raise OverloadedError(
+                f"Too many questions waiting for {self.model}",
+                retry_after=self._typical_latency(),
+            )
+
+        waiter = (asyncio.get_running_loop().create_future(), tokens)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self._dispatch()
+
+        started = time.perf_counter()
+        try:
+            if not waiter[0].done():
+                await asyncio.wait_for(waiter[0], _remaining(deadline))
+            LLM_QUEUE_SECONDS.labels(self.model).observe(time.perf_counter() - started)
+        except BaseException as e:
+            if waiter[0].done() and not waiter[0].cancelled():
+                # Admitted just as we gave up
+                self.release(tokens)
+            else:
+                self._discard(user_id, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceededError(
+                    f"Timed out waiting for {self.model}"
+                ) from None
+            raise
+
+    def _discard(self, user_id: str, waiter) -> None:
+        queue = self._queues.get(user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._queues[user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit waiting calls, one per user in turn, while there is capacity."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queues and self.in_flight < int(self.limit):
+            user_id, queue = next(iter(self._queues.items()))
+            future, tokens = queue[0]
+            if not future.done():
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait > 0:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        wait, self._dispatch
+                    )
+                    return
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                self.in_flight += 1
+                future.set_result(None)
+
+            queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Back of the line until every other user has had a turn
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+
+    def release(
+        self,
+        reserved_tokens: float,
+        used_tokens: Optional[float] = None,
+        latency: Optional[float] = None,
+        stream: bool = False,
+        overloaded: bool = False,
+        completion_tokens: Optional[float] = None,
+        kind: Hashable = None,
+    ) -> None:
+        """Free a slot, settle the token reservation and adapt the limit.
+
+        ``latency`` is the time to the answer, or to the first byte of a stream.
+        A whole completion's latency is judged per ``completion_tokens``, and
+        only against earlier calls of the same ``kind`` (e.g. route).
+        """
+        self.in_flight -= 1
+        if used_tokens is not None:
+            self.tokens.refund(reserved_tokens - used_tokens)
+
+        if latency is not None:
+            self._round_trip = _ewma(self._round_trip, latency)
+            if stream:
+                pace = latency
+            elif completion_tokens is not None:
+                pace = latency / max(completion_tokens, _MIN_PACED_TOKENS)
+            else:
+                # Without usage the latency can't be told apart from answer length
+                pace = None
+            if pace is not None and not overloaded:
+                typical = self._latency.get((stream, kind))
+                overloaded = (
+                    typical is not None and pace > typical * LLM_LATENCY_TOLERANCE
+                )
+                self._latency[(stream, kind)] = _ewma(typical, pace)
+
+        if overloaded:
+            now = time.monotonic()
+            # One cut per round trip, however many calls report the same overload
+            if now - self._last_decrease > (self._typical_latency() or 1.0):
+                self.limit = max(LLM_MIN_CONCURRENCY, self.limit * LLM_BACKOFF_RATIO)
+                self._last_decrease = now
+            self._slow_start = False
+        elif latency is not None:
+            step = 1 if self._slow_start else 1 / self.limit
+            self.limit = min(self.max_limit, self.limit + step)
+
+        self._dispatch()
+
+    def _typical_latency(self) -> Optional[float]:
+        return self._round_trip
+
+
+def _ewma(average: Optional[float], value: float) -> float:
+    return value if average is None else 0.9 * average + 0.1 * value
+
+
+class LLMScheduler:
+    """Runs completion calls through per-model limiters with retries and deadlines."""
+
+    def __init__(
+        self,
+        rpm_limits: str = LLM_RPM_LIMITS,
+        tpm_limits: str = LLM_TPM_LIMITS,
+        initial_limit: Optional[float] = None,
+        max_limit: float = LLM_MAX_CONCURRENCY,
+    ):
+        self.rpm_limits = _parse_limits(rpm_limits)
+        self.tpm_limits = _parse_limits(tpm_limits)
+        # Concurrency limits for every model; by default see initial_concurrency()
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        if model not in self.limiters:
+            self.limiters[model] = ModelLimiter(
+                model,
+                self.rpm_limits.get(model),
+                self.tpm_limits.get(model),
+                initial_limit=self.initial_limit,
+                max_limit=self.max_limit,
+            )
+        return self.limiters[model]
+
+    async def call(
+        self,
+        model: str,
+        request: Callable[..., Awaitable],
+        user_id: str,
+        tokens: float,
+        deadline: Optional[float] = None,
+        stream: bool = False,
+        kind: Hashable = None,
+    ):
+        """Await ``request(**options)`` once admitted, retrying transient failures.
+
+        ``tokens`` is the estimated cost, settled against the reported usage. The
+        per-attempt timeout is cut to what is left of the deadline. A stream keeps
+        its slot until it has been read to the end or closed. Calls of one
+        ``kind`` (e.g. route) share a typical latency to detect overload against.
+        """
+        limiter = self.limiter(model)
+        attempt = 0
+        while True:
+            await limiter.acquire(user_id, tokens, deadline)
+            options = {}
+            remaining = _remaining(deadline)
+            if remaining is not None:
+                options["timeout"] = max(remaining, 0.001)
+
+            started = time.monotonic()
+            try:
+                result = await request(**options)
+            except Exception as e:
+                retryable = is_retryable(e)
+                limiter.release(tokens, overloaded=retryable)
+                if not retryable or attempt >= LLM_MAX_RETRIES:
+                    raise
+                delay = retry_delay(e, attempt)
+                remaining = _remaining(deadline)
+                if remaining is not None and delay >= remaining:
+                    raise
+                attempt += 1
+                print(
+                    f"{model} call failed ({type(e).__name__}), "
+                    f"retry {attempt} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                limiter.release(tokens)
+                raise
+
+            latency = time.monotonic() - started
+            if stream:
+                return self._release_after(limiter, result, tokens, latency, kind)
+            usage = getattr(result, "usage", None)
+            limiter.release(
+                tokens,
+                getattr(usage, "total_tokens", None),
+                latency,
+                completion_tokens=getattr(usage, "completion_tokens", None),
+                kind=kind,
+            )
+            return result
+
+    @staticmethod
+    async def _release_after(
+        limiter: ModelLimiter, stream, tokens: float, latency: float, kind: Hashable
+    ) -> AsyncIterator:
+        used = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    used = usage.total_tokens
+                yield chunk
+        finally:
+            limiter.release(tokens, used, latency, stream=True, kind=kind)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                await close()
+
+
+def error_status(error: Exception) -> Tuple[int, Optional[float]]:
+    """HTTP status and Retry-After seconds to answer a failed question with."""
+    if isinstance(error, SchedulerError):
+        return error.status_code, error.retry_after
+    if isinstance(error, openai.APITimeoutError):
+        return 504, None
+    if isinstance(error, _RETRYABLE_ERRORS) and is_retryable(error):
+        # Upstream is rate limiting or failing us, not the client
+        return 503, retry_after(error)
+    return 500, None
+
+
+def estimate_tokens(messages, max_tokens: int) -> float:
+    """Rough token cost of a call.
+
+    About four characters per prompt token, plus the output budget.
+    """
+    return sum(len(message["content"]) for message in messages) / 4 + max_tokens
+
+
+llm_scheduler = LLMScheduler() if LLM_SCHEDULER_ENABLED else None
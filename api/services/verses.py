@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import zlib
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from services.sanskrit import normalize, sandhi_joins, search_key, strip_marks
+
+load_dotenv()
+
+VERSE_CORPUS_PATH = os.getenv("VERSE_CORPUS_PATH", "data/verses.idx")
+
+# Canonical text ids and the names they are cited by
+TEXTS = {
+    "bhagavad-gita": [
+        "bhagavad gita",
+        "bhagavadgita",
+        "gita",
+        "bg",
+        "srimad bhagavad gita",
+    ],
+    "isha-upanishad": [
+        "isha upanishad",
+        "isa upanishad",
+        "ishopanishad",
+        "isavasya upanishad",
+    ],
+    "kena-upanishad": ["kena upanishad"],
+    "katha-upanishad": ["katha upanishad", "kathopanishad"],
+    "mundaka-upanishad": ["mundaka upanishad"],
+    "mandukya-upanishad": ["mandukya upanishad"],
+    "taittiriya-upanishad": ["taittiriya upanishad"],
+    "chandogya-upanishad": ["chandogya upanishad"],
+    "brihadaranyaka-upanishad": ["brihadaranyaka upanishad"],
+    "yoga-sutras": ["yoga sutras", "yoga sutra", "patanjali yoga sutras"],
+    "rig-veda": ["rig veda", "rigveda", "rv"],
+}
+
+_ALIASES = {
+    alias: text_id
+    for text_id, aliases in TEXTS.items()
+    for alias in aliases + [text_id.replace("-", " ")]
+}
+
+MAGIC = b"NARAVRS1"
+# Bumped whenever tokenize() changes, since postings are stored pre-tokenized
+INDEX_VERSION = 2
+
+# Word characters, including Devanagari vowel signs but not the danda punctuation
+_WORD = re.compile(r"[\w\u0900-\u0963\u0966-\u097F]+")
+_STOPWORDS = frozenset(
+    (
+        "a an and are as at be by for from has he in is it its of on or that the this "
+        "to was were will with"
+    ).split()
+)
+
+
+def canonical_text_id(name: str) -> Optional[str]:
+    """Resolve a text name or alias (e.g. "Bhagavad Gita", "BG") to its canonical id."""
+    key = " ".join(
+        strip_marks(name).lower().replace("-", " ").replace("_", " ").split()
+    )
+    return _ALIASES.get(key)
+
+
+def tokenize(text: str, sandhi: bool = False) -> List[str]:
+    """Split text into index terms: lowercased words plus their search keys.
+
+    Search keys match across Devanagari, IAST and loose ASCII spellings. With
+    ``sandhi`` the keys of adjacent words are also joined, for Sanskrit text and
+    queries whose word boundaries may differ from the corpus.
+    """
+    tokens = []
+    keys = []
+    for word in _WORD.findall(normalize(text).lower()):
+        if word in _STOPWORDS:
+            continue
+        tokens.append(word)
+        key = search_key(word)
+        if key != word:
+            tokens.append(key)
+        keys.append(key)
+    if sandhi:
+        tokens.extend(sandhi_joins(keys))
+    return tokens
+
+
+@dataclass(frozen=True)
+class Verse:
+    text: str
+    chapter: int
+    verse: int
+    devanagari: str
+    iast: str
+    translation: str
+
+    @property
+    def reference(self) -> str:
+        return f"{self.text} {self.chapter}.{self.verse}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "text": self.text,
+            "chapter": self.chapter,
+            "verse": self.verse,
+            "reference": self.reference,
+            "devanagari": self.devanagari,
+            "iast": self.iast,
+            "translation": self.translation,
+        }
+
+
+class VerseStore:
+    """In-memory verse corpus with O(1) reference lookup and an inverted index.
+
+    Verses are addressed by position; ``postings`` maps each normalized term to
+    the sorted positions of the verses containing it.
+    """
+
+    def __init__(self, verses: List[Verse], postings: Dict[str, array]):
+        self.verses = verses
+        self.postings = postings
+        self._by_reference: Dict[Tuple[str, int, int], int] = {
+            (verse.text, verse.chapter, verse.verse): i
+            for i, verse in enumerate(verses)
+        }
+
+    def __len__(self) -> int:
+        return len(self.verses)
+
+    @staticmethod
+    def verse_terms(verse: Verse) -> Iterable[str]:
+        return set(
+            tokenize(verse.devanagari, sandhi=True)
+            + tokenize(verse.iast, sandhi=True)
+            + tokenize(verse.translation)
+        )
+
+    @classmethod
+    def build(cls, records: Iterable[Dict]) -> "VerseStore":
+        """Build a store from verse dicts.
+
+        Each has text, chapter, verse, devanagari, iast and translation.
+        """
+        verses = []
+        for record in records:
+            text_id = canonical_text_id(record["text"]) or record["text"]
+            verses.append(
+                Verse(
+                    text=text_id,
+                    chapter=int(record["chapter"]),
+                    verse=int(record["verse"]),
+                    devanagari=normalize(record.get("devanagari", "")),
+                    iast=normalize(record.get("iast", "")),
+                    translation=record.get("translation", ""),
+                )
+            )
+        verses.sort(key=lambda v: (v.text, v.chapter, v.verse))
+
+        postings = defaultdict(lambda: array("I"))
+        for i, verse in enumerate(verses):
+            for term in cls.verse_terms(verse):
+                postings[term].append(i)
+        return cls(verses, dict(postings))
+
+    def get(self, text: str, chapter: int, verse: int) -> Optional[Verse]:
+        """Look up a verse by reference; ``text`` may be any known alias."""
+        text_id = canonical_text_id(text) or text
+        i = self._by_reference.get((text_id, chapter, verse))
+        return self.verses[i] if i is not None else None
+
+    def search(self, query: str, limit: int = 10) -> List[Verse]:
+        """Return verses containing the most query terms, best first."""
+        counts: Dict[int, int] = defaultdict(int)
+        for term in set(tokenize(query, sandhi=True)):
+            for i in self.postings.get(term, ()):
+                counts[i] += 1
+        best = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [self.verses[i] for i, _ in best]
+
+    def save(self, path: str) -> None:
+        """Write the store as zlib-compressed JSON with delta-encoded postings."""
+        payload = {
+            "version": INDEX_VERSION,
+            "verses": [
+                [v.text, v.chapter, v.verse, v.devanagari, v.iast, v.translation]
+                for v in self.verses
+            ],
+            "postings": {
+                term: [ids[0]] + [b - a for a, b in zip(ids, ids[1:])]
+                for term, ids in self.postings.items()
+            },
+        }
+        data = zlib.compress(
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(), 9
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(data)
+
+    @classmethod
+    def load(cls, path: str) -> "VerseStore":
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a verse index")
+            payload = json.loads(zlib.decompress(f.read()))
+        if payload.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"{path} is an old verse index; "
+                "rebuild it with scripts/build_verse_index.py"
+            )
+
+        verses = [Verse(*row) for row in payload["verses"]]
+        postings = {}
+        for term, deltas in payload["postings"].items():
+            ids = array("I", deltas)
+            for j in range(1, len(ids)):
+                ids[j] += ids[j - 1]
+            postings[term] = ids
+        return cls(verses, postings)
+
+
+_store: Optional[VerseStore] = None
+
+
+def get_verse_store() -> VerseStore:
+    """Return the process-wide verse store, loading VERSE_CORPUS_PATH on first use."""
+    global _store
+    if _store is None:
+        if os.path.exists(VERSE_CORPUS_PATH):
+            _store = VerseStore.load(VERSE_CORPUS_PATH)
+        else:
+            print(f"No verse index at {VERSE_CORPUS_PATH}; verse lookups will be empty")
+            _store = VerseStore([], {})
+    return _store
@@ -0,0 +1,5 @@
+import os
+
+# utils.database builds its engines at import time; point them at SQLite so
+# the tests need no Postgres
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
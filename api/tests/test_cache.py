@@ -0,0 +1,57 @@
+import asyncio
+import sqlite3
+
+import numpy as np
+
+from services.cache import (
+    CacheLookup,
+    InMemoryCacheBackend,
+    ResponseCache,
+    SQLiteCacheBackend,
+)
+
+QUERY = np.array([1.0, 0.0], dtype=np.float32)
+BEST = np.array([1.0, 0.0], dtype=np.float32)
+NEXT_BEST = np.array([0.8, 0.6], dtype=np.float32)
+
+
+async def _fill(backend):
+    await backend.set("best", "scope", "best question", "best answer", BEST)
+    await backend.set("next", "scope", "next question", "next answer", NEXT_BEST)
+
+
+def test_sqlite_nearest_skips_an_evicted_best_match(tmp_path):
+    backend = SQLiteCacheBackend(path=str(tmp_path / "cache.db"))
+    asyncio.run(_fill(backend))
+    # Index both rows, then evict the best one as another worker would
+    assert asyncio.run(backend.nearest("scope", QUERY))[0] == "best answer"
+    with sqlite3.connect(backend.path) as conn:
+        conn.execute("DELETE FROM response_cache WHERE key = 'best'")
+
+    response, similarity = asyncio.run(backend.nearest("scope", QUERY))
+
+    assert response == "next answer"
+    assert similarity == np.float32(0.8)
+    backend.close()
+
+
+def test_in_memory_nearest_skips_an_expired_best_match():
+    backend = InMemoryCacheBackend()
+    asyncio.run(_fill(backend))
+    # Expired in the entry table but not yet in the index
+    expires_at, scope, response, embedding = backend._entries["best"]
+    backend._entries["best"] = (0.0, scope, response, embedding)
+
+    assert asyncio.run(backend.nearest("scope", QUERY))[0] == "next answer"
+
+
+class FailingBackend:
+    async def set(self, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_store_errors_are_not_raised():
+    cache = ResponseCache(FailingBackend(), semantic=False)
+    lookup = CacheLookup(key="key", scope="scope", question="question")
+
+    asyncio.run(cache.store(lookup, "answer"))
@@ -0,0 +1,66 @@
+from services.citations import correct_devanagari, extract_citations
+from services.verses import VerseStore
+
+GITA_2_47 = "कर्मण्येवाधिकारस्ते मा फलेषु कदाचन ।\nमा कर्मफलहेतुर्भूर्मा ते सङ्गोऽस्त्वकर्मणि ॥"
+# "फलेशु" for "फलेषु" on the first line
+MISQUOTED = "कर्मण्येवाधिकारस्ते मा फलेशु कदाचन ।\nमा कर्मफलहेतुर्भूर्मा ते सङ्गोऽस्त्वकर्मणि ॥"
+
+STORE = VerseStore.build(
+    [
+        {
+            "text": "bhagavad-gita",
+            "chapter": 2,
+            "verse": 47,
+            "devanagari": GITA_2_47,
+            "iast": "karmaṇy evādhikāras te mā phaleṣu kadācana",
+            "translation": "You have a right to your actions, never to their fruits.",
+        }
+    ]
+)
+
+
+def _answer(quote: str) -> str:
+    first, second = quote.split("\n")
+    return (
+        "The Bhagavad Gita (Chapter 2, Verse 47) says:\n"
+        "\n"
+        f'"{first}\n'
+        f'{second}"\n'
+        "\n"
+        "Act without attachment to the results."
+    )
+
+
+def test_two_line_misquote_is_corrected_in_place():
+    answer = _answer(MISQUOTED)
+    citations = extract_citations(answer, STORE)
+    [citation] = citations
+    assert citation["devanagari_matches"] is False
+
+    corrected = correct_devanagari(answer, citations)
+
+    assert corrected == _answer(GITA_2_47)
+    assert citation["devanagari_matches"] is True
+    assert citation["devanagari_corrected"] is True
+    assert citation["quoted_devanagari"] == GITA_2_47
+
+
+def test_correct_quote_is_left_alone():
+    answer = _answer(GITA_2_47)
+    citations = extract_citations(answer, STORE)
+
+    assert correct_devanagari(answer, citations) == answer
+    assert citations[0]["devanagari_matches"] is True
+    assert citations[0]["devanagari_corrected"] is False
+
+
+def test_unmatched_spans_are_not_marked_corrected():
+    answer = _answer(MISQUOTED)
+    citations = extract_citations(answer, STORE)
+    # Not the text the citations were extracted from, so the spans don't hold the quote
+    other = answer.replace("फलेशु", "फलेस")
+
+    assert correct_devanagari(other, citations) == other
+    assert citations[0]["devanagari_matches"] is False
+    assert citations[0]["devanagari_corrected"] is False
+    assert citations[0]["quoted_devanagari"] == MISQUOTED
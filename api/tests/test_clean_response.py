@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from services.chat import ResponseCleaner, clean_response
+
+# The characters that matter to the cleaner: line breaks of every kind,
+# whitespace and asterisks, plus a little text
+ALPHABET = [
+    "a",
+    "b",
+    "x y",
+    " ",
+    "\t",
+    "*",
+    "**",
+    "***",
+    "\n",
+    "\n\n",
+    "\r",
+    "\r\n",
+    "\v",
+    "\f",
+    "\x1c",
+    "\x85",
+    " ",
+    " ",
+]
+
+
+def legacy_clean_response(text: str) -> str:
+    """The original multi-pass implementation, kept as the reference."""
+    text = text.replace("***", "**")
+
+    lines = text.splitlines()
+    cleaned_lines = []
+    prev_line_empty = False
+
+    for line in lines:
+        stripped_line = line.strip()
+
+        if not stripped_line:
+            if not prev_line_empty:
+                cleaned_lines.append("")
+            prev_line_empty = True
+            continue
+
+        cleaned_lines.append(stripped_line)
+        prev_line_empty = False
+
+    text = "\n".join(cleaned_lines)
+
+    paragraphs = text.split("\n\n")
+    cleaned_paragraphs = []
+
+    for para in paragraphs:
+        para = para.strip()
+        if para:
+            cleaned_paragraphs.append(para)
+
+    return "\n\n".join(cleaned_paragraphs)
+
+
+def random_texts(seed: int, cases: int):
+    rng = random.Random(seed)
+    for _ in range(cases):
+        yield rng, "".join(rng.choices(ALPHABET, k=rng.randint(0, 40)))
+
+
+def stream_clean(text: str, rng: random.Random, max_chunk: int) -> str:
+    """Feed the text to a ResponseCleaner in random chunks of up to max_chunk."""
+    cleaner = ResponseCleaner()
+    out = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, max_chunk)
+        out.append(cleaner.feed(text[i : i + n]))
+        i += n
+    out.append(cleaner.finish())
+    # What feed/finish return adds up to the accumulated text
+    assert "".join(out) == cleaner.text
+    return cleaner.text
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "   \n\n  ",
+        "***bold***",
+        "## Title\n\n\n\nBody  \n  more",
+        "a\r\nb\rc\n\n\r\n\r\nd",
+        "line next\x85last",
+    ],
+)
+def test_clean_response_matches_legacy_examples(text):
+    assert clean_response(text) == legacy_clean_response(text)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_clean_response_matches_legacy(seed):
+    for _, text in random_texts(seed, 5000):
+        assert clean_response(text) == legacy_clean_response(text), repr(text)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_streamed_cleaning_matches_legacy(seed):
+    for rng, text in random_texts(seed, 5000):
+        expected = legacy_clean_response(text)
+        assert stream_clean(text, rng, max_chunk=6) == expected, repr(text)
+
+
+def test_streamed_cleaning_one_character_at_a_time():
+    for rng, text in random_texts(99, 2000):
+        expected = legacy_clean_response(text)
+        assert stream_clean(text, rng, max_chunk=1) == expected, repr(text)
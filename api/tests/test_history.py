@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import models
+from services import history
+from utils.database import Base
+
+
+class FakeClient:
+    """Stands in for the summary model, recording each prompt it is sent."""
+
+    def __init__(self):
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=self)
+
+    async def create(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        message = SimpleNamespace(content=f"summary {len(self.prompts)}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    """A SQLite database with one conversation of twelve short turns."""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'nara.db'}", poolclass=NullPool
+    )
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with factory() as db:
+            db.add(models.User(id=1, supabase_id="sup-1", email="a@example.com"))
+            db.add(models.Conversation(id=1, user_id=1))
+            for i in range(1, 13):
+                db.add(
+                    models.Message(
+                        id=i,
+                        conversation_id=1,
+                        user_message=f"question {i}",
+                        assistant_message=f"answer {i}",
+                    )
+                )
+            await db.commit()
+
+    asyncio.run(setup())
+    monkeypatch.setattr(history, "AsyncSessionLocal", factory)
+    monkeypatch.setattr(history, "HISTORY_MAX_TURNS", 5)
+    # Rough counts, so the tests don't need the tokenizer files
+    monkeypatch.setattr(history, "count_tokens", lambda text, model="gpt-4o": len(text))
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def test_turns_past_the_window_are_folded_into_the_summary(
+    session_factory, monkeypatch
+):
+    client = FakeClient()
+    monkeypatch.setattr(history, "get_llm_client", lambda: client)
+
+    async def go():
+        async with session_factory() as db:
+            conversation = await db.get(models.Conversation, 1)
+            kept, summarize_before = await history.load_history(db, conversation)
+        await history.update_summary(1, None, None, summarize_before)
+        async with session_factory() as db:
+            return kept, summarize_before, await db.get(models.Conversation, 1)
+
+    kept, summarize_before, conversation = asyncio.run(go())
+
+    # Every turn fits the budget, but only five are loaded
+    assert [turn["id"] for turn in kept] == [8, 9, 10, 11, 12]
+    assert summarize_before == 8
+    # Turns 1-7 are folded five at a time, oldest first
+    assert len(client.prompts) == 2
+    folded = "\n".join(client.prompts)
+    assert all(f"question {i}\n" in folded for i in range(1, 8))
+    assert "question 8" not in folded
+    assert "summary 1" in client.prompts[1]
+    assert conversation.summary == "summary 2"
+    assert conversation.summary_message_id == 7
+
+
+def test_nothing_to_fold_within_the_window(session_factory):
+    async def go():
+        async with session_factory() as db:
+            conversation = await db.get(models.Conversation, 1)
+            conversation.summary_message_id = 7
+            return await history.load_history(db, conversation)
+
+    kept, summarize_before = asyncio.run(go())
+
+    assert [turn["id"] for turn in kept] == [8, 9, 10, 11, 12]
+    assert summarize_before is None
@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime
+from functools import partial
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import models
+from database.db_engine import list_conversations, list_messages
+from database.user_cache import user_id_cache
+from utils.database import Base
+
+NOON = datetime(2026, 1, 1, 12, 0, 0)
+
+# SQLite stores CURRENT_TIMESTAMP defaults as "YYYY-MM-DD HH:MM:SS" and
+# SQLAlchemy-written datetimes with microseconds; mix both, with ties
+TIMESTAMPS = [
+    ("text", "2026-01-01 12:00:00"),
+    ("orm", NOON.replace(microsecond=500000)),
+    ("text", "2026-01-01 12:00:00"),
+    ("orm", NOON),
+    ("text", "2026-01-01 12:00:01"),
+    ("orm", datetime(2026, 1, 1, 11, 59, 59, 999000)),
+]
+# Oldest first: 11:59:59.999, then the three at 12:00:00 by id, then the rest
+CHRONOLOGICAL = [6, 1, 3, 4, 2, 5]
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Run coroutines against a fresh SQLite database with one conversation."""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'nara.db'}", poolclass=NullPool
+    )
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    def run(make_coroutine):
+        async def go():
+            async with session_factory() as db:
+                return await make_coroutine(db)
+
+        return asyncio.run(go())
+
+    async def setup(db):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        db.add(models.User(id=1, supabase_id="sup-1", email="a@example.com"))
+        db.add(models.Conversation(id=1, user_id=1))
+        await db.flush()
+        for i, (kind, timestamp) in enumerate(TIMESTAMPS, 1):
+            if kind == "orm":
+                db.add(models.Message(id=i, conversation_id=1, created_at=timestamp))
+                db.add(models.Conversation(id=i + 1, user_id=1, updated_at=timestamp))
+                await db.flush()
+            else:
+                params = {"id": i, "timestamp": timestamp}
+                await db.execute(
+                    text(
+                        "INSERT INTO messages (id, conversation_id, created_at) "
+                        "VALUES (:id, 1, :timestamp)"
+                    ),
+                    params,
+                )
+                await db.execute(
+                    text(
+                        "INSERT INTO conversations (id, user_id, updated_at) "
+                        "VALUES (:id + 1, 1, :timestamp)"
+                    ),
+                    params,
+                )
+        # Conversation 1 holds the messages; keep it out of the listing order
+        await db.execute(
+            text("UPDATE conversations SET updated_at = '2025-01-01' WHERE id = 1")
+        )
+        await db.commit()
+
+    user_id_cache._entries.clear()
+    run(setup)
+    yield run
+    user_id_cache._entries.clear()
+    asyncio.run(engine.dispose())
+
+
+def test_messages_page_through_ties_once_each(run):
+    pages, cursor = [], None
+    # Bounded, so pages that repeat rows fail rather than loop forever
+    for _ in range(len(TIMESTAMPS) + 1):
+        page, cursor = run(
+            partial(list_messages, conversation_id=1, limit=2, cursor=cursor)
+        )
+        pages.insert(0, [message["id"] for message in page])
+        if cursor is None:
+            break
+    else:
+        pytest.fail("pagination did not end")
+
+    assert [message_id for page in pages for message_id in page] == CHRONOLOGICAL
+    assert all(len(page) == 2 for page in pages)
+
+
+def test_messages_cursor_without_limit_returns_the_rest(run):
+    first, cursor = run(lambda db: list_messages(db, 1, 2))
+    rest, next_cursor = run(lambda db: list_messages(db, 1, None, cursor))
+
+    assert [message["id"] for message in rest + first] == CHRONOLOGICAL
+    assert next_cursor is None
+
+
+def test_conversations_page_through_ties_once_each(run):
+    listed, cursor = [], None
+    # Bounded, so pages that repeat rows fail rather than loop forever
+    for _ in range(len(TIMESTAMPS) + 1):
+        page, cursor = run(
+            partial(list_conversations, supabase_id="sup-1", limit=2, cursor=cursor)
+        )
+        listed += [conversation["id"] for conversation in page]
+        if cursor is None:
+            break
+    else:
+        pytest.fail("pagination did not end")
+
+    newest_first = [message_id + 1 for message_id in reversed(CHRONOLOGICAL)]
+    assert listed == newest_first + [1]
@@ -0,0 +1,124 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from services import routing
+from services.classifier import has_reference, primary_category
+from services.routing import (
+    DEFAULT_ROUTE,
+    LEGACY_ROUTE,
+    ROUTES,
+    ROUTING_LARGE_MODEL,
+    ROUTING_RULES,
+    ROUTING_SMALL_MODEL,
+)
+
+MESSAGES = [{"role": "user", "content": "What is dharma?"}]
+
+
+def _chain(route):
+    """The routes a failure on ``route`` falls back through, in order."""
+    chain = []
+    while route.fallback is not None:
+        route = ROUTES[route.fallback]
+        assert route not in chain, f"fallback cycle through {route.name}"
+        chain.append(route)
+    return chain
+
+
+def _rate_limited(model):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, request=request)
+    return openai.RateLimitError(
+        f"{model} is rate limited", response=response, body=None
+    )
+
+
+class FakeCompletions:
+    """chat.completions stand-in that rate-limits the given models."""
+
+    def __init__(self, failing_models):
+        self.failing_models = set(failing_models)
+        self.calls = []
+
+    async def create(self, model, **kwargs):
+        self.calls.append(model)
+        if model in self.failing_models:
+            raise _rate_limited(model)
+        return SimpleNamespace(model=model)
+
+
+def _client(failing_models):
+    completions = FakeCompletions(failing_models)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+@pytest.fixture(autouse=True)
+def no_scheduler(monkeypatch):
+    # Call the fake client directly rather than through retries and backoff
+    monkeypatch.setattr(routing, "llm_scheduler", None)
+
+
+@pytest.mark.parametrize("name", sorted(ROUTES))
+def test_fallback_chain_reaches_a_different_model(name):
+    route = ROUTES[name]
+    chain = _chain(route)
+    if chain:
+        assert chain[0].model != route.model
+    else:
+        # Routes without a fallback are only ever served as fallbacks
+        assert name not in {rule.route for rule in ROUTING_RULES}
+        assert name not in (DEFAULT_ROUTE, LEGACY_ROUTE)
+
+
+def test_large_model_failure_falls_back_to_small_model():
+    client, completions = _client({ROUTING_LARGE_MODEL})
+
+    completion, route = asyncio.run(
+        routing.create_completion(client, ROUTES["deep"], MESSAGES)
+    )
+
+    assert route.model == completion.model == ROUTING_SMALL_MODEL
+    assert route.max_tokens < ROUTES["deep"].max_tokens
+    assert completions.calls == [ROUTING_LARGE_MODEL, ROUTING_SMALL_MODEL]
+
+
+def test_failed_model_is_not_retried_further_down_the_chain():
+    client, completions = _client({ROUTING_SMALL_MODEL, ROUTING_LARGE_MODEL})
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(routing.create_completion(client, ROUTES["quick"], MESSAGES))
+
+    # quick (small) -> standard (large); compact is on the small model again
+    assert completions.calls == [ROUTING_SMALL_MODEL, ROUTING_LARGE_MODEL]
+
+
+@pytest.mark.parametrize(
+    "question, route",
+    [
+        # Short philosophical questions aren't quick ones
+        ("What is the nature of atman?", "standard"),
+        ("What is the meaning of life?", "standard"),
+        # Translation only when there is a verse or a term to translate
+        ("What does Bhagavad Gita 2.47 mean?", "translation"),
+        ('Translate "tat tvam asi" word by word', "translation"),
+        ("What is the meaning of karma?", "translation"),
+        ("What is puja?", "quick"),
+    ],
+)
+def test_select_route(monkeypatch, question, route):
+    monkeypatch.setattr(routing, "ROUTING_ENABLED", True)
+    category = primary_category(question)
+
+    assert routing.select_route(category, question, turns=0).name == route
+
+
+def test_meaning_without_a_reference_is_not_a_translation(monkeypatch):
+    monkeypatch.setattr(routing, "ROUTING_ENABLED", True)
+    question = "What is the meaning of suffering in my life right now?"
+
+    assert not has_reference(question)
+    assert routing.select_route("translation", question, turns=0).name != "translation"
@@ -0,0 +1,73 @@
+from services.scheduler import LLMScheduler, ModelLimiter
+
+
+def _finish(limiter, latency, completion_tokens=None, kind=None, stream=False):
+    limiter.in_flight += 1
+    limiter.release(
+        100,
+        latency=latency,
+        stream=stream,
+        completion_tokens=completion_tokens,
+        kind=kind,
+    )
+
+
+def test_long_answers_at_a_normal_pace_are_not_overload():
+    limiter = ModelLimiter("gpt-4o", initial_limit=16)
+    for _ in range(10):
+        _finish(limiter, 2.0, completion_tokens=100)
+    limit = limiter.limit
+
+    # Ten times the latency, but for ten times the answer
+    _finish(limiter, 20.0, completion_tokens=1000)
+
+    assert limiter.limit > limit
+
+
+def test_slow_generation_cuts_the_limit():
+    limiter = ModelLimiter("gpt-4o", initial_limit=16)
+    for _ in range(10):
+        _finish(limiter, 2.0, completion_tokens=100)
+    limit = limiter.limit
+
+    _finish(limiter, 20.0, completion_tokens=100)
+
+    assert limiter.limit == limit / 2
+
+
+def test_each_kind_of_call_has_its_own_typical_latency():
+    limiter = ModelLimiter("gpt-4o", initial_limit=16)
+    for _ in range(10):
+        _finish(limiter, 0.5, stream=True, kind="standard")
+    limit = limiter.limit
+
+    # Deep answers take longer to start; the first one sets their baseline
+    _finish(limiter, 3.0, stream=True, kind="deep")
+    _finish(limiter, 3.0, stream=True, kind="deep")
+
+    assert limiter.limit > limit
+
+
+def test_initial_limit_follows_the_rate_limit():
+    # 600 requests a minute of 10 second calls keep 100 in flight
+    assert ModelLimiter("gpt-4o", rpm=600).limit == 100
+    assert ModelLimiter("gpt-4o", rpm=600, max_limit=64).limit == 64
+    assert ModelLimiter("gpt-4o").limit == 16
+
+
+def test_limit_doubles_per_window_until_the_first_overload():
+    limiter = ModelLimiter("gpt-4o", initial_limit=4)
+    for _ in range(4):
+        _finish(limiter, 1.0, stream=True)
+    assert limiter.limit == 8
+
+    limiter.release(100, overloaded=True)
+    _finish(limiter, 1.0, stream=True)
+    assert limiter.limit == 4 + 1 / 4
+
+
+def test_scheduler_limits_apply_to_every_model():
+    scheduler = LLMScheduler(initial_limit=64, max_limit=64)
+
+    assert scheduler.limiter("gpt-4o").limit == 64
+    assert scheduler.limiter("gpt-4o-mini").max_limit == 64
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database.db_engine import store_message, upsert_user
+from database.user_cache import user_id_cache
+from utils.database import Base
+
+
+@pytest.fixture
+def write_path(tmp_path):
+    """Run coroutines against a fresh SQLite database, recording each statement."""
+    statements = []
+    # Every run() has its own event loop, so don't keep connections between them
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'nara.db'}", poolclass=NullPool
+    )
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    def run(make_coroutine):
+        async def go():
+            async with session_factory() as db:
+                return await make_coroutine(db)
+
+        return asyncio.run(go())
+
+    asyncio.run(setup())
+    statements.clear()
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    user_id_cache._entries.clear()
+    yield run, statements
+    user_id_cache._entries.clear()
+    asyncio.run(engine.dispose())
+
+
+def _save(conversation_id, question):
+    """A store_message call for user sup-1, to pass to run()."""
+    return lambda db: store_message(
+        db, conversation_id, question, "An answer.", "sup-1", "a@example.com"
+    )
+
+
+def _verbs(statements):
+    return [statement.split()[0].upper() for statement in statements]
+
+
+def _touches_users(statement):
+    return " users" in statement.lower()
+
+
+def test_first_turn_save_is_three_inserts(write_path):
+    run, statements = write_path
+
+    conversation_id, message_id = run(_save(None, "What is dharma?"))
+
+    assert conversation_id is not None and message_id is not None
+    # User upsert, conversation, message; no SELECTs and no refreshes
+    assert _verbs(statements) == ["INSERT", "INSERT", "INSERT"]
+
+
+def test_follow_up_save_is_one_insert(write_path):
+    run, statements = write_path
+    conversation_id, _ = run(_save(None, "What is dharma?"))
+    statements.clear()
+
+    _, message_id = run(_save(conversation_id, "And karma?"))
+
+    assert message_id is not None
+    assert _verbs(statements) == ["INSERT"]
+    assert "messages" in statements[0].lower()
+
+
+def test_second_save_for_same_user_skips_users_table(write_path):
+    run, statements = write_path
+    run(_save(None, "What is dharma?"))
+    statements.clear()
+
+    run(_save(None, "What is moksha?"))
+
+    assert _verbs(statements) == ["INSERT", "INSERT"]
+    assert not any(_touches_users(statement) for statement in statements)
+
+
+def test_upsert_user_is_one_statement_then_cached(write_path):
+    run, statements = write_path
+
+    async def upsert_and_commit(db):
+        db_user_id = await upsert_user(db, "sup-2", "b@example.com")
+        await db.commit()
+        await user_id_cache.set("sup-2", db_user_id)
+        return db_user_id
+
+    db_user_id = run(upsert_and_commit)
+    assert len(statements) == 1 and _touches_users(statements[0])
+    statements.clear()
+
+    assert run(lambda db: upsert_user(db, "sup-2", "b@example.com")) == db_user_id
+    assert statements == []
@@ -0,0 +1,231 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import event, insert, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import models, write_queue
+from database.write_queue import MessageWriteQueue
+from utils.database import Base
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A SQLite database for the queue to write to.
+
+    Inserting a message whose text is "reject" violates a constraint, and
+    setting ``outage["after"]`` to n makes every statement after the next n
+    fail as if the database had gone away.
+    """
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'nara.db'}", poolclass=NullPool
+    )
+    outage = {"after": None}
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def fail_during_outage(conn, cursor, statement, parameters, context, executemany):
+        if outage["after"] is not None:
+            if outage["after"] == 0:
+                raise ConnectionError("database went away")
+            outage["after"] -= 1
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(
+                text(
+                    "CREATE TRIGGER reject BEFORE INSERT ON messages "
+                    "WHEN NEW.user_message = 'reject' "
+                    "BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+                )
+            )
+
+    asyncio.run(setup())
+    monkeypatch.setattr(write_queue, "AsyncSessionLocal", async_sessionmaker(engine))
+    yield engine, outage
+    asyncio.run(engine.dispose())
+
+
+def _stored(engine):
+    async def go():
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(models.Message.user_message).order_by(models.Message.id)
+            )
+            return [row[0] for row in result]
+
+    return asyncio.run(go())
+
+
+def _row(question):
+    return {
+        "conversation_id": 1,
+        "user_message": question,
+        "assistant_message": "answer",
+        "route": None,
+        "created_at": "2026-01-01T00:00:00+00:00",
+    }
+
+
+def _spooled(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["user_message"] for line in f]
+
+
+def test_partial_write_spools_only_unwritten_rows(database, tmp_path):
+    engine, outage = database
+    queue = MessageWriteQueue(spool_path=str(tmp_path / "spool.jsonl"))
+    rows = [_row("one"), _row("reject"), _row("two"), _row("three")]
+
+    async def go():
+        await queue.start()
+        # The multi-row INSERT is rejected; then "one" is committed, "reject"
+        # dropped, and the database goes away before "two"
+        outage["after"] = 3
+        for row in rows:
+            await queue.enqueue(1, row["user_message"], "answer")
+        await queue.close()
+
+    asyncio.run(go())
+    outage["after"] = None
+
+    assert _stored(engine) == ["one"]
+    assert _spooled(queue.spool_path) == ["two", "three"]
+
+
+def test_replay_moves_truncated_lines_aside(database, tmp_path):
+    engine, _ = database
+    spool_path = tmp_path / "spool.jsonl"
+    with open(spool_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_row("one")) + "\n")
+        f.write(json.dumps(_row("two")) + "\n")
+        # A crash mid-append leaves half a line
+        f.write(json.dumps(_row("three"))[:25])
+    queue = MessageWriteQueue(spool_path=str(spool_path))
+
+    async def go():
+        await queue.start()
+        await queue.close()
+
+    asyncio.run(go())
+
+    assert _stored(engine) == ["one", "two"]
+    assert not spool_path.exists()
+    assert not (tmp_path / "spool.jsonl.replay").exists()
+    with open(tmp_path / "spool.jsonl.bad", encoding="utf-8") as f:
+        assert f.read() == json.dumps(_row("three"))[:25] + "\n"
+
+
+def test_replay_keeps_unwritten_rows_on_failure(database, tmp_path):
+    engine, outage = database
+    spool_path = tmp_path / "spool.jsonl"
+    with open(spool_path, "w", encoding="utf-8") as f:
+        for question in ("one", "two", "three"):
+            f.write(json.dumps(_row(question)) + "\n")
+    queue = MessageWriteQueue(batch_size=1, spool_path=str(spool_path))
+    queue._spool_lock = asyncio.Lock()
+
+    outage["after"] = 1
+    asyncio.run(queue.replay_spool())
+    outage["after"] = None
+    assert _stored(engine) == ["one"]
+    assert _spooled(tmp_path / "spool.jsonl.replay") == ["two", "three"]
+
+    asyncio.run(queue.replay_spool())
+    assert _stored(engine) == ["one", "two", "three"]
+
+
+def test_replay_skips_spool_locked_by_another_worker(database, tmp_path):
+    engine, _ = database
+    spool_path = tmp_path / "spool.jsonl"
+    with open(spool_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_row("one")) + "\n")
+    worker = MessageWriteQueue(spool_path=str(spool_path))
+    other_worker = MessageWriteQueue(spool_path=str(spool_path))
+    other_worker._spool_lock = asyncio.Lock()
+
+    held = worker._lock_spool_file()
+    try:
+        asyncio.run(other_worker.replay_spool())
+    finally:
+        held.close()
+
+    assert _stored(engine) == []
+    assert spool_path.exists()
+
+
+def test_writer_survives_failed_idle_replay(database, tmp_path, monkeypatch):
+    engine, _ = database
+    monkeypatch.setattr(write_queue, "MESSAGE_SPOOL_RETRY_INTERVAL", 0.01)
+    queue = MessageWriteQueue(spool_path=str(tmp_path / "spool.jsonl"))
+    replays = []
+
+    async def failing_replay():
+        replays.append(1)
+        if len(replays) > 1:
+            raise OSError("disk unavailable")
+
+    monkeypatch.setattr(queue, "replay_spool", failing_replay)
+
+    async def replayed_after_failure():
+        while len(replays) < 3:
+            await asyncio.sleep(0.01)
+
+    async def go():
+        await queue.start()
+        await asyncio.wait_for(replayed_after_failure(), 5)
+        await queue.enqueue(1, "after the failure", "answer")
+        await queue.wait_for(1)
+        await queue.close()
+
+    asyncio.run(go())
+
+    assert _stored(engine) == ["after the failure"]
+
+
+def test_second_process_cannot_run_the_queue(database, tmp_path):
+    spool_path = str(tmp_path / "spool.jsonl")
+    worker = MessageWriteQueue(spool_path=spool_path)
+    other_worker = MessageWriteQueue(spool_path=spool_path)
+
+    async def go():
+        await worker.start()
+        # Its queued messages would be invisible to history reads here
+        with pytest.raises(RuntimeError, match="MESSAGE_QUEUE_ENABLED"):
+            await other_worker.start()
+        await worker.close()
+        # Released on shutdown, so a restarted worker can take over
+        await other_worker.start()
+        await other_worker.close()
+
+    asyncio.run(go())
+
+
+def test_queued_and_direct_writes_share_one_clock(database, tmp_path):
+    engine, _ = database
+    queue = MessageWriteQueue(spool_path=str(tmp_path / "spool.jsonl"))
+
+    async def go():
+        async with write_queue.AsyncSessionLocal() as db:
+            await db.execute(
+                insert(models.Message).values(conversation_id=1, user_message="first")
+            )
+            await db.commit()
+        await queue.start()
+        await queue.enqueue(1, "second", "answer")
+        await queue.close()
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text("SELECT user_message, created_at FROM messages ORDER BY id")
+            )
+            return result.all()
+
+    rows = asyncio.run(go())
+
+    # Both stamped by the app: SQLAlchemy writes "YYYY-MM-DD HH:MM:SS.ffffff",
+    # where the database's CURRENT_TIMESTAMP would have no fraction
+    assert [row.user_message for row in rows] == ["first", "second"]
+    assert all(len(row.created_at) == 26 for row in rows)
+    assert rows[0].created_at <= rows[1].created_at
@@ -1,24 +1,238 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-import os
+import threading
+import time
+from typing import Dict, Optional
+from uuid import uuid4
+
 from dotenv import load_dotenv
+from pydantic import model_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+from utils.metrics import count_statement
 
 load_dotenv()
 
-# PostgreSQL database URL
-SQLALCHEMY_DATABASE_URL: str = f"postgresql://{os.getenv('PG_USER')}:{os.getenv('PG_PASSWORD')}@{os.getenv('PG_HOST')}:{os.getenv('PG_PORT')}/{os.getenv('PG_DATABASE')}"
+# Defaults for each DB_PROFILE; any DB_* variable set explicitly wins
+PROFILE_DEFAULTS = {
+    "development": {"echo": True, "pool_size": 5, "max_overflow": 10},
+    "production": {"echo": False, "pool_size": 20, "max_overflow": 20},
+}
 
-# Create engine with appropriate settings for PostgreSQL
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_pre_ping=True,  # Enable connection health checks
-    pool_size=5,  # Set connection pool size
-    max_overflow=10,  # Maximum number of connections that can be created beyond pool_size
-    echo=True,  # Set to False in production
-)
+
+class DatabaseSettings(BaseSettings):
+    """Database connection and pool settings, read from the environment / .env."""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    pg_user: Optional[str] = None
+    pg_password: Optional[str] = None
+    pg_host: Optional[str] = None
+    pg_port: Optional[str] = None
+    pg_database: Optional[str] = None
+    # Full URLs override the PG_* parts (e.g. sqlite:///local.db for local runs)
+    database_url: Optional[str] = None
+    async_database_url: Optional[str] = None
+
+    db_profile: str = "development"
+    db_echo: Optional[bool] = None
+    db_pool_size: Optional[int] = None
+    db_max_overflow: Optional[int] = None
+    db_pool_recycle: int = 1800  # Seconds before a pooled connection is replaced
+    db_pool_timeout: float = 30  # Seconds to wait for a pooled connection
+    db_connect_timeout: float = 10
+    # Supabase's transaction pooler (PgBouncer) can't use prepared statements
+    db_pgbouncer: bool = False
+    # Let the pooler own pooling entirely instead of keeping our own pool
+    db_null_pool: bool = False
+
+    @model_validator(mode="after")
+    def apply_profile(self):
+        if self.db_profile not in PROFILE_DEFAULTS:
+            raise ValueError(f"Unknown DB_PROFILE: {self.db_profile}")
+        defaults = PROFILE_DEFAULTS[self.db_profile]
+        if self.db_echo is None:
+            self.db_echo = defaults["echo"]
+        if self.db_pool_size is None:
+            self.db_pool_size = defaults["pool_size"]
+        if self.db_max_overflow is None:
+            self.db_max_overflow = defaults["max_overflow"]
+        return self
+
+    @property
+    def sync_url(self) -> str:
+        if self.database_url:
+            return self.database_url
+        return f"postgresql://{self.pg_user}:{self.pg_password}@{self.pg_host}:{self.pg_port}/{self.pg_database}"
+
+    @property
+    def async_url(self) -> str:
+        if self.async_database_url:
+            return self.async_database_url
+        url = self.sync_url
+        if url.startswith("sqlite://"):
+            return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+class PoolMetrics:
+    """Counters for connection checkouts and the time spent waiting for them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_created = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "connections_created": self.connections_created,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+
+class InstrumentedPoolMixin:
+    """Times how long each checkout waits for a free connection."""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _instrument(sync_engine, metrics: PoolMetrics) -> None:
+    sync_engine.pool.metrics = metrics
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connections_created += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with metrics._lock:
+            metrics.checkouts += 1
+            metrics.checked_out += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.checked_out -= 1
+
+
+def _engine_kwargs(settings: DatabaseSettings, url: str, queue_pool) -> Dict:
+    kwargs = {"echo": settings.db_echo}
+    if url.startswith("sqlite"):
+        return kwargs
+
+    kwargs["pool_pre_ping"] = True  # Enable connection health checks
+    if settings.db_null_pool:
+        kwargs["poolclass"] = NullPool
+    else:
+        kwargs.update(
+            poolclass=queue_pool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_recycle=settings.db_pool_recycle,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    return kwargs
+
+
+def create_db_engine(settings: DatabaseSettings):
+    """Create the synchronous engine described by ``settings``."""
+    url = settings.sync_url
+    kwargs = _engine_kwargs(settings, url, InstrumentedQueuePool)
+    if not url.startswith("sqlite"):
+        kwargs["connect_args"] = {"connect_timeout": int(settings.db_connect_timeout)}
+        if settings.db_pgbouncer and make_url(url).get_driver_name() == "psycopg":
+            # psycopg 3 prepares repeated statements server-side by default
+            kwargs["connect_args"]["prepare_threshold"] = None
+    sync_engine = create_engine(url, **kwargs)
+    event.listen(sync_engine, "before_cursor_execute", count_statement)
+    if kwargs.get("poolclass") is InstrumentedQueuePool:
+        _instrument(sync_engine, PoolMetrics())
+    return sync_engine
+
+
+def create_async_db_engine(settings: DatabaseSettings):
+    """Create the asyncpg engine used on the request path."""
+    url = settings.async_url
+    kwargs = _engine_kwargs(settings, url, InstrumentedAsyncQueuePool)
+    if not url.startswith("sqlite"):
+        kwargs["connect_args"] = {"timeout": settings.db_connect_timeout}
+        if settings.db_pgbouncer:
+            # Transaction pooling hands each transaction a different server
+            # connection, so named prepared statements can't be reused
+            kwargs["connect_args"].update(
+                statement_cache_size=0,
+                prepared_statement_cache_size=0,
+                prepared_statement_name_func=lambda: f"__asyncpg_{uuid4()}__",
+            )
+    async_engine = create_async_engine(url, **kwargs)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    if kwargs.get("poolclass") is InstrumentedAsyncQueuePool:
+        _instrument(async_engine.sync_engine, PoolMetrics())
+    return async_engine
+
+
+def pool_status(db_engine) -> Dict:
+    """Current pool usage and checkout/wait counters for an engine."""
+    sync_engine = getattr(db_engine, "sync_engine", db_engine)
+    pool = sync_engine.pool
+    metrics = getattr(pool, "metrics", None)
+    if metrics is None:
+        return {"pool": type(pool).__name__}
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+        **metrics.snapshot(),
+    }
+
+
+db_settings = DatabaseSettings()
+
+# Kept for scripts and migrations that build their own connections
+SQLALCHEMY_DATABASE_URL: str = db_settings.sync_url
+ASYNC_SQLALCHEMY_DATABASE_URL: str = db_settings.async_url
+
+engine = create_db_engine(db_settings)
+
+# Async engine so request handlers never block the event loop on database I/O
+async_engine = create_async_db_engine(db_settings)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
 
 
@@ -28,3 +242,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
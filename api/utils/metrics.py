@@ -0,0 +1,231 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+load_dotenv()
+
+# With several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR at an empty
+# directory shared by them (set before start-up) and every worker's metrics are
+# aggregated on scrape
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+# Bearer token required to read /api/metrics; open when unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Latency buckets from 1 ms to 2 minutes, covering both database stages and
+# long completions
+_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    20,
+    40,
+    60,
+    120,
+)
+
+REQUEST_SECONDS = Histogram(
+    "nara_http_request_seconds",
+    "HTTP request latency, until the last byte of the response",
+    ["endpoint", "status"],
+    buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "nara_stage_seconds",
+    "Time spent in each stage of answering a question",
+    ["stage"],
+    buckets=_BUCKETS,
+)
+LLM_SECONDS = Histogram(
+    "nara_llm_seconds",
+    "Completion latency per model: time to first token and total",
+    ["model", "phase"],
+    buckets=_BUCKETS,
+)
+LLM_QUEUE_SECONDS = Histogram(
+    "nara_llm_queue_seconds",
+    "Time completion calls waited in the LLM scheduler",
+    ["model"],
+    buckets=_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "nara_llm_tokens",
+    "Tokens used per model and type (prompt, cached_prompt, completion)",
+    ["model", "type"],
+)
+CACHE_REQUESTS = Counter(
+    "nara_cache_requests",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+
+# Sampled from process state; summed across live workers
+SCHEDULER_STATE = Gauge(
+    "nara_llm_scheduler",
+    "LLM scheduler concurrency limit, calls in flight and calls queued per model",
+    ["model", "state"],
+    multiprocess_mode="livesum",
+)
+DB_POOL = Gauge(
+    "nara_db_pool_connections",
+    "Database pool size, checked-in, checked-out and overflow connections",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+DB_STATEMENTS = Counter(
+    "nara_db_statements",
+    "SQL statements executed, by the endpoint that issued them",
+    ["endpoint"],
+)
+DB_POOL_CHECKOUTS = Counter(
+    "nara_db_pool_checkouts", "Connections checked out of the pool"
+)
+DB_POOL_WAIT_SECONDS = Counter(
+    "nara_db_pool_wait_seconds", "Total time spent waiting for a pooled connection"
+)
+
+_stages = {}
+_last_pool_counts: Dict[str, float] = {}
+# ASGI scope of the request being handled; routing fills in its endpoint
+_request_scope: ContextVar[Optional[Dict]] = ContextVar("request_scope", default=None)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    # Cache the labelled child; labels() takes a lock and builds a key each call
+    child = _stages.get(stage)
+    if child is None:
+        child = _stages[stage] = STAGE_SECONDS.labels(stage)
+    child.observe(seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time the enclosed block as ``stage`` in nara_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(model: str, usage: Optional[Dict]) -> None:
+    """Count the tokens of a completion, as returned by usage_summary."""
+    if not usage:
+        return
+    LLM_TOKENS.labels(model, "prompt").inc(usage["prompt_tokens"])
+    LLM_TOKENS.labels(model, "cached_prompt").inc(usage["cached_prompt_tokens"])
+    LLM_TOKENS.labels(model, "completion").inc(usage["completion_tokens"])
+
+
+def record_cache(cache: str, result: str) -> None:
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def _endpoint_name(scope: Optional[Dict]) -> str:
+    if scope is None:
+        return "background"
+    return getattr(scope.get("endpoint"), "__name__", "unmatched")
+
+
+def count_statement(*args) -> None:
+    """SQLAlchemy before_cursor_execute listener counting statements per endpoint."""
+    DB_STATEMENTS.labels(_endpoint_name(_request_scope.get())).inc()
+
+
+def refresh_gauges(
+    pool: Optional[Dict] = None, limiters: Optional[Dict] = None
+) -> None:
+    """Copy the pool and scheduler state into their gauges.
+
+    Called after each question and on scrape, so in multiprocess mode every
+    worker's latest state is part of the sum.
+    """
+    if pool and "size" in pool:
+        DB_POOL.labels("size").set(pool["size"])
+        DB_POOL.labels("checked_in").set(pool["checked_in"])
+        DB_POOL.labels("checked_out").set(pool["checked_out"])
+        DB_POOL.labels("overflow").set(pool["overflow"])
+        # The pool keeps running totals; add what is new since the last refresh
+        for counter, key in (
+            (DB_POOL_CHECKOUTS, "checkouts"),
+            (DB_POOL_WAIT_SECONDS, "wait_seconds_total"),
+        ):
+            delta = pool[key] - _last_pool_counts.get(key, 0)
+            if delta > 0:
+                counter.inc(delta)
+            _last_pool_counts[key] = pool[key]
+
+    for model, limiter in (limiters or {}).items():
+        SCHEDULER_STATE.labels(model, "limit").set(limiter.limit)
+        SCHEDULER_STATE.labels(model, "in_flight").set(limiter.in_flight)
+        SCHEDULER_STATE.labels(model, "queued").set(limiter.queued)
+
+
+def render() -> Tuple[bytes, str]:
+    """Metrics in the Prometheus text format, with their content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges on shutdown."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every request until its response has been sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        _request_scope.set(scope)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by endpoint function rather than path, so ids in the URL
+            # don't create a series per conversation
+            REQUEST_SECONDS.labels(_endpoint_name(scope), str(status)).observe(
+                time.perf_counter() - start
+            )
@@ -12,6 +12,9 @@ import DeleteModal from './components/DeleteModal';
 import { apiGet, apiPost, apiPut, apiDelete, debugTokenStatus } from './utils/apiClient';
 
 const BACKEND_URL = process.env.REACT_APP_API_URL || "http://localhost:8000";
+// Page size for the conversation and message lists; the API returns the
+// cursor for the next page in the X-Next-Cursor header
+const PAGE_SIZE = 100;
 
 function App() {
   const [user, setUser] = useState(null);
@@ -27,7 +30,11 @@ function App() {
   const [isSidebarOpen, setIsSidebarOpen] = useState(false);
   const [showProfileDropdown, setShowProfileDropdown] = useState(false);
   const [isLoadingConversations, setIsLoadingConversations] = useState(false);
+  const [conversationsCursor, setConversationsCursor] = useState(null);
+  const [messagesCursor, setMessagesCursor] = useState(null);
+  const [isLoadingEarlierMessages, setIsLoadingEarlierMessages] = useState(false);
   const messagesEndRef = useRef(null);
+  const activeConversationIdRef = useRef(null);
   const [deleteModalOpen, setDeleteModalOpen] = useState(false);
   const [conversationToDelete, setConversationToDelete] = useState(null);
 
@@ -60,6 +67,7 @@ function App() {
 
   // Add this new useEffect to fetch messages when activeConversationId changes
   useEffect(() => {
+    activeConversationIdRef.current = activeConversationId;
     if (activeConversationId) {
       fetchConversationMessages(activeConversationId);
     } else {
@@ -88,10 +96,11 @@ function App() {
     try {
       setIsLoadingConversations(true);
       
-      const response = await apiGet('/api/conversations');
+      const response = await apiGet(`/api/conversations?limit=${PAGE_SIZE}`);
       const data = await response.json();
       
       setConversations(data);
+      setConversationsCursor(response.headers.get('X-Next-Cursor'));
       console.log('Conversations loaded:', data);
       
       // Set active conversation to the most recent one if none is selected
@@ -106,6 +115,27 @@ function App() {
     }
   };
 
+  const loadMoreConversations = async () => {
+    if (!conversationsCursor) return;
+    try {
+      setIsLoadingConversations(true);
+      const response = await apiGet(
+        `/api/conversations?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(conversationsCursor)}`
+      );
+      const data = await response.json();
+      setConversations(prev => {
+        const seen = new Set(prev.map(conv => conv.id));
+        return [...prev, ...data.filter(conv => !seen.has(conv.id))];
+      });
+      setConversationsCursor(response.headers.get('X-Next-Cursor'));
+    } catch (error) {
+      console.error('Error loading more conversations:', error);
+      setError(`Failed to load conversations: ${error.message}`);
+    } finally {
+      setIsLoadingConversations(false);
+    }
+  };
+
   const createNewConversation = async (question) => {
     try {
       const response = await apiPost('/api/createnewconversation', { 
@@ -261,12 +291,14 @@ function App() {
   const fetchConversationMessages = async (conversationId) => {
     if (!conversationId) {
       setMessages([]);
+      setMessagesCursor(null);
       return;
     }
 
     try {
-      const response = await apiGet(`/api/conversations/${conversationId}/messages`);
+      const response = await apiGet(`/api/conversations/${conversationId}/messages?limit=${PAGE_SIZE}`);
       const data = await response.json();
+      setMessagesCursor(response.headers.get('X-Next-Cursor'));
       
       console.log('Raw message data from API:', data);
       
@@ -287,6 +319,34 @@ function App() {
     }
   };
 
+  // Pages backwards: each page holds the messages before the ones already shown
+  const loadEarlierMessages = async () => {
+    if (!activeConversationId || !messagesCursor) return;
+    const conversationId = activeConversationId;
+    try {
+      setIsLoadingEarlierMessages(true);
+      const response = await apiGet(
+        `/api/conversations/${conversationId}/messages?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(messagesCursor)}`
+      );
+      const data = await response.json();
+      // Ignore the page if the user switched conversations meanwhile
+      if (conversationId !== activeConversationIdRef.current) return;
+      const earlierMessages = data.map(msg => ({
+        id: msg.id,
+        user: msg.user,
+        assistant: msg.assistant,
+        response_liked: msg.response_liked
+      }));
+      setMessages(prev => [...earlierMessages, ...prev]);
+      setMessagesCursor(response.headers.get('X-Next-Cursor'));
+    } catch (error) {
+      console.error('Error loading earlier messages:', error);
+      setError('Failed to load messages. Please try again.');
+    } finally {
+      setIsLoadingEarlierMessages(false);
+    }
+  };
+
   const toggleSidebar = () => {
     setIsSidebarOpen(!isSidebarOpen);
   };
@@ -380,6 +440,8 @@ function App() {
         onSelectConversation={setActiveConversationId}
         onDeleteConversation={handleDeleteClick}
         isLoading={isLoadingConversations}
+        hasMore={Boolean(conversationsCursor)}
+        onLoadMore={loadMoreConversations}
         isOpen={true}
         onAboutClick={() => setShowAbout(true)}
         onLogout={() => {}}
@@ -479,6 +541,15 @@ function App() {
           )}
 
           <div className="messages-container">
+            {messagesCursor && (
+              <button
+                className="load-more-button"
+                onClick={loadEarlierMessages}
+                disabled={isLoadingEarlierMessages}
+              >
+                {isLoadingEarlierMessages ? 'Loading...' : 'Load earlier messages'}
+              </button>
+            )}
             {messages.map((message, index) => (
               <Message
                 key={index}
@@ -9,6 +9,8 @@ const Sidebar = ({
   onSelectConversation, 
   onDeleteConversation, 
   isLoading,
+  hasMore,
+  onLoadMore,
   onAboutClick,
   onLogout,
   user
@@ -134,6 +136,11 @@ const Sidebar = ({
             ))}
           </>
         )}
+        {hasMore && (
+          <button className="load-more-button" onClick={onLoadMore} disabled={isLoading}>
+            {isLoading ? 'Loading...' : 'Load more'}
+          </button>
+        )}
       </div>
     </div>
   );